@@ -2,10 +2,32 @@ import os
 import re
 import sys
 import time
+import zlib
+import errno
+import queue
+import random
 import json  # Добавили для работы с настройками
+import select
+import shutil
+import hmac
+import hashlib
+import secrets
+import sqlite3
+import threading
+import tempfile
+import argparse
+import contextlib
 import subprocess
 import importlib
+import heapq
+import urllib.error
+import urllib.parse
+import urllib.request
+from io import BytesIO, StringIO
+from stat import S_ISDIR
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # ==========================================
 # КОНСТАНТЫ ОФОРМЛЕНИЯ И НАСТРОЕК
@@ -20,6 +42,48 @@ CONFIG_FILE = os.path.join(script_dir, "config.json")
 SORTING_SHEET_FILE = os.path.join(script_dir, "Sorting sheet.xlsx")
 REQUIREMENTS_FILE = os.path.join(script_dir, "requirements.txt")
 
+# Кэш готовых файлов: повторный запрос того же комплекта отдается без склейки
+CACHE_DIR = os.path.join(script_dir, "Cache")
+OUTPUT_CACHE_DIR = os.path.join(CACHE_DIR, "Outputs")
+OUTPUT_CACHE_MAX_BYTES = 5 * 1024 ** 3  # 5 ГБ, старые записи удаляются первыми
+# Кэш сегментов: заранее склеенные пары GTD + Invoice одной папки (сценарий 3)
+SEGMENT_CACHE_DIR = os.path.join(CACHE_DIR, "Segments")
+SEGMENT_CACHE_MAX_BYTES = 5 * 1024 ** 3
+# Сведения о входных файлах (страницы, хэш, шифрование, ошибки чтения)
+METADATA_DB_FILE = os.path.join(CACHE_DIR, "metadata.sqlite3")
+# Список файлов, исключенных из склейки как битые
+QUARANTINE_FILE = os.path.join(CACHE_DIR, "quarantine.json")
+# Части (шарды) склейки больших комплектов; остаются после сбоя как контрольная точка
+SHARDS_DIR = os.path.join(CACHE_DIR, "Shards")
+CHECKPOINT_MAX_AGE_SECONDS = 7 * 24 * 3600  # Контрольные точки старше недели удаляются
+
+# Настройки по умолчанию (любую можно переопределить одноименным ключом в config.json)
+DEFAULT_SETTINGS = {
+    "quarantine_broken": False,  # Пропускать битые файлы (с записью в карантин) вместо отмены склейки
+    "workers": None,  # Число процессов для параллельных этапов (None - по числу ядер)
+    "parallel_min_files": 200,  # С какого числа файлов склейка делится на части по процессам
+    "engine": "pypdf2",  # Движок склейки: pypdf2, raw (прямой перенос объектов) или pikepdf
+    "dedup_resources": False,  # Движок raw: хранить одинаковые шрифты/картинки/профили один раз
+    "object_streams": False,  # Движки raw и pikepdf: сжатые объектные потоки и поток xref (PDF 1.5)
+    "compression_level": 6,  # Уровень сжатия zlib для объектных потоков и потока xref (1-9)
+    "dedup_inputs": True,  # Папки отгрузок: побайтно одинаковые входные файлы скреплять только один раз
+    "volume_max_mb": 0,  # Делить результат на тома не больше N МБ (0 - без ограничения)
+    "volume_max_pages": 0,  # Делить результат на тома не больше N страниц (0 - без ограничения)
+    "volume_limits": {},  # Свои ограничения для сценария: {"inv_spec": {"max_mb": 20, "max_pages": 0}}
+    "outline": True,  # Закладки в готовом файле: папка -> документы (ДТ, Invoice, ЭСД)
+    "service_port": 8765,  # Порт службы склейки на 127.0.0.1 (python BindingPDF.py --serve)
+    "service_workers": 2,  # Сколько заданий служба выполняет одновременно
+    "watch_debounce_seconds": 5,  # Наблюдение за Temp: скреплять, когда файлы не менялись столько секунд
+    "watch_poll_seconds": 2,  # Наблюдение за Temp без inotify: как часто перечитывать папку
+    "write_buffer_kb": 1024,  # Буфер записи готовых файлов, КБ (benchmarks/bench_write.py)
+    "fsync_outputs": False,  # Сбрасывать готовый файл на диск перед переименованием в итоговое имя
+    "checkpoint_files": 500,  # Больших комплектов: не больше N файлов в части (контрольной точке)
+    "io_timeout_seconds": 60,  # Чтение папок и входных PDF: ждать ответа не дольше N секунд на операцию или часть файла в 8 МБ (0 - без ограничения)
+    "io_retries": 3,  # Сколько раз повторять чтение после кратковременного сбоя сети
+    "io_retry_delay_seconds": 1,  # Пауза перед первым повтором; каждая следующая вдвое длиннее
+    "io_slow_seconds": 10,  # Операции дольше N секунд попадают в сводку медленных
+}
+
 # ==========================================
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ (Утилиты)
 # ==========================================
@@ -29,6 +93,75 @@ def print_error(message):
     print(f"❗️ {message}")
 
 
+class JobCancelled(BaseException):
+    """
+    Задание службы склейки отменено. Как и KeyboardInterrupt, не перехватывается
+    обработчиками "except Exception", чтобы отмена не выглядела ошибкой файла.
+    """
+
+
+_running_job = threading.local()  # Задание службы, которое выполняется в этом потоке
+
+
+def check_cancelled():
+    """Прерывает задание, выполняющееся в этом потоке, если его отменили. Вне службы ничего не делает."""
+    job = getattr(_running_job, "job", None)
+    if job is not None and job.cancel_requested:
+        raise JobCancelled()
+
+
+@contextlib.contextmanager
+def locked_file(path):
+    """
+    Открывает (создает) файл на чтение и запись и держит на нем исключительную блокировку.
+    Блокировка действует между процессами, в том числе на сетевой папке; потоки одного
+    процесса нужно разделять отдельно.
+    """
+    with open(path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # Сама ждет ~10 с, затем ошибка
+                    break
+                except OSError:
+                    pass
+        else:
+            import fcntl
+            fcntl.lockf(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield f
+        finally:
+            if os.name == 'nt':
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.lockf(f.fileno(), fcntl.LOCK_UN)
+
+
+def report_progress(done, total):
+    """Сообщает ход склейки (файлов сделано из всего) заданию этого потока и проверяет отмену."""
+    job = getattr(_running_job, "job", None)
+    if job is not None:
+        job.progress = (done, total)
+    check_cancelled()
+
+
+class CancellableWriter:
+    """Поток записи, который между порциями данных проверяет отмену задания."""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, data):
+        check_cancelled()
+        return self._stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
 def ensure_dependencies():
     """Проверяет зависимости и при необходимости ставит их из requirements.txt."""
     required_modules = ("PyPDF2", "openpyxl")
@@ -79,7 +212,20 @@ if not ensure_dependencies():
     input()
     sys.exit(1)
 
-from PyPDF2 import PdfMerger
+from PyPDF2 import PdfMerger, PdfReader
+from PyPDF2.errors import PdfReadError
+from PyPDF2.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+    StreamObject,
+    TextStringObject,
+)
 
 
 def load_config():
@@ -95,11 +241,10 @@ def load_config():
 
 
 def save_config(source_path, save_path):
-    """Сохраняет пути в JSON файл."""
-    data = {
-        "source_path": source_path,
-        "save_path": save_path
-    }
+    """Сохраняет пути в JSON файл (остальные настройки в файле не трогаются)."""
+    data = load_config() or {}
+    data["source_path"] = source_path
+    data["save_path"] = save_path
     try:
         with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=4)
@@ -108,6 +253,50 @@ def save_config(source_path, save_path):
         print_error(f"Не удалось сохранить настройки: {e}")
 
 
+_job_settings = threading.local()  # Снимок config.json задания, которое выполняет этот поток
+
+
+def current_settings():
+    """Настройки задания, выполняемого в этом потоке; вне задания - config.json, прочитанный заново."""
+    config = getattr(_job_settings, "config", None)
+    return (load_config() or {}) if config is None else config
+
+
+def use_settings(config):
+    """Делает config настройками этого потока (и процессов склейки, которым он передан при запуске)."""
+    _job_settings.config = config
+
+
+@contextlib.contextmanager
+def job_settings():
+    """
+    config.json читается один раз на задание: get_setting внутри берет значения из снимка.
+    Правка конфига во время склейки действует со следующего задания, а ошибка в конфиге
+    печатается один раз. Вложенное задание пользуется снимком внешнего.
+    """
+    previous = getattr(_job_settings, "config", None)
+    use_settings(current_settings())
+    try:
+        yield
+    finally:
+        use_settings(previous)
+
+
+def get_setting(name):
+    """Возвращает настройку из config.json (снимка задания) или значение по умолчанию."""
+    return current_settings().get(name, DEFAULT_SETTINGS[name])
+
+
+def create_process_pool(workers):
+    """
+    Пул процессов склейки и индексации с настройками текущего задания.
+    Процессы - копии текущего (fork на Linux): так они стартуют за миллисекунды, а не заново
+    импортируют программу. Общие объекты, которые копия не должна унаследовать на полпути
+    (кэш метаданных с соединением SQLite, индекс папок), защищены обработчиками fork ниже.
+    """
+    return ProcessPoolExecutor(max_workers=workers, initializer=use_settings, initargs=(current_settings(),))
+
+
 def get_clean_path(prompt_text, allow_menu_codes=False):
     """
     Запрашивает путь.
@@ -182,20 +371,519 @@ def generate_range_string(processed_numbers):
     return ';'.join(range_parts)
 
 
-def save_merged_pdf(merger, save_path, file_name):
-    """Сохраняет PDF и обрабатывает ошибки."""
+def get_manifest_path(pdf_path):
+    """Путь к описи готового файла: "<имя>.manifest.json" рядом с PDF."""
+    return os.path.splitext(pdf_path)[0] + ".manifest.json"
+
+
+def write_atomically(path, write, buffer_kb=None, fsync=None):
+    """
+    Записывает файл через временный файл рядом с ним и переименование: при сбое или Ctrl+C
+    под итоговым именем не остается недописанного файла, а читатель видит либо старый файл,
+    либо новый целиком. write(stream) пишет содержимое в двоичный поток. Поток буферизуется
+    блоками write_buffer_kb (меньше мелких записей по сети); при fsync_outputs данные
+    сбрасываются на диск до переименования. buffer_kb и fsync заменяют настройки (для замеров).
+    """
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    buffer_kb = get_setting("write_buffer_kb") if buffer_kb is None else buffer_kb
+    fsync = get_setting("fsync_outputs") if fsync is None else fsync
+    try:
+        with open(tmp_path, 'wb', buffering=buffer_kb * 1024) as f_out:
+            write(f_out)
+            if fsync:
+                f_out.flush()
+                os.fsync(f_out.fileno())
+        # Переименование поверх жесткой ссылки на запись кэша не трогает саму запись.
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if fsync and os.name != 'nt':
+        # Переименование тоже должно пережить сбой питания: сбрасываем запись каталога.
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def write_manifest(pdf_path, manifest):
+    """Записывает опись готового файла рядом с ним (ошибка записи не мешает склейке)."""
+    try:
+        data = json.dumps(manifest, ensure_ascii=False, indent=4).encode("utf-8")
+        write_atomically(get_manifest_path(pdf_path), lambda f_out: f_out.write(data))
+    except (OSError, TypeError, ValueError) as e:
+        print_error(f"Не удалось сохранить опись файла: {e}")
+
+
+def save_merged_pdf(merger, save_path, file_name, manifest=None):
+    """
+    Сохраняет PDF и обрабатывает ошибки. Возвращает True при успехе.
+    manifest - опись входных файлов с диапазонами страниц, сохраняется рядом с PDF.
+    """
     full_path = os.path.join(save_path, file_name)
     try:
         if not os.path.exists(save_path):
             os.makedirs(save_path)
 
         print(f"Сохранение: {file_name} ...")
-        with open(full_path, 'wb') as f_out:
-            merger.write(f_out)
+        write_atomically(full_path, lambda f_out: merger.write(CancellableWriter(f_out)))
         merger.close()
+        if manifest is not None:
+            write_manifest(full_path, manifest)
         print(f"✅ Готово!")
+        return True
     except Exception as e:
         print_error(f"Ошибка при сохранении: {e}")
+        return False
+
+
+# ==========================================
+# УСТОЙЧИВОЕ ЧТЕНИЕ (сетевые папки)
+# ==========================================
+# Чтение каталогов и входных PDF идет через call_with_retry: операция выполняется в отдельном
+# потоке и ждется не дольше io_timeout_seconds, а кратковременные сбои (обрыв SMB, занятый файл)
+# повторяются с растущей паузой. Короткий обрыв сети не прерывает длинную склейку,
+# а зависшее чтение не блокирует ее навсегда.
+
+# Коды ошибок, после которых чтение имеет смысл повторить.
+TRANSIENT_ERRNOS = {getattr(errno, name) for name in (
+    "EAGAIN", "EBUSY", "EINTR", "EIO", "ETIMEDOUT", "ECONNABORTED", "ECONNREFUSED", "ECONNRESET",
+    "EHOSTDOWN", "EHOSTUNREACH", "ENETDOWN", "ENETRESET", "ENETUNREACH", "ENOLINK", "EREMOTEIO", "ESTALE",
+) if hasattr(errno, name)}
+# Windows: файл занят (32, 33), сетевой путь не найден (53), сетевая ошибка (59),
+# сетевое имя больше недоступно (64), превышен таймаут семафора (121).
+TRANSIENT_WINERRORS = {32, 33, 53, 59, 64, 121}
+
+
+class IOTimeoutError(TimeoutError):
+    """Операция чтения не завершилась за io_timeout_seconds."""
+
+
+def is_transient_io_error(error):
+    """Сбой, который может пройти сам (сеть, занятый файл, таймаут), а не ошибка вроде "файл не найден"."""
+    return (isinstance(error, TimeoutError) or error.errno in TRANSIENT_ERRNOS
+            or getattr(error, "winerror", None) in TRANSIENT_WINERRORS)
+
+
+class IOWorkers:
+    """
+    Потоки-демоны для операций с ограничением времени. Поток, на котором операция зависла,
+    бросается (прервать системный вызов нельзя), вместо него при следующем вызове запускается новый.
+    Потоки живут между вызовами: запуск нового потока на каждый stat заметно дороже.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # Процесс, созданный через fork (процессы склейки и индексации), потоков родителя не получает.
+        self._tasks = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._idle = 0
+
+    def _work(self):
+        while True:
+            function, args, outcome, finished = self._tasks.get()
+            try:
+                outcome["result"] = function(*args)
+            except BaseException as e:
+                outcome["error"] = e
+            finished.set()
+            with self._lock:
+                self._idle += 1
+
+    def call(self, path, function, args, timeout):
+        """function(*args) в отдельном потоке; IOTimeoutError, если ответа нет дольше timeout секунд."""
+        with self._lock:
+            if self._idle:
+                self._idle -= 1
+            else:
+                threading.Thread(target=self._work, name="io", daemon=True).start()
+        outcome = {}
+        finished = threading.Event()
+        self._tasks.put((function, args, outcome, finished))
+
+        deadline = time.monotonic() + timeout
+        while not finished.wait(min(0.5, max(0.0, deadline - time.monotonic()))):
+            check_cancelled()
+            if time.monotonic() >= deadline:
+                raise IOTimeoutError(errno.ETIMEDOUT, f"нет ответа дольше {timeout} с", path)
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome["result"]
+
+
+_io_workers = IOWorkers()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_io_workers.reset)
+_io_events = threading.local()  # Повторы и медленные операции, накопленные в этом потоке
+
+
+def record_io_event(path, text):
+    events = getattr(_io_events, "events", None)
+    if events is None:
+        events = _io_events.events = []
+    events.append((path, text))
+
+
+def take_io_events():
+    """Забирает повторы и медленные операции, накопленные в этом потоке: список (путь, описание)."""
+    events = getattr(_io_events, "events", None) or []
+    _io_events.events = []
+    return events
+
+
+def print_io_report(events):
+    """Сводка по медленным и повторенным операциям (печатается в конце склейки, если они были)."""
+    if not events:
+        return
+    paths = {path for path, _ in events}
+    print(f"⚠️  Папки отвечали с задержками или сбоями: {len(paths)} файлов и папок.")
+    for path, text in events[:20]:
+        print(f"   {path}: {text}")
+    if len(events) > 20:
+        print(f"   ... и еще {len(events) - 20}")
+
+
+def call_with_retry(path, function, *args):
+    """
+    Выполняет чтение function(*args) файла или папки path с ограничением io_timeout_seconds.
+    Кратковременный сбой (см. is_transient_io_error) повторяется до io_retries раз с паузой
+    io_retry_delay_seconds, затем вдвое длиннее и т.д.; другие ошибки и последняя неудача
+    передаются дальше как есть. Повторы и операции дольше io_slow_seconds попадают в сводку
+    (take_io_events). Операция должна быть повторяемой: зависший вызов продолжает работать в фоне.
+    """
+    timeout = get_setting("io_timeout_seconds")
+    attempt = 0
+    while True:
+        started = time.monotonic()
+        try:
+            if timeout:
+                result = _io_workers.call(path, function, args, timeout)
+            else:
+                result = function(*args)
+        except OSError as e:
+            retries = get_setting("io_retries")
+            if attempt >= retries or not is_transient_io_error(e):
+                raise
+            attempt += 1
+            # Пауза с небольшим разбросом, чтобы процессы склейки не повторяли чтение одновременно.
+            delay = get_setting("io_retry_delay_seconds") * 2 ** (attempt - 1) * random.uniform(0.8, 1.2)
+            print(f"⚠️  {path}: {e.strerror or e}. Повтор {attempt} из {retries} через {delay:.1f} с ...")
+            record_io_event(path, f"повтор {attempt}: {e.strerror or e}")
+            resume_at = time.monotonic() + delay
+            while time.monotonic() < resume_at:
+                check_cancelled()
+                time.sleep(min(0.5, max(0.0, resume_at - time.monotonic())))
+            continue
+
+        elapsed = time.monotonic() - started
+        if elapsed >= get_setting("io_slow_seconds"):
+            record_io_event(path, f"медленно: {elapsed:.1f} с")
+        return result
+
+
+# Большой файл читается частями по IO_CHUNK_SIZE, и io_timeout_seconds ограничивает каждую часть, а не
+# весь файл: медленная, но живая сеть не упирается в таймаут на файле в сотни МБ, а повтор после сбоя
+# перечитывает одну часть. Брошенный по таймауту поток при этом дочитывает не больше одной части.
+IO_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def read_file_head(path):
+    """(os.stat_result, первая часть содержимого) - одной операцией для call_with_retry."""
+    with open(path, 'rb') as f_in:
+        return os.fstat(f_in.fileno()), f_in.read(IO_CHUNK_SIZE)
+
+
+def read_file_chunk(path, offset):
+    """Часть содержимого с позиции offset. Файл открывается заново: после обрыва сети старый дескриптор бесполезен."""
+    with open(path, 'rb') as f_in:
+        f_in.seek(offset)
+        return f_in.read(IO_CHUNK_SIZE)
+
+
+def read_file_with_stat(path):
+    """(os.stat_result, содержимое) файла, прочитанного частями через call_with_retry."""
+    stat, chunk = call_with_retry(path, read_file_head, path)
+    chunks = [chunk]
+    offset = len(chunk)
+    while len(chunk) == IO_CHUNK_SIZE:
+        chunk = call_with_retry(path, read_file_chunk, path, offset)
+        chunks.append(chunk)
+        offset += len(chunk)
+    return stat, b"".join(chunks)
+
+
+def read_input_pdf(pdf_path):
+    """
+    Входной PDF целиком в памяти (BytesIO, в .name - путь), прочитанный частями через call_with_retry.
+    Движок склейки затем работает с памятью и к папке больше не обращается: сбой или зависание
+    сети приходится на чтение, которое можно прервать и повторить, а не на середину append.
+    """
+    stream = BytesIO(read_file_with_stat(pdf_path)[1])
+    stream.name = pdf_path
+    return stream
+
+
+# ==========================================
+# ДВИЖКИ СКЛЕЙКИ PDF
+# ==========================================
+
+class PdfEngine:
+    """
+    Общий интерфейс движка склейки: open() -> append(путь)... -> [add_outline(закладки)] -> write(поток) -> close().
+    Подходит для save_merged_pdf так же, как PdfMerger. Вместо пути append принимает и поток
+    с именем файла в .name (read_input_pdf): так склеиваются файлы, прочитанные через call_with_retry.
+    Закладки - список (заголовок, номер страницы с нуля, вложенные закладки того же вида).
+    """
+    name = ""
+
+    def open(self):
+        return self
+
+    def append(self, pdf_path):
+        raise NotImplementedError
+
+    def add_outline(self, outline):
+        raise NotImplementedError
+
+    def write(self, out_stream):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class OutlinedPdfMerger(PdfMerger):
+    """
+    PdfMerger с готовыми закладками (extra_outline). PdfMerger переносит страницы в PdfWriter
+    только при write(), поэтому закладки добавляются сразу после переноса, вместе с собственными.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.extra_outline = []
+
+    def _write_outline(self, outline=None, parent=None):
+        super()._write_outline(outline, parent)
+        if outline is None:
+            self._write_extra_outline(self.extra_outline, None)
+
+    def _write_extra_outline(self, outline, parent):
+        for title, page_index, children in outline:
+            item = self.output.add_outline_item(title, page_index, parent)
+            self._write_extra_outline(children, item)
+
+
+class PyPdf2Engine(PdfEngine):
+    """Движок по умолчанию: PyPDF2.PdfMerger (чистый Python)."""
+    name = "pypdf2"
+
+    def open(self):
+        self.merger = OutlinedPdfMerger()
+        return self
+
+    def append(self, pdf_path):
+        self.merger.append(pdf_path)
+
+    def add_outline(self, outline):
+        self.merger.extra_outline.extend(outline)
+
+    def write(self, out_stream):
+        self.merger.write(out_stream)
+
+    def close(self):
+        self.merger.close()
+
+
+class PikePdfEngine(PdfEngine):
+    """Движок на pikepdf (qpdf, C++). Доступен, если установлен пакет pikepdf."""
+    name = "pikepdf"
+
+    @staticmethod
+    def is_available():
+        try:
+            importlib.import_module("pikepdf")
+        except ImportError:
+            return False
+        return True
+
+    def open(self):
+        import pikepdf
+        self.pikepdf = pikepdf
+        self.pdf = pikepdf.Pdf.new()
+        self.sources = []  # Исходники должны оставаться открытыми до записи
+        return self
+
+    def append(self, pdf_path):
+        source = self.pikepdf.Pdf.open(pdf_path)
+        self.sources.append(source)
+        self.pdf.pages.extend(source.pages)
+
+    def add_outline(self, outline):
+        def make_items(entries):
+            items = []
+            for title, page_index, children in entries:
+                item = self.pikepdf.OutlineItem(title, page_index)
+                item.children.extend(make_items(children))
+                items.append(item)
+            return items
+
+        with self.pdf.open_outline() as pdf_outline:
+            pdf_outline.root.extend(make_items(outline))
+
+    def write(self, out_stream):
+        if get_setting("object_streams"):
+            self.pdf.save(out_stream, object_stream_mode=self.pikepdf.ObjectStreamMode.generate,
+                          compress_streams=True)
+        else:
+            self.pdf.save(out_stream)
+
+    def close(self):
+        self.pdf.close()
+        for source in self.sources:
+            source.close()
+        self.sources = []
+
+
+PDF_ENGINES = {
+    PyPdf2Engine.name: PyPdf2Engine,
+    PikePdfEngine.name: PikePdfEngine,
+}
+
+
+def create_pdf_engine(name=None, **options):
+    """Создает и открывает движок склейки по имени (по умолчанию - из настройки "engine")."""
+    name = name or get_setting("engine")
+    engine_class = PDF_ENGINES.get(name)
+    if engine_class is None:
+        print_error(f"Неизвестный движок склейки \"{name}\", используется {PyPdf2Engine.name}.")
+        return PyPdf2Engine().open()
+    elif engine_class is PikePdfEngine and not PikePdfEngine.is_available():
+        print_error("Модуль pikepdf не установлен, используется PyPDF2. Установите: pip install pikepdf")
+        return PyPdf2Engine().open()
+    return engine_class(**options).open()
+
+
+# ==========================================
+# КЭШ ГОТОВЫХ ФАЙЛОВ
+# ==========================================
+
+# Настройки, от которых зависят байты результата: при их изменении кэш не должен отдавать старый файл.
+OUTPUT_SETTINGS = ("engine", "outline", "object_streams", "dedup_resources", "compression_level")
+
+
+def get_output_cache_key(scenario, pdf_paths):
+    """
+    Ключ кэша готовых файлов, сегментов и частей: сценарий, настройки вида результата (OUTPUT_SETTINGS)
+    и упорядоченный список (путь, размер, mtime) входных файлов.
+    """
+    key_hash = hashlib.sha256(scenario.encode("utf-8"))
+    key_hash.update(json.dumps([get_setting(name) for name in OUTPUT_SETTINGS]).encode("utf-8"))
+    try:
+        for pdf in pdf_paths:
+            stat = os.stat(pdf)
+            entry = [os.path.abspath(pdf), stat.st_size, stat.st_mtime_ns]
+            key_hash.update(json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+    except OSError:
+        return None
+    return key_hash.hexdigest()
+
+
+def link_or_copy_file(src, dst):
+    """Создает dst как жесткую ссылку на src, а если это невозможно - как копию."""
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return  # Уже та же запись (rename поверх ссылки на тот же файл ничего бы не сделал)
+    tmp_path = f"{dst}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        # Другой диск, сетевая папка без поддержки ссылок и т.п.
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+def restore_cached_output(cache_key, save_path, file_name, make_manifest=None):
+    """
+    Отдает готовый файл из кэша. Возвращает True, если запись найдена.
+    make_manifest - функция, которая строит опись файла; вызывается только при попадании в кэш,
+    чтобы при промахе не читать метаданные всех входных файлов зря.
+    """
+    cache_path = os.path.join(OUTPUT_CACHE_DIR, f"{cache_key}.pdf")
+    if not os.path.isfile(cache_path):
+        return False
+    try:
+        if not os.path.exists(save_path):
+            os.makedirs(save_path)
+        link_or_copy_file(cache_path, os.path.join(save_path, file_name))
+        os.utime(cache_path)  # Отмечаем использование для вытеснения старых записей
+    except OSError as e:
+        print_error(f"Не удалось взять файл из кэша: {e}")
+        return False
+    if make_manifest is not None:
+        write_manifest(os.path.join(save_path, file_name), make_manifest())
+    print(f"Сохранение: {file_name} ...")
+    print("✅ Готово! (взято из кэша, входные файлы не изменились)")
+    return True
+
+
+def store_output_in_cache(cache_key, output_path):
+    """Помещает готовый файл в кэш и удаляет самые старые записи сверх лимита."""
+    try:
+        os.makedirs(OUTPUT_CACHE_DIR, exist_ok=True)
+        link_or_copy_file(output_path, os.path.join(OUTPUT_CACHE_DIR, f"{cache_key}.pdf"))
+        prune_cache_dir(OUTPUT_CACHE_DIR, OUTPUT_CACHE_MAX_BYTES)
+    except OSError as e:
+        # Кэш - только ускорение, его ошибки не должны мешать основной работе.
+        print_error(f"Не удалось сохранить файл в кэш: {e}")
+
+
+def prune_cache_dir(cache_dir, max_bytes):
+    """Удаляет самые давно использованные записи кэша, пока он больше лимита."""
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".pdf"):
+            continue
+        stat = os.stat(os.path.join(cache_dir, name))
+        entries.append((stat.st_mtime, stat.st_size, name))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total_size <= max_bytes:
+            break
+        os.remove(os.path.join(cache_dir, name))
+        total_size -= size
+
+
+def get_segment_path(segment_files):
+    """
+    Возвращает путь к сегменту - заранее склеенной группе файлов (например, GTD + Invoice одной папки).
+    Сегмент собирается один раз и переиспользуется, пока не изменится ни один из его файлов.
+    """
+    segment_key = get_output_cache_key("segment", segment_files)
+    if segment_key is None:
+        raise FileNotFoundError(f"Не найден один из файлов: {', '.join(segment_files)}")
+
+    segment_path = os.path.join(SEGMENT_CACHE_DIR, f"{segment_key}.pdf")
+    if os.path.isfile(segment_path):
+        os.utime(segment_path)
+        return segment_path
+
+    os.makedirs(SEGMENT_CACHE_DIR, exist_ok=True)
+    # Сегмент - промежуточный файл: переносится прямым копированием объектов (raw), а документ,
+    # который так не перенести, движок сам склеивает через PyPDF2.
+    merger = RawPdfEngine().open()
+    for pdf in segment_files:
+        merger.append(read_input_pdf(pdf))
+    write_atomically(segment_path, merger.write)
+    merger.close()
+    return segment_path
 
 
 def normalize_gtd_number(value):
@@ -271,11 +959,23 @@ def get_release_date_sort_key(value):
     return (1, value_text)
 
 
+_release_dates_cache = None  # (путь, размер, mtime) файла -> словарь номер ДТ -> дата выпуска
+
+
 def load_release_dates_from_sorting_sheet():
-    """Читает Sorting sheet.xlsx и возвращает словарь: номер ДТ -> дата выпуска."""
-    if not os.path.exists(SORTING_SHEET_FILE):
+    """
+    Читает Sorting sheet.xlsx и возвращает словарь: номер ДТ -> дата выпуска.
+    Прочитанная таблица хранится в памяти, пока файл не изменится.
+    """
+    global _release_dates_cache
+    try:
+        sheet_stat = os.stat(SORTING_SHEET_FILE)
+    except OSError:
         print_error('Файл "Sorting sheet.xlsx" не найден рядом со скриптом.')
         return None
+    signature = (SORTING_SHEET_FILE, sheet_stat.st_size, sheet_stat.st_mtime_ns)
+    if _release_dates_cache is not None and _release_dates_cache[0] == signature:
+        return _release_dates_cache[1]
 
     try:
         from openpyxl import load_workbook
@@ -321,6 +1021,7 @@ def load_release_dates_from_sorting_sheet():
             print_error('В файле "Sorting sheet.xlsx" не найдено номеров ДТ в колонке C.')
             return None
 
+        _release_dates_cache = (signature, release_dates)
         return release_dates
     except Exception as e:
         print_error(f'Ошибка чтения файла "Sorting sheet.xlsx": {e}')
@@ -331,241 +1032,2081 @@ def load_release_dates_from_sorting_sheet():
 
 
 # ==========================================
-# ЛОГИКА 1: BindingInvSpec (Инвойсы и Спецификации)
+# МЕТАДАННЫЕ ФАЙЛОВ (кэш SQLite)
 # ==========================================
-def process_inv_spec(source_path, save_path, valid_folders):
-    print("\n[Выполняется: Инвойсы и Спецификации]")
-
-    def get_invoice_num(fname):
-        match = re.search(r'Invoice (\d+)', fname, re.IGNORECASE)
-        return int(match.group(1)) if match else float('inf')
-
-    all_invoice_pdfs = []
-    processed_folders = []
 
-    all_folders = sorted(os.listdir(source_path), key=get_number_from_string)
+def read_pdf_metadata(pdf_path):
+    """Собирает сведения о файле: размер, время изменения, хэш, число страниц, шифрование, ошибку чтения."""
+    metadata = {
+        "path": os.path.abspath(pdf_path),
+        "size": None,
+        "mtime_ns": None,
+        "sha256": None,
+        "pages": None,
+        "encrypted": False,
+        "error": None,
+    }
+    try:
+        # Файл читается один раз: из того же содержимого считаются хэш и страницы.
+        stat, data = read_file_with_stat(pdf_path)
+    except OSError as e:
+        metadata["error"] = f"файл недоступен: {e}"
+        return metadata
+
+    metadata["size"] = stat.st_size
+    metadata["mtime_ns"] = stat.st_mtime_ns
+    metadata["sha256"] = hashlib.sha256(data).hexdigest()
+    if b"%PDF-" not in data[:1024]:
+        metadata["error"] = "нет заголовка %PDF"
+        return metadata
 
-    for folder_name in all_folders:
-        folder_path = os.path.join(source_path, folder_name)
-        if not os.path.isdir(folder_path): continue
+    try:
+        reader = PdfReader(BytesIO(data))
+        if reader.is_encrypted:
+            # Часто пароль задан только на права (печать, правка), а открывается файл пустым паролем:
+            # такой файл PyPDF2 расшифровывает сам и склеивает как обычный.
+            try:
+                metadata["encrypted"] = not reader.decrypt("")
+            except Exception:
+                metadata["encrypted"] = True  # Шифр, который PyPDF2 без дополнительных пакетов не снимает
+        if not metadata["encrypted"]:
+            metadata["pages"] = len(reader.pages)
+    except Exception as e:
+        metadata["error"] = str(e) or e.__class__.__name__
+    return metadata
 
-        f_num = get_number_from_string(folder_name)
-        if f_num in valid_folders:
-            found_in_folder = False
-            for file_name in os.listdir(folder_path):
-                if "invoice" in file_name.lower() and file_name.lower().endswith(".pdf"):
-                    all_invoice_pdfs.append(os.path.join(folder_path, file_name))
-                    found_in_folder = True
 
-            if found_in_folder:
-                processed_folders.append(f_num)
+class FileMetadataCache:
+    """
+    Кэш сведений о PDF в SQLite. Запись действительна, пока у файла не изменились размер и mtime.
+    Заполняется лениво (get) и пачками в нескольких процессах (get_many, index_in_background).
+    Файл, который уже читает другой поток (например, фоновая индексация), не читается второй раз:
+    get_many дожидается его сведений.
+    """
 
-    if not all_invoice_pdfs:
-        print_error("Файлы Invoice не найдены.")
-        return
+    COLUMNS = ("path", "size", "mtime_ns", "sha256", "pages", "encrypted", "error")
+    # Версия записей: прежние версии считали зашифрованным и файл с паролем только на права.
+    SCHEMA_VERSION = 1
+    PARALLEL_MIN_FILES = 32  # С какого числа непроиндексированных файлов читать их в нескольких процессах
+
+    def __init__(self, db_path=METADATA_DB_FILE):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._memory = {}  # Уже прочитанные записи: в службе склейки повторные задания не ходят в SQLite
+        self._in_flight = {}  # Файлы, которые сейчас читает какой-то поток: путь -> threading.Event
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT, "
+                "pages INTEGER, encrypted INTEGER, error TEXT)"
+            )
+            if self._connection.execute("PRAGMA user_version").fetchone()[0] < self.SCHEMA_VERSION:
+                self._connection.execute("DELETE FROM files WHERE encrypted")
+                self._connection.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
 
-    all_invoice_pdfs.sort(key=lambda x: get_invoice_num(os.path.basename(x)))
+    def lookup(self, pdf_path):
+        """Возвращает сведения из кэша, если файл с тех пор не менялся, иначе None."""
+        path = os.path.abspath(pdf_path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            metadata = self._memory.get(path)
+            if metadata is None:
+                row = self._connection.execute(
+                    f"SELECT {', '.join(self.COLUMNS)} FROM files WHERE path = ?", (path,)
+                ).fetchone()
+                if row is None:
+                    return None
+                metadata = dict(zip(self.COLUMNS, row))
+                metadata["encrypted"] = bool(metadata["encrypted"])
+                self._memory[path] = metadata
+        if metadata["size"] != stat.st_size or metadata["mtime_ns"] != stat.st_mtime_ns:
+            return None
+        return dict(metadata)
+
+    def store(self, metadata_list):
+        # Недоступные файлы не запоминаем: их нужно проверить заново при следующем обращении.
+        metadata_list = [metadata for metadata in metadata_list if metadata["size"] is not None]
+        with self._lock, self._connection:
+            self._memory.update((metadata["path"], dict(metadata)) for metadata in metadata_list)
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO files ({', '.join(self.COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in self.COLUMNS)})",
+                [tuple(metadata[column] for column in self.COLUMNS) for metadata in metadata_list],
+            )
 
-    range_str = generate_range_string(processed_folders)
-    output_name = f"Inv. + Spec. {range_str} {len(all_invoice_pdfs)} pcs..pdf"
+    def get(self, pdf_path):
+        """Сведения о файле: из кэша или (при изменении файла) прочитанные заново."""
+        metadata = self.lookup(pdf_path)
+        if metadata is None:
+            metadata = read_pdf_metadata(pdf_path)
+            self.store([metadata])
+        return metadata
+
+    def _claim(self, pdf_paths):
+        """Делит файлы на те, что будет читать этот поток, и те, что уже читает другой: (пути, [(путь, событие)])."""
+        claimed, in_flight = [], []
+        with self._lock:
+            for pdf in pdf_paths:
+                event = self._in_flight.get(os.path.abspath(pdf))
+                if event is None:
+                    self._in_flight[os.path.abspath(pdf)] = threading.Event()
+                    claimed.append(pdf)
+                else:
+                    in_flight.append((pdf, event))
+        return claimed, in_flight
+
+    def _release(self, pdf_paths):
+        """Снимает отметку "читается" и будит потоки, которые ждут эти файлы."""
+        with self._lock:
+            events = [self._in_flight.pop(os.path.abspath(pdf), None) for pdf in pdf_paths]
+        for event in events:
+            if event is not None:
+                event.set()
+
+    def get_many(self, pdf_paths, workers=None):
+        """Сведения о наборе файлов; недостающие собираются параллельно. Возвращает словарь путь -> сведения."""
+        result = {}
+        missing = []
+        for pdf in pdf_paths:
+            metadata = self.lookup(pdf)
+            if metadata is None:
+                missing.append(pdf)
+            else:
+                result[pdf] = metadata
 
-    merger = PdfMerger()
-    for pdf in all_invoice_pdfs:
+        claimed, in_flight = self._claim(missing)
         try:
-            merger.append(pdf)
-        except Exception as e:
-            print_error(f"Ошибка с файлом {pdf}: {e}")
+            if 0 < len(claimed) < self.PARALLEL_MIN_FILES:
+                # Запуск процессов дороже, чем прочитать несколько файлов на месте.
+                for pdf in claimed:
+                    result[pdf] = read_pdf_metadata(pdf)
+                self.store([result[pdf] for pdf in claimed])
+            elif claimed:
+                with create_process_pool(workers) as executor:
+                    # Готовое сохраняется пачками: поток, ждущий часть этих файлов, продолжает раньше конца.
+                    batch = []
+                    for pdf, metadata in zip(claimed, executor.map(read_pdf_metadata, claimed, chunksize=8)):
+                        result[pdf] = metadata
+                        batch.append(pdf)
+                        if len(batch) >= self.PARALLEL_MIN_FILES:
+                            self.store([result[pdf] for pdf in batch])
+                            self._release(batch)
+                            batch = []
+                    self.store([result[pdf] for pdf in batch])
+        finally:
+            self._release(claimed)
+
+        for pdf, event in in_flight:
+            while not event.wait(0.5):
+                check_cancelled()
+            # Недоступный файл в кэш не попадает: тогда он читается здесь еще раз.
+            result[pdf] = self.get(pdf)
+        return result
+
+    def index_in_background(self, pdf_paths, workers=None):
+        """Заполняет кэш в фоновом потоке, не задерживая пользователя. Возвращает поток."""
+        config = current_settings()
+
+        def run():
+            use_settings(config)
+            try:
+                self.get_many(pdf_paths, workers)
+            except Exception:
+                pass  # Индексация - только ускорение, ошибки всплывут при самой склейке.
 
-    save_merged_pdf(merger, save_path, output_name)
+        thread = threading.Thread(target=run, name="metadata-indexer", daemon=True)
+        thread.start()
+        return thread
 
+    def count_pages(self, pdf_paths):
+        """Общее число страниц набора файлов (None, если какой-то файл не читается)."""
+        total = 0
+        for metadata in self.get_many(pdf_paths).values():
+            if metadata["pages"] is None:
+                return None
+            total += metadata["pages"]
+        return total
 
-# ==========================================
-# ЛОГИКА 2: BindingGTDESD (Декларации и ЭСД)
-# ==========================================
-def process_gtd_esd(source_path, save_path, valid_folders):
-    print("\n[Выполняется: Декларации и ЭСД]")
-    processed_folders = []
-    all_pdfs = []
-
-    all_folders = sorted(os.listdir(source_path), key=get_number_from_string)
-
-    for folder_name in all_folders:
-        folder_path = os.path.join(source_path, folder_name)
-        if not os.path.isdir(folder_path): continue
-
-        f_num = get_number_from_string(folder_name)
-        if f_num in valid_folders:
-            gtd_files = []
-            esd_files = []
-
-            for file_name in os.listdir(folder_path):
-                if not file_name.lower().endswith(".pdf"): continue
-                if file_name.startswith("GTD_"):
-                    gtd_files.append(os.path.join(folder_path, file_name))
-                elif file_name.count('-') == 4:
-                    esd_files.append(os.path.join(folder_path, file_name))
-
-            if gtd_files and esd_files:
-                processed_folders.append(f_num)
-                all_pdfs.extend(sorted(gtd_files)[:1])
-                all_pdfs.extend(sorted(esd_files)[:1])
-            else:
-                print_error(f"Папка {folder_name} пропущена: некомплект.")
 
-    if not all_pdfs:
-        print_error("Не найдено пар GTD+ESD.")
-        return
+_metadata_cache = None
+# Общие экземпляры создаются один раз, даже если первыми их запросили несколько потоков сразу
+# (фоновая индексация, потоки службы): иначе у каждого был бы свой кэш и свой список читаемых файлов.
+_shared_instances_lock = threading.Lock()
+
 
-    range_str = generate_range_string(processed_folders)
-    output_name = f"GTD+ЭСД {range_str} {len(processed_folders)} pcs..pdf"
+def get_metadata_cache():
+    """Общий для всей программы экземпляр кэша метаданных."""
+    global _metadata_cache
+    with _shared_instances_lock:
+        if _metadata_cache is None:
+            _metadata_cache = FileMetadataCache(METADATA_DB_FILE)
+        return _metadata_cache
 
-    merger = PdfMerger()
-    for pdf in all_pdfs:
-        merger.append(pdf)
 
-    save_merged_pdf(merger, save_path, output_name)
+def list_folder_pdfs(source_path, valid_folders):
+    """Все PDF в папках выбранного диапазона (для предварительной индексации)."""
+    pdf_paths = []
+    for _, folder_path, _, file_names in get_folder_index().scan_shipment_folders(source_path, valid_folders):
+        for file_name in file_names:
+            if file_name.lower().endswith(".pdf"):
+                pdf_paths.append(os.path.join(folder_path, file_name))
+    return pdf_paths
 
 
 # ==========================================
-# ЛОГИКА 3: BindingGTDInvSpec (GTD + Invoice + Spec)
+# ИНДЕКС ПАПОК ОТГРУЗОК (в памяти)
 # ==========================================
-def process_gtd_inv_spec(source_path, save_path, valid_folders):
-    print("\n[Выполняется: Декларации, Инвойсы и Спецификации]")
-    release_dates_by_gtd = load_release_dates_from_sorting_sheet()
-    if release_dates_by_gtd is None:
-        return
 
-    valid_pairs = []
-    processed_folders_set = set()
-    missing_gtd_numbers = []
+class FolderIndex:
+    """
+    Содержимое каталогов в памяти. Каталог перечитывается, только если изменилось его время
+    изменения (файл добавили, удалили или переименовали), поэтому повторный обход того же
+    дерева - один stat на папку вместо listdir. Важно для сетевых папок и службы склейки.
+    """
 
-    all_folders = sorted(os.listdir(source_path), key=get_number_from_string)
+    # Каталог, измененный меньше чем RACY_WINDOW_NS назад, не кэшируется: следующее изменение
+    # в пределах той же отметки времени (на SMB и FAT она грубая) не изменило бы mtime.
+    RACY_WINDOW_NS = 2 * 10 ** 9
 
-    for folder_name in all_folders:
-        folder_path = os.path.join(source_path, folder_name)
-        if not os.path.isdir(folder_path): continue
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listings = {}  # путь -> (mtime_ns, имена)
 
-        f_num = get_number_from_string(folder_name)
-        if f_num in valid_folders:
-            gtd_files = []
-            inv_files = []
+    def list_dir(self, path):
+        """Имена в каталоге (None, если это не каталог). Чтение с повтором при сбое сети (call_with_retry)."""
+        stat = call_with_retry(path, os.stat, path)
+        if not S_ISDIR(stat.st_mode):
+            return None
+        with self._lock:
+            cached = self._listings.get(path)
+        if cached is not None and cached[0] == stat.st_mtime_ns:
+            return cached[1]
+
+        names = call_with_retry(path, os.listdir, path)
+        if time.time_ns() - stat.st_mtime_ns > self.RACY_WINDOW_NS:
+            with self._lock:
+                self._listings[path] = (stat.st_mtime_ns, names)
+        return names
+
+    def scan_shipment_folders(self, source_path, valid_folders):
+        """
+        Папки выбранного диапазона по возрастанию номера:
+        список (имя папки, путь, номер, имена файлов).
+        """
+        folders = []
+        for folder_name in sorted(self.list_dir(source_path) or [], key=get_number_from_string):
+            f_num = get_number_from_string(folder_name)
+            if f_num not in valid_folders:
+                continue
+            folder_path = os.path.join(source_path, folder_name)
+            try:
+                file_names = self.list_dir(folder_path)
+            except FileNotFoundError:
+                continue  # Папку удалили между чтением корня и папки
+            if file_names is not None:
+                folders.append((folder_name, folder_path, f_num, file_names))
+        return folders
+
+    def warm_up(self, source_path):
+        """Читает корень и все папки отгрузок (для службы склейки при запуске)."""
+        for folder_name in self.list_dir(source_path) or []:
+            try:
+                self.list_dir(os.path.join(source_path, folder_name))
+            except OSError:
+                pass
 
-            for file_name in sorted(os.listdir(folder_path)):
-                lower_name = file_name.lower()
-                if not lower_name.endswith(".pdf"): continue
 
-                if lower_name.startswith("gtd_"):
-                    gtd_files.append(os.path.join(folder_path, file_name))
-                elif "invoice" in lower_name:
-                    inv_files.append(os.path.join(folder_path, file_name))
+_folder_index = None
 
-            gtd_path = gtd_files[0] if gtd_files else None
-            inv_path = inv_files[0] if inv_files else None
 
-            if gtd_path and inv_path:
-                normalized_gtd = normalize_gtd_number(os.path.basename(gtd_path))
-                release_entry = release_dates_by_gtd.get(normalized_gtd)
+def get_folder_index():
+    """Общий для всей программы индекс папок."""
+    global _folder_index
+    with _shared_instances_lock:
+        if _folder_index is None:
+            _folder_index = FolderIndex()
+        return _folder_index
 
-                if release_entry is None:
-                    missing_gtd_numbers.append(normalized_gtd or os.path.basename(gtd_path))
-                    continue
 
-                sort_key = (release_entry["release_key"], normalized_gtd)
-                valid_pairs.append({
-                    'sort_key': sort_key,
-                    'gtd': gtd_path,
-                    'inv': inv_path
-                })
-                processed_folders_set.add(f_num)
+# Процесс склейки или индексации - копия программы (fork), а другие потоки (служба, фоновая индексация)
+# в этот момент могут писать в SQLite или держать блокировки общих объектов. Перед fork эти блокировки
+# берутся, поэтому копия не застает объект на полпути, а в копии общие объекты создаются заново:
+# соединение SQLite родителя в ней не используется и не закрывается.
+_inherited_instances = []  # Объекты родителя в процессе-копии: удерживаются, чтобы не закрылись
 
-            elif gtd_path and not inv_path:
-                print_error(f"Папка {folder_name}: Найден GTD, но нет Invoice! (Пропущено)")
 
-            elif inv_path and not gtd_path:
-                print_error(f"Папка {folder_name}: Найден Invoice, но нет GTD! (Пропущено)")
+def _shared_instance_locks():
+    return [_shared_instances_lock] + [instance._lock for instance in (_metadata_cache, _folder_index)
+                                       if instance is not None]
 
-    if missing_gtd_numbers:
-        missing_list = ", ".join(sorted(set(missing_gtd_numbers)))
-        print_error(f'В файле "Sorting sheet.xlsx" отсутствуют номера ДТ: {missing_list}.')
-        print_error('Обновите файл "Sorting sheet.xlsx" и повторите запуск.')
-        return
 
-    if not valid_pairs:
-        print_error("Файлы для скрепления не найдены (или возникли ошибки комплектности).")
-        return
+def _before_fork():
+    global _fork_locks
+    _fork_locks = _shared_instance_locks()
+    for lock in _fork_locks:
+        lock.acquire()
 
-    valid_pairs.sort(key=lambda x: x["sort_key"])
 
-    files_to_merge = []
-    for pair in valid_pairs:
-        files_to_merge.append(pair['gtd'])
-        files_to_merge.append(pair['inv'])
+def _after_fork_in_parent():
+    for lock in reversed(_fork_locks):
+        lock.release()
 
-    range_str = generate_range_string(list(processed_folders_set))
-    output_name = f"GTD+Inv. + Spec. {range_str} {len(processed_folders_set)} pcs..pdf"
 
-    merger = PdfMerger()
-    for pdf in files_to_merge:
-        merger.append(pdf)
+def _after_fork_in_child():
+    global _metadata_cache, _folder_index, _shared_instances_lock
+    _inherited_instances.extend(instance for instance in (_metadata_cache, _folder_index) if instance is not None)
+    _metadata_cache = _folder_index = None
+    _shared_instances_lock = threading.Lock()
 
-    save_merged_pdf(merger, save_path, output_name)
+
+_fork_locks = []
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_before_fork, after_in_parent=_after_fork_in_parent,
+                        after_in_child=_after_fork_in_child)
 
 
 # ==========================================
-# ЛОГИКА 4: BindingGTD (Только Декларации)
+# ПЕРЕНОС ОБЪЕКТОВ PDF (без распаковки потоков)
 # ==========================================
-def process_gtd_only(source_path, save_path, valid_folders):
-    print("\n[Выполняется: Только Декларации (GTD)]")
-    processed_folders = []
-    all_pdfs = []
-
-    all_folders = sorted(os.listdir(source_path), key=get_number_from_string)
 
-    for folder_name in all_folders:
-        folder_path = os.path.join(source_path, folder_name)
-        if not os.path.isdir(folder_path): continue
-
-        f_num = get_number_from_string(folder_name)
-        if f_num in valid_folders:
-            gtd_files = []
-            for file_name in os.listdir(folder_path):
-                if file_name.lower().endswith(".pdf") and file_name.startswith("GTD_"):
-                    gtd_files.append(os.path.join(folder_path, file_name))
+class UnsupportedPdfError(Exception):
+    """Документ содержит конструкции, которые нельзя перенести напрямую."""
+
+
+def collect_page_tree_nodes(reader):
+    """Возвращает ключи (номер, поколение) всех промежуточных узлов /Pages документа."""
+    nodes = set()
+    pending = [reader.trailer["/Root"].raw_get("/Pages")]
+    while pending:
+        node_ref = pending.pop()
+        if not isinstance(node_ref, IndirectObject):
+            raise UnsupportedPdfError("узел дерева страниц не является косвенным объектом")
+        key = (node_ref.idnum, node_ref.generation)
+        node = node_ref.get_object()
+        if key in nodes or node.get("/Type") == "/Page":
+            continue
+        nodes.add(key)
+        pending.extend(node.get("/Kids", []))
+    return nodes
 
-            if gtd_files:
-                processed_folders.append(f_num)
-                all_pdfs.extend(sorted(gtd_files)[:1])
 
-    if not all_pdfs:
-        print_error("GTD файлы не найдены.")
+def check_pass_through_supported(reader, keep_navigation=False):
+    """
+    Проверяет, что документ можно перенести постранично без потерь (иначе UnsupportedPdfError).
+    keep_navigation=True - закладки и именованные ссылки переносит вызывающий (см. RawPdfEngine.append_part).
+    """
+    if reader.is_encrypted:
+        raise UnsupportedPdfError("документ зашифрован")
+    catalog = reader.trailer["/Root"]
+    # Закладки, формы и именованные ссылки живут в каталоге и при постраничном переносе потерялись бы.
+    if "/AcroForm" in catalog:
+        raise UnsupportedPdfError("в документе есть поля формы")
+    if keep_navigation:
         return
+    outlines = catalog.get("/Outlines")
+    if outlines is not None and "/First" in outlines.get_object():
+        raise UnsupportedPdfError("в документе есть закладки")
+    # Словарь /Names обычно косвенный объект: catalog[...] его разыменовывает, а catalog.get - нет.
+    if "/Dests" in catalog or "/Dests" in (catalog["/Names"] if "/Names" in catalog else {}):
+        raise UnsupportedPdfError("в документе есть именованные ссылки")
 
-    range_str = generate_range_string(processed_folders)
-    output_name = f"GTD {range_str} {len(processed_folders)} pcs..pdf"
 
-    merger = PdfMerger()
-    for pdf in all_pdfs:
-        merger.append(pdf)
+def read_pdf_outline(reader, items=None):
+    """
+    Закладки документа в виде (заголовок, номер страницы с нуля, вложенные закладки).
+    Закладки, которые не ведут на страницу этого документа, пропускаются вместе с вложенными.
+    """
+    outline = []
+    parent = None
+    for item in reader.outline if items is None else items:
+        if isinstance(item, list):
+            # Вложенный уровень идет в списке сразу за своей закладкой.
+            if parent is not None:
+                parent[2].extend(read_pdf_outline(reader, item))
+            continue
+        page_index = reader.get_destination_page_number(item)
+        parent = (str(item.title), page_index, []) if page_index is not None and page_index >= 0 else None
+        if parent is not None:
+            outline.append(parent)
+    return outline
 
-    save_merged_pdf(merger, save_path, output_name)
+
+def read_named_destinations(reader):
+    """
+    Именованные ссылки документа: список (имя, массив назначения [страница, вид, параметры...]).
+    Берутся и из словаря /Dests каталога (PDF 1.1), и из дерева имен /Names /Dests.
+    """
+    catalog = reader.trailer["/Root"]
+    destinations = []
+
+    def add(name, value):
+        value = value.get_object()
+        if isinstance(value, DictionaryObject):
+            value = value.get("/D", ArrayObject()).get_object()
+        if isinstance(value, ArrayObject) and value:
+            destinations.append((str(name), ArrayObject(item.get_object() if index else item
+                                                        for index, item in enumerate(value))))
+
+    if "/Dests" in catalog:
+        for name, value in catalog["/Dests"].get_object().items():
+            add(name[1:], value)
+    names = catalog["/Names"] if "/Names" in catalog else {}
+    pending = [names["/Dests"]] if "/Dests" in names else []
+    while pending:
+        node = pending.pop().get_object()
+        pending.extend(node.get("/Kids", []))
+        names = node.get("/Names", [])
+        for index in range(0, len(names) - 1, 2):
+            add(names[index].get_object(), names[index + 1])
+    return destinations
+
+
+class PdfObjectCopier:
+    """
+    Переносит страницы исходных PDF в выходной поток с перенумерацией объектов.
+    Потоки (содержимое страниц, шрифты, картинки) копируются байт в байт, без распаковки.
+    dedup=True - одинаковые потоки из разных документов записываются один раз и используются совместно.
+    object_stream_size > 0 - объекты, не являющиеся потоками, упаковываются пачками такого размера
+    в сжатые объектные потоки (тогда файл завершается потоком xref, см. write_xref_stream).
+    """
+
+    def __init__(self, out_stream, first_number, dedup=False, object_stream_size=0, compression_level=6):
+        self.out = out_stream
+        self.next_number = first_number
+        self.offsets = {}  # номер объекта -> (смещение в файле, поколение)
+        self.object_stream_size = object_stream_size
+        self.compression_level = compression_level
+        self.compressed = {}  # номер объекта -> (номер объектного потока, индекс в нем)
+        self._object_batch = []  # (номер, сериализованный объект), ждущие упаковки
+        self.stream_numbers = {} if dedup else None  # хэш потока -> номер записанного объекта
+        self.shared_streams = 0
+        self.bytes_saved = 0
+        self._digests = {}  # (номер, поколение) объекта текущего документа -> хэш содержимого
+
+    def reserve_number(self):
+        number = self.next_number
+        self.next_number += 1
+        return number
+
+    def write_object(self, number, obj, generation=0):
+        if self.object_stream_size and generation == 0 and not isinstance(obj, StreamObject):
+            buffer = BytesIO()
+            obj.write_to_stream(buffer, None)
+            self._object_batch.append((number, buffer.getvalue()))
+            if len(self._object_batch) >= self.object_stream_size:
+                self.flush_object_stream()
+            return
+        self.offsets[number] = (self.out.tell(), generation)
+        self.out.write(f"{number} {generation} obj\n".encode("ascii"))
+        obj.write_to_stream(self.out, None)
+        self.out.write(b"\nendobj\n")
+
+    def flush_object_stream(self):
+        """Упаковывает накопленные объекты в один сжатый объектный поток (/Type /ObjStm)."""
+        if not self._object_batch:
+            return
+        batch, self._object_batch = self._object_batch, []
+        stream_number = self.reserve_number()
+
+        header_parts = []
+        body = BytesIO()
+        for index, (number, data) in enumerate(batch):
+            header_parts.append(f"{number} {body.tell()}")
+            body.write(data)
+            body.write(b"\n")
+            self.compressed[number] = (stream_number, index)
+        header = " ".join(header_parts).encode("ascii") + b"\n"
+
+        object_stream = EncodedStreamObject()
+        object_stream._data = zlib.compress(header + body.getvalue(), self.compression_level)
+        object_stream[NameObject("/Type")] = NameObject("/ObjStm")
+        object_stream[NameObject("/N")] = NumberObject(len(batch))
+        object_stream[NameObject("/First")] = NumberObject(len(header))
+        object_stream[NameObject("/Filter")] = NameObject("/FlateDecode")
+        self.write_object(stream_number, object_stream)
+
+    def copy_document_pages(self, reader, parent_ref):
+        """Переносит все страницы документа под узел parent_ref. Возвращает ссылки на новые страницы."""
+        check_pass_through_supported(reader)
+        return self.copy_pages(reader, list(reader.pages), parent_ref)
+
+    def copy_pages(self, reader, pages, parent_ref):
+        """
+        Переносит указанные страницы документа (и все, на что они ссылаются) под узел parent_ref.
+        Остальные страницы не читаются. Возвращает ссылки на новые страницы.
+        """
+        id_map = {}
+        self._digests = {}
+        for page in pages:
+            if page.indirect_reference is None:
+                raise UnsupportedPdfError("страница не является косвенным объектом")
+            key = (page.indirect_reference.idnum, page.indirect_reference.generation)
+            id_map[key] = self.reserve_number()
+        # Ссылки на старые узлы /Pages (например, /Parent) ведут на новый родительский узел.
+        for key in collect_page_tree_nodes(reader):
+            id_map[key] = parent_ref.idnum
+
+        page_refs = []
+        for page in pages:
+            pending = []
+            page_number = id_map[(page.indirect_reference.idnum, page.indirect_reference.generation)]
+            new_page = DictionaryObject()
+            for key, value in page.items():
+                if key != "/Parent":
+                    new_page[key] = self._copy_value(value, id_map, pending)
+            new_page[NameObject("/Parent")] = parent_ref
+            self.write_object(page_number, new_page)
+            page_refs.append(IndirectObject(page_number, 0, None))
+
+            # Сразу дописываем все, на что ссылается страница: объекты одной страницы лежат рядом.
+            while pending:
+                (idnum, generation), number = pending.pop()
+                obj = reader.get_object(IndirectObject(idnum, generation, reader))
+                if obj is None:
+                    obj = NullObject()
+                self.write_object(number, self._copy_value(obj, id_map, pending))
+        return page_refs
+
+    def _copy_value(self, value, id_map, pending):
+        if isinstance(value, IndirectObject):
+            key = (value.idnum, value.generation)
+            number = id_map.get(key)
+            if number is None and self.stream_numbers is not None:
+                number = self._copy_shared_stream(value, id_map, pending)
+            if number is None:
+                number = self.reserve_number()
+                id_map[key] = number
+                pending.append((key, number))
+            return IndirectObject(number, 0, None)
+        if isinstance(value, StreamObject):
+            copied = EncodedStreamObject() if isinstance(value, EncodedStreamObject) else DecodedStreamObject()
+            copied._data = value._data
+        elif isinstance(value, DictionaryObject):
+            copied = DictionaryObject()
+        elif isinstance(value, ArrayObject):
+            return ArrayObject(self._copy_value(item, id_map, pending) for item in value)
+        else:
+            return value
+        for key, item in value.items():
+            copied[key] = self._copy_value(item, id_map, pending)
+        return copied
+
+    def _copy_shared_stream(self, ref, id_map, pending):
+        """
+        Если такой же поток уже записан, возвращает его номер и ничего не переносит: хэш считается
+        по содержимому потока и всего, на что он ссылается, еще до переноса ссылок. Поэтому
+        одинаковые ресурсы дают одинаковый хэш в любом документе, а у повтора в файл не попадают
+        ни сам поток, ни объекты, на которые он ссылается. Новый поток переносится сразу.
+        Возвращает номер объекта или None, если это не поток или его нельзя объединять.
+        """
+        obj = ref.get_object()
+        if not isinstance(obj, StreamObject):
+            return None
+        digest = self._content_digest(ref, set())
+        if digest is None:
+            return None
+
+        key = (ref.idnum, ref.generation)
+        number = self.stream_numbers.get(digest)
+        if number is not None:
+            self.shared_streams += 1
+            self.bytes_saved += len(obj._data)
+            id_map[key] = number
+            return number
+        number = self.reserve_number()
+        id_map[key] = number  # До переноса: ссылки потока на самого себя ведут на новый номер
+        self.write_object(number, self._copy_value(obj, id_map, pending))
+        self.stream_numbers[digest] = number
+        return number
+
+    def _content_digest(self, value, in_progress):
+        """
+        Хэш объекта по содержимому: ссылки заменяются хэшами объектов, на которые они ведут
+        (/Length потока не учитывается - он пишется заново). None - объект ссылается сам на себя
+        или на страницы документа, такие потоки переносятся без объединения.
+        """
+        hasher = hashlib.sha256()
+        if isinstance(value, IndirectObject):
+            key = (value.idnum, value.generation)
+            if key not in self._digests:
+                if key in in_progress:
+                    return None
+                in_progress.add(key)
+                self._digests[key] = self._content_digest(value.get_object(), in_progress)
+                in_progress.discard(key)
+            digest = self._digests[key]
+            return None if digest is None else b"R" + digest
+        if isinstance(value, DictionaryObject):
+            if value.get("/Type") in ("/Page", "/Pages"):
+                return None
+            hasher.update(b"<<")
+            for name in sorted(value):
+                if name == "/Length" and isinstance(value, StreamObject):
+                    continue
+                item_digest = self._content_digest(value.raw_get(name), in_progress)
+                if item_digest is None:
+                    return None
+                hasher.update(name.encode("utf-8") + b" " + item_digest)
+            hasher.update(b">>")
+            if isinstance(value, StreamObject):
+                hasher.update(b"stream" + value._data)
+        elif isinstance(value, ArrayObject):
+            hasher.update(b"[")
+            for item in value:
+                item_digest = self._content_digest(item, in_progress)
+                if item_digest is None:
+                    return None
+                hasher.update(item_digest)
+            hasher.update(b"]")
+        else:
+            buffer = BytesIO()
+            value.write_to_stream(buffer, None)
+            hasher.update(buffer.getvalue())
+        return hasher.digest()
+
+
+def write_xref_table(out_stream, offsets):
+    """Пишет классическую таблицу xref, группируя номера объектов в непрерывные подразделы."""
+    out_stream.write(b"xref\n")
+    # Объект 0 - голова списка свободных объектов, он всегда открывает таблицу.
+    offsets = dict(offsets)
+    offsets[0] = (0, 65535)
+    numbers = sorted(offsets)
+    start = 0
+    while start < len(numbers):
+        end = start
+        while end + 1 < len(numbers) and numbers[end + 1] == numbers[end] + 1:
+            end += 1
+        out_stream.write(f"{numbers[start]} {end - start + 1}\n".encode("ascii"))
+        for number in numbers[start:end + 1]:
+            offset, generation = offsets[number]
+            entry_type = "f" if number == 0 else "n"
+            out_stream.write(f"{offset:010d} {generation:05d} {entry_type} \n".encode("ascii"))
+        start = end + 1
+
+
+def write_xref_stream(copier, trailer_entries):
+    """
+    Завершает файл потоком перекрестных ссылок (PDF 1.5) вместо классической таблицы:
+    упаковывает оставшиеся объекты и пишет сжатый /Type /XRef с полями trailer.
+    Возвращает смещение потока xref (для startxref).
+    """
+    copier.flush_object_stream()
+    xref_number = copier.reserve_number()
+    xref_offset = copier.out.tell()
+
+    # Записи: тип 0 - свободный, 1 - объект в файле (смещение), 2 - объект в объектном потоке.
+    entries = {0: (0, 0, 65535)}
+    for number, (offset, generation) in copier.offsets.items():
+        entries[number] = (1, offset, generation)
+    for number, (stream_number, index) in copier.compressed.items():
+        entries[number] = (2, stream_number, index)
+    entries[xref_number] = (1, xref_offset, 0)
+
+    numbers = sorted(entries)
+    offset_width = max(1, (max(entry[1] for entry in entries.values()).bit_length() + 7) // 8)
+    index = []
+    data = BytesIO()
+    start = 0
+    while start < len(numbers):
+        end = start
+        while end + 1 < len(numbers) and numbers[end + 1] == numbers[end] + 1:
+            end += 1
+        index.extend([NumberObject(numbers[start]), NumberObject(end - start + 1)])
+        for number in numbers[start:end + 1]:
+            entry_type, field2, field3 = entries[number]
+            data.write(bytes([entry_type]) + field2.to_bytes(offset_width, "big") + field3.to_bytes(2, "big"))
+        start = end + 1
+
+    xref_stream = EncodedStreamObject()
+    xref_stream._data = zlib.compress(data.getvalue(), copier.compression_level)
+    xref_stream[NameObject("/Type")] = NameObject("/XRef")
+    xref_stream[NameObject("/Size")] = NumberObject(copier.next_number)
+    xref_stream[NameObject("/W")] = ArrayObject([NumberObject(1), NumberObject(offset_width), NumberObject(2)])
+    xref_stream[NameObject("/Index")] = ArrayObject(index)
+    xref_stream[NameObject("/Filter")] = NameObject("/FlateDecode")
+    for key, value in trailer_entries.items():
+        xref_stream[NameObject(key)] = value
+    copier.offsets[xref_number] = (xref_offset, 0)
+    copier.out.write(f"{xref_number} 0 obj\n".encode("ascii"))
+    xref_stream.write_to_stream(copier.out, None)
+    copier.out.write(b"\nendobj\n")
+    return xref_offset
+
+
+def write_outline_items(copier, outline, parent_ref, page_refs, prev_ref=None):
+    """
+    Пишет один уровень закладок (и вложенные уровни, свернутыми) под узел parent_ref.
+    prev_ref - уже существующая закладка, за которой продолжается цепочка.
+    Возвращает ссылки на записанные закладки этого уровня.
+    """
+    refs = [IndirectObject(copier.reserve_number(), 0, None) for _ in outline]
+    for index, (title, page_index, children) in enumerate(outline):
+        item = DictionaryObject()
+        item[NameObject("/Title")] = TextStringObject(title)
+        item[NameObject("/Parent")] = parent_ref
+        item[NameObject("/Dest")] = ArrayObject([page_refs[page_index], NameObject("/Fit")])
+        previous = refs[index - 1] if index else prev_ref
+        if previous is not None:
+            item[NameObject("/Prev")] = previous
+        if index + 1 < len(refs):
+            item[NameObject("/Next")] = refs[index + 1]
+        if children:
+            child_refs = write_outline_items(copier, children, refs[index], page_refs)
+            item[NameObject("/First")] = child_refs[0]
+            item[NameObject("/Last")] = child_refs[-1]
+            item[NameObject("/Count")] = NumberObject(-len(child_refs))  # Отрицательное число - свернуто
+        copier.write_object(refs[index].idnum, item)
+    return refs
+
+
+def get_object_count(reader):
+    """Значение /Size: на единицу больше наибольшего номера объекта в файле."""
+    if "/Size" in reader.trailer:
+        return int(reader.trailer["/Size"])
+    # PyPDF2 не переносит /Size из потока xref в trailer - считаем по самим таблицам.
+    numbers = [number for table in reader.xref.values() for number in table]
+    numbers.extend(reader.xref_objStm)
+    return max(numbers, default=0) + 1
+
+
+def read_startxref(pdf_path):
+    """Возвращает смещение последнего раздела xref и признак классической таблицы."""
+    with open(pdf_path, 'rb') as f_in:
+        f_in.seek(0, os.SEEK_END)
+        file_size = f_in.tell()
+        f_in.seek(max(0, file_size - 2048))
+        tail = f_in.read()
+        match = re.search(rb"startxref\s+(\d+)\s+%%EOF\s*$", tail)
+        if not match:
+            raise UnsupportedPdfError("не найден раздел startxref")
+        startxref = int(match.group(1))
+        f_in.seek(startxref)
+        is_table = f_in.read(4) == b"xref"
+    return startxref, is_table
+
+
+class RawPdfEngine(PdfEngine):
+    """
+    Движок прямого переноса: документы склеиваются целиком, объекты переносятся с перенумерацией,
+    а потоки (содержимое страниц, шрифты, картинки) копируются байт в байт без распаковки.
+    Заново строятся только дерево страниц, каталог, xref и trailer.
+    Объекты пишутся во временный файл сразу при append, поэтому память не растет с размером комплекта.
+    Если документ содержит то, что нельзя перенести напрямую (шифрование, закладки, формы),
+    вся склейка переключается на обычный движок PyPDF2.
+    dedup - хранить одинаковые потоки (шрифты, логотипы, цветовые профили) один раз
+    (None - по настройке "dedup_resources").
+    object_streams - упаковывать объекты в сжатые объектные потоки и писать поток xref
+    (None - по настройке "object_streams"), compression_level - уровень сжатия zlib.
+    """
+    name = "raw"
+    OBJECT_STREAM_SIZE = 200
+
+    def __init__(self, dedup=None, object_streams=None, compression_level=None):
+        self.dedup = get_setting("dedup_resources") if dedup is None else dedup
+        self.object_streams = get_setting("object_streams") if object_streams is None else object_streams
+        self.compression_level = (get_setting("compression_level") if compression_level is None
+                                  else compression_level)
+
+    def open(self):
+        self.inputs = []
+        self.fallback = None
+        # Объектные потоки появились в PDF 1.5.
+        self.version = "1.5" if self.object_streams else "1.4"
+        self.spool = tempfile.TemporaryFile()
+        self.spool.write(f"%PDF-{self.version}\n%".encode("ascii") + b"\xe2\xe3\xcf\xd3\n")
+        self.header_version = self.version
+        # Объекты 1 и 2 - каталог и корень дерева страниц, остальные нумеруются по порядку.
+        self.copier = PdfObjectCopier(
+            self.spool,
+            first_number=3,
+            dedup=self.dedup,
+            object_stream_size=self.OBJECT_STREAM_SIZE if self.object_streams else 0,
+            compression_level=self.compression_level,
+        )
+        self.parent_ref = IndirectObject(2, 0, None)
+        self.page_refs = []
+        self.outline = []
+        self.part_outline = []  # Закладки из готовых частей (append_part) - идут перед добавленными
+        self.named_destinations = []
+        return self
+
+    def append(self, pdf_path):
+        # Запоминается путь, а не поток: содержимое уже перенесено, и держать его в памяти незачем.
+        input_path = getattr(pdf_path, "name", pdf_path)
+        if self.fallback is not None:
+            self.fallback.append(pdf_path)
+            self.inputs.append(input_path)
+            return
+
+        reader = PdfReader(pdf_path)
+        try:
+            self.page_refs.extend(self.copier.copy_document_pages(reader, self.parent_ref))
+        except UnsupportedPdfError as e:
+            print(f"ℹ️  {os.path.basename(input_path)}: {e}, склейка продолжается движком PyPDF2.")
+            self._switch_to_fallback()
+            self.append(pdf_path)
+            return
+        # При другой ошибке уже записанные объекты документа остаются в файле без ссылок на них:
+        # это безопасно, а страницы документа в дерево не попадают.
+        self.inputs.append(input_path)
+        header_version = reader.pdf_header.replace("%PDF-", "")
+        if re.fullmatch(r"\d+\.\d+", header_version) and float(header_version) > float(self.version):
+            self.version = header_version
+
+    def add_outline(self, outline):
+        if self.fallback is not None:
+            self.fallback.add_outline(outline)
+        else:
+            self.outline.extend(outline)
+
+    def append_part(self, pdf_path):
+        """
+        Присоединяет готовую часть склейки (merge_in_shards). В отличие от append, закладки
+        и именованные ссылки части не мешают прямому переносу: они строятся заново с новыми
+        номерами страниц, как если бы все документы части склеивались в этом файле.
+        """
+        if self.fallback is not None:
+            self.append(pdf_path)
+            return
+        reader = PdfReader(pdf_path)
+        try:
+            check_pass_through_supported(reader, keep_navigation=True)
+            outline = read_pdf_outline(reader)
+            destinations = read_named_destinations(reader)
+            page_refs = self.copier.copy_pages(reader, list(reader.pages), self.parent_ref)
+        except UnsupportedPdfError as e:
+            print(f"ℹ️  {os.path.basename(getattr(pdf_path, 'name', pdf_path))}: {e}, "
+                  f"склейка продолжается движком PyPDF2.")
+            self._switch_to_fallback()
+            self.append(pdf_path)
+            return
+
+        first_page = len(self.page_refs)
+        self.page_refs.extend(page_refs)
+        self.inputs.append(getattr(pdf_path, "name", pdf_path))
+
+        def shift(entries):
+            return [(title, first_page + page_index, shift(children)) for title, page_index, children in entries]
+
+        self.part_outline.extend(shift(outline))
+        new_refs = {(page.indirect_reference.idnum, page.indirect_reference.generation): page_ref
+                    for page, page_ref in zip(reader.pages, page_refs)}
+        for name, destination in destinations:
+            page = destination[0]
+            if isinstance(page, IndirectObject) and (page.idnum, page.generation) in new_refs:
+                page = new_refs[(page.idnum, page.generation)]
+            elif isinstance(page, NumberObject) and 0 <= page < len(page_refs):
+                page = page_refs[page]  # Номер страницы вместо ссылки (так пишут для других файлов)
+            else:
+                continue
+            self.named_destinations.append((name, ArrayObject([page] + list(destination[1:]))))
+
+    def append_pages(self, reader, page_indexes):
+        """Переносит только указанные страницы (номера с нуля) открытого документа."""
+        if reader.is_encrypted:
+            raise UnsupportedPdfError("документ зашифрован")
+        pages = [reader.pages[index] for index in page_indexes]
+        self.page_refs.extend(self.copier.copy_pages(reader, pages, self.parent_ref))
+
+    def _switch_to_fallback(self):
+        # Закладки и ссылки частей PyPDF2 прочитает из самих частей заново.
+        self.fallback = PyPdf2Engine().open()
+        for pdf in self.inputs:
+            self.fallback.append(read_input_pdf(pdf))
+        self.fallback.add_outline(self.outline)
+        self.spool.close()
+
+    def write(self, out_stream):
+        if self.fallback is not None:
+            self.fallback.write(out_stream)
+            return
+
+        base_offset = out_stream.tell()
+        self.spool.seek(0)
+        shutil.copyfileobj(self.spool, out_stream, 1024 * 1024)
+        copier = self.copier
+        copier.offsets = {number: (offset + base_offset, generation)
+                          for number, (offset, generation) in copier.offsets.items()}
+        copier.out = out_stream
+
+        pages_node = DictionaryObject()
+        pages_node[NameObject("/Type")] = NameObject("/Pages")
+        pages_node[NameObject("/Kids")] = ArrayObject(self.page_refs)
+        pages_node[NameObject("/Count")] = NumberObject(len(self.page_refs))
+        copier.write_object(2, pages_node)
+
+        catalog = DictionaryObject()
+        catalog[NameObject("/Type")] = NameObject("/Catalog")
+        catalog[NameObject("/Pages")] = self.parent_ref
+        outline = self.part_outline + self.outline
+        if outline:
+            outlines_ref = IndirectObject(copier.reserve_number(), 0, None)
+            item_refs = write_outline_items(copier, outline, outlines_ref, self.page_refs)
+            outlines = DictionaryObject()
+            outlines[NameObject("/Type")] = NameObject("/Outlines")
+            outlines[NameObject("/First")] = item_refs[0]
+            outlines[NameObject("/Last")] = item_refs[-1]
+            outlines[NameObject("/Count")] = NumberObject(len(item_refs))
+            copier.write_object(outlines_ref.idnum, outlines)
+            catalog[NameObject("/Outlines")] = outlines_ref
+            catalog[NameObject("/PageMode")] = NameObject("/UseOutlines")
+        if self.named_destinations:
+            # Один лист дерева имен; имена в нем должны идти по возрастанию.
+            names = ArrayObject()
+            for name, destination in sorted(self.named_destinations, key=lambda entry: entry[0]):
+                names.extend([TextStringObject(name), destination])
+            dests_ref = IndirectObject(copier.reserve_number(), 0, None)
+            dests = DictionaryObject()
+            dests[NameObject("/Names")] = names
+            copier.write_object(dests_ref.idnum, dests)
+            names_dict = DictionaryObject()
+            names_dict[NameObject("/Dests")] = dests_ref
+            catalog[NameObject("/Names")] = names_dict
+        if self.version != self.header_version:
+            # Версия из заголовка уже записана, более новую указываем в каталоге (PDF 1.4+).
+            catalog[NameObject("/Version")] = NameObject(f"/{self.version}")
+        copier.write_object(1, catalog)
+
+        if self.object_streams:
+            xref_offset = write_xref_stream(copier, {"/Root": IndirectObject(1, 0, None)})
+        else:
+            xref_offset = out_stream.tell()
+            write_xref_table(out_stream, copier.offsets)
+            trailer = DictionaryObject()
+            trailer[NameObject("/Size")] = NumberObject(copier.next_number)
+            trailer[NameObject("/Root")] = IndirectObject(1, 0, None)
+            out_stream.write(b"trailer\n")
+            trailer.write_to_stream(out_stream, None)
+        out_stream.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode("ascii"))
+
+        if copier.shared_streams:
+            print(f"ℹ️  Одинаковых ресурсов объединено: {copier.shared_streams}, "
+                  f"сэкономлено {copier.bytes_saved / 1024 / 1024:.1f} МБ.")
+
+    @property
+    def stats(self):
+        """Статистика объединения ресурсов (для замеров)."""
+        if self.fallback is not None:
+            return {"fallback": True}
+        return {"shared_streams": self.copier.shared_streams, "bytes_saved": self.copier.bytes_saved}
+
+    def close(self):
+        if self.fallback is not None:
+            self.fallback.close()
+        else:
+            self.spool.close()
+        self.inputs = []
+
+
+PDF_ENGINES[RawPdfEngine.name] = RawPdfEngine
+
+
+# ==========================================
+# ДОПОЛНЕНИЕ ГОТОВОГО ФАЙЛА (инкрементальное обновление PDF)
+# ==========================================
+
+def append_pdfs_incrementally(bundle_path, pdf_paths, outline=None):
+    """
+    Дописывает страницы из pdf_paths в конец готового файла как инкрементальное обновление PDF:
+    добавляются только новые объекты, новая версия корня дерева страниц и новый раздел xref.
+    outline - закладки новых страниц (номера страниц считаются от первой добавленной); они дописываются
+    в конец закладок файла, если у файла они есть.
+    Возвращает количество добавленных страниц.
+    """
+    startxref, is_table = read_startxref(bundle_path)
+
+    # Жесткую ссылку (например, на запись кэша) сначала превращаем в отдельный файл
+    # (до открытия: в Windows открытый файл заменить нельзя).
+    if os.stat(bundle_path).st_nlink > 1:
+        shutil.copyfile(bundle_path, f"{bundle_path}.tmp")
+        os.replace(f"{bundle_path}.tmp", bundle_path)
+
+    # Файл читается лениво (PdfReader по пути прочитал бы его в память целиком): нужны только
+    # trailer, корень дерева страниц и закладки.
+    with open(bundle_path, 'rb') as bundle_file:
+        bundle = PdfReader(bundle_file)
+        if bundle.is_encrypted:
+            raise UnsupportedPdfError("файл зашифрован")
+        trailer = bundle.trailer
+        pages_ref = trailer["/Root"].raw_get("/Pages")
+        pages_node = pages_ref.get_object()
+        parent_ref = IndirectObject(pages_ref.idnum, pages_ref.generation, None)
+
+        original_size = os.path.getsize(bundle_path)
+        with open(bundle_path, 'r+b') as f_out:
+            try:
+                f_out.seek(original_size - 1)
+                if f_out.read(1) != b"\n":
+                    f_out.write(b"\n")
+
+                # Раздел обновления пишем в том же виде, что и исходный: таблицей или потоком xref.
+                copier = PdfObjectCopier(f_out, get_object_count(bundle),
+                                         compression_level=get_setting("compression_level"))
+                new_page_refs = []
+                for pdf in pdf_paths:
+                    new_page_refs.extend(copier.copy_document_pages(PdfReader(read_input_pdf(pdf)), parent_ref))
+
+                new_pages_node = DictionaryObject(pages_node)
+                new_pages_node[NameObject("/Kids")] = ArrayObject(list(pages_node["/Kids"]) + new_page_refs)
+                new_pages_node[NameObject("/Count")] = NumberObject(int(pages_node["/Count"]) + len(new_page_refs))
+                copier.write_object(pages_ref.idnum, new_pages_node, pages_ref.generation)
+                if outline:
+                    extend_bundle_outline(bundle, copier, outline, new_page_refs)
+
+                new_trailer = DictionaryObject()
+                for key in ("/Root", "/Info", "/ID"):
+                    if key in trailer:
+                        new_trailer[NameObject(key)] = trailer.raw_get(key)
+                new_trailer[NameObject("/Prev")] = NumberObject(startxref)
+
+                if is_table:
+                    xref_offset = f_out.tell()
+                    write_xref_table(f_out, copier.offsets)
+                    new_trailer[NameObject("/Size")] = NumberObject(copier.next_number)
+                    f_out.write(b"trailer\n")
+                    new_trailer.write_to_stream(f_out, None)
+                else:
+                    xref_offset = write_xref_stream(copier, new_trailer)
+                f_out.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode("ascii"))
+            except BaseException:
+                # Возвращаем файл в исходное состояние, чтобы не оставить битый хвост.
+                f_out.truncate(original_size)
+                raise
+    return len(new_page_refs)
+
+
+def extend_bundle_outline(bundle, copier, outline, page_refs):
+    """Продолжает верхний уровень закладок готового файла новыми закладками (новые версии объектов)."""
+    outlines_ref = bundle.trailer["/Root"].raw_get("/Outlines")
+    if not isinstance(outlines_ref, IndirectObject):
+        return
+    outlines = outlines_ref.get_object()
+    last_ref = outlines.raw_get("/Last")
+    if not isinstance(last_ref, IndirectObject):
+        return
+
+    parent_ref = IndirectObject(outlines_ref.idnum, outlines_ref.generation, None)
+    old_last_ref = IndirectObject(last_ref.idnum, last_ref.generation, None)
+    item_refs = write_outline_items(copier, outline, parent_ref, page_refs, prev_ref=old_last_ref)
+
+    old_last = DictionaryObject(last_ref.get_object())
+    old_last[NameObject("/Next")] = item_refs[0]
+    copier.write_object(last_ref.idnum, old_last, last_ref.generation)
+    new_outlines = DictionaryObject(outlines)
+    new_outlines[NameObject("/Last")] = item_refs[-1]
+    new_outlines[NameObject("/Count")] = NumberObject(int(outlines.get("/Count", 0)) + len(item_refs))
+    copier.write_object(outlines_ref.idnum, new_outlines, outlines_ref.generation)
+
+
+def find_bundle_to_extend(save_path, name_prefix, processed_folders):
+    """
+    Ищет в папке сохранения готовый файл сценария, который можно дополнить:
+    его папки должны совпадать с началом текущей выборки, а новые папки - идти после них.
+    Возвращает (имя файла, набор папок в нем) или (None, None).
+    """
+    pattern = re.compile(rf"^{re.escape(name_prefix)} (\S+) (\d+) pcs\.\.pdf$")
+    processed_set = set(processed_folders)
+    best_name, best_folders = None, None
+
+    if not os.path.isdir(save_path):
+        return None, None
+    for file_name in os.listdir(save_path):
+        match = pattern.match(file_name)
+        if not match:
+            continue
+        bundle_folders = set()
+        for part in match.group(1).split(';'):
+            bounds = part.split('-')
+            if not all(bound.isdigit() for bound in bounds) or len(bounds) > 2:
+                bundle_folders = None
+                break
+            bundle_folders.update(range(int(bounds[0]), int(bounds[-1]) + 1))
+        if not bundle_folders or len(bundle_folders) != int(match.group(2)):
+            continue
+
+        last_folder = max(bundle_folders)
+        if bundle_folders != {f for f in processed_set if f <= last_folder}:
+            continue
+        if best_folders is None or len(bundle_folders) > len(best_folders):
+            best_name, best_folders = file_name, bundle_folders
+
+    return best_name, best_folders
+
+
+def extend_manifest(old_bundle_path, new_bundle_path, new_items):
+    """Дописывает в опись дополненного файла новые комплекты (если у файла была опись)."""
+    old_manifest_path = get_manifest_path(old_bundle_path)
+    try:
+        with open(old_manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return
+
+    added = build_manifest(new_items, os.path.basename(new_bundle_path))
+    for entry in added["inputs"]:
+        entry["page_start"] += manifest["pages"]
+        entry["page_end"] += manifest["pages"]
+    manifest["inputs"].extend(added["inputs"])
+    manifest["pages"] += added["pages"]
+    manifest["output"] = added["output"]
+    manifest["created"] = added["created"]
+    write_manifest(new_bundle_path, manifest)
+    if get_manifest_path(new_bundle_path) != old_manifest_path:
+        os.remove(old_manifest_path)
+
+
+def extend_existing_bundle(save_path, name_prefix, plan):
+    """
+    Дополняет ранее собранный файл папками, которые идут после уже включенных (сценарии 2 и 4),
+    и переименовывает его под новый диапазон. Возвращает путь к дополненному файлу,
+    None - склейка отменена (поврежденные файлы) или False, если подходящего файла нет
+    и собирать нужно целиком.
+    """
+    if not os.path.isdir(save_path):
+        return False
+    processed_folders = [item["folder"] for item in plan]
+    bundle_name, bundle_folders = find_bundle_to_extend(save_path, name_prefix, processed_folders)
+    if bundle_name is None:
+        print("ℹ️  Подходящий готовый файл для дополнения не найден, собираю файл целиком.")
+        return False
+
+    new_items = [item for item in plan if item["folder"] not in bundle_folders]
+    if not new_items:
+        print(f"ℹ️  Файл {bundle_name} уже содержит все выбранные папки.")
+        return os.path.join(save_path, bundle_name)
+
+    new_items = validate_plan(new_items)
+    if not new_items:
+        return None
+
+    bundle_path = os.path.join(save_path, bundle_name)
+    print(f"Дополнение: {bundle_name} (+{len(new_items)} папок) ...")
+    try:
+        outline = build_outline(new_items, build_manifest(new_items, bundle_name)) if get_setting("outline") else None
+        added_pages = append_pdfs_incrementally(bundle_path, plan_files(new_items), outline)
+    except UnsupportedPdfError as e:
+        print_error(f"Файл нельзя дополнить ({e}), собираю файл целиком.")
+        return False
+
+    all_folders = sorted(bundle_folders) + [item["folder"] for item in new_items]
+    new_name = folder_bundle_name(name_prefix)([{"folder": f_num} for f_num in all_folders])
+    os.replace(bundle_path, os.path.join(save_path, new_name))
+    extend_manifest(bundle_path, os.path.join(save_path, new_name), new_items)
+    print(f"✅ Готово! Добавлено страниц: {added_pages}. Новое имя: {new_name}")
+    return os.path.join(save_path, new_name)
+
+
+# ==========================================
+# ПРОВЕРКА ВХОДНЫХ ФАЙЛОВ И КАРАНТИН
+# ==========================================
+
+def get_pdf_problem(metadata):
+    """Возвращает описание проблемы файла, мешающей склейке, или None."""
+    if metadata["error"]:
+        return metadata["error"]
+    if metadata["encrypted"]:
+        return "файл зашифрован"
+    if not metadata["pages"]:
+        return "в файле нет страниц"
+    return None
+
+
+def add_to_quarantine(broken_files):
+    """Дописывает битые файлы в список карантина (Cache/quarantine.json)."""
+    quarantine = {}
+    try:
+        if os.path.exists(QUARANTINE_FILE):
+            with open(QUARANTINE_FILE, 'r', encoding='utf-8') as f:
+                quarantine = json.load(f)
+        for pdf, problem in broken_files:
+            quarantine[os.path.abspath(pdf)] = {
+                "problem": problem,
+                "detected": datetime.now().isoformat(timespec="seconds"),
+            }
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(QUARANTINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(quarantine, f, ensure_ascii=False, indent=4)
+    except Exception as e:
+        print_error(f"Не удалось обновить список карантина: {e}")
+
+
+def validate_plan(plan, skip_broken=False):
+    """
+    Проверяет все входные файлы до начала склейки: заголовок, xref, дерево страниц, шифрование.
+    Файлы открываются параллельно в нескольких процессах, результаты берутся из кэша метаданных.
+    Возвращает план (без комплектов с битыми файлами, если включен карантин или skip_broken)
+    или None - склейка отменена.
+    skip_broken - сценарий и раньше пропускал файлы с ошибками: комплекты с ними исключаются без карантина.
+    """
+    pdf_paths = plan_files(plan)
+    try:
+        metadata_by_path = get_metadata_cache().get_many(pdf_paths, get_setting("workers"))
+    except (OSError, sqlite3.Error) as e:
+        print_error(f"Не удалось проверить файлы заранее: {e}")
+        return plan
+
+    broken_files = []
+    for pdf in pdf_paths:
+        problem = get_pdf_problem(metadata_by_path[pdf])
+        if problem:
+            broken_files.append((pdf, problem))
+    if not broken_files:
+        return plan
+
+    print_error(f"Найдены поврежденные файлы ({len(broken_files)} шт.):")
+    for pdf, problem in broken_files:
+        print(f"   • {pdf}: {problem}")
+
+    quarantine = get_setting("quarantine_broken")
+    if not quarantine and not skip_broken:
+        print_error("Склейка отменена. Замените файлы или включите \"quarantine_broken\" в config.json.")
+        return None
+
+    if quarantine:
+        add_to_quarantine(broken_files)
+    broken_paths = {pdf for pdf, _ in broken_files}
+    valid_plan = [item for item in plan if not broken_paths.intersection(item["files"])]
+    skipped = len(plan) - len(valid_plan)
+    if quarantine:
+        print(f"ℹ️  Файлы внесены в карантин, пропущено комплектов: {skipped}.")
+    else:
+        print(f"ℹ️  Файлы с ошибками пропущены, пропущено комплектов: {skipped}.")
+    if not valid_plan:
+        print_error("После исключения поврежденных файлов скреплять нечего.")
+        return None
+    return valid_plan
+
+
+def get_file_hash(pdf_path, quick=False):
+    """
+    SHA-256 файла. quick=True - только по первым и последним 64 КБ (быстрый отсев
+    файлов, которые точно различаются). Полный хэш берется из кэша метаданных, если он там есть.
+    """
+    chunk_size = 64 * 1024
+    file_hash = hashlib.sha256()
+    if not quick:
+        metadata = get_metadata_cache().lookup(pdf_path)
+        if metadata is not None:
+            return metadata["sha256"]
+    with open(pdf_path, 'rb') as f_in:
+        if quick:
+            file_hash.update(f_in.read(chunk_size))
+            f_in.seek(max(0, os.fstat(f_in.fileno()).st_size - chunk_size))
+            file_hash.update(f_in.read(chunk_size))
+        else:
+            for chunk in iter(lambda: f_in.read(1024 * 1024), b""):
+                file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def find_identical_files(pdf_paths):
+    """
+    Находит побайтно одинаковые файлы: сначала по размеру, затем по быстрому хэшу
+    начала и конца файла, и только потом по полному хэшу.
+    Возвращает словарь: путь -> ключ содержимого (у одинаковых файлов ключ общий).
+    """
+    content_keys = {}
+    by_size = {}
+    for pdf in pdf_paths:
+        try:
+            by_size.setdefault(os.path.getsize(pdf), []).append(pdf)
+        except OSError:
+            content_keys[pdf] = pdf  # Недоступный файл ни с чем не совпадает
+
+    for size, same_size in by_size.items():
+        if len(set(same_size)) == 1:
+            for pdf in same_size:
+                content_keys[pdf] = ("size", size)
+            continue
+        by_quick_hash = {}
+        for pdf in same_size:
+            by_quick_hash.setdefault(get_file_hash(pdf, quick=True), []).append(pdf)
+        for quick_hash, candidates in by_quick_hash.items():
+            for pdf in candidates:
+                if len(set(candidates)) == 1:
+                    content_keys[pdf] = ("quick", size, quick_hash)
+                else:
+                    content_keys[pdf] = ("full", size, get_file_hash(pdf))
+    return content_keys
+
+
+def drop_duplicate_inputs(plan):
+    """
+    Убирает из плана комплекты, побайтно совпадающие с уже включенными ранее
+    (например, "Invoice 123.pdf" и "Invoice 123 (1).pdf"), и сообщает, что пропущено.
+    """
+    try:
+        content_keys = find_identical_files(plan_files(plan))
+    except (OSError, sqlite3.Error) as e:
+        print_error(f"Не удалось проверить файлы на дубликаты: {e}")
+        return plan
+
+    unique_plan = []
+    first_seen = {}
+    duplicates = []
+    for item in plan:
+        item_key = tuple(content_keys[pdf] for pdf in item["files"])
+        if item_key in first_seen:
+            duplicates.append((item, first_seen[item_key]))
+            continue
+        first_seen[item_key] = item
+        unique_plan.append(item)
+
+    if duplicates:
+        print(f"ℹ️  Пропущены одинаковые файлы ({len(duplicates)} шт.):")
+        for item, original in duplicates:
+            print(f"   • {', '.join(item['files'])} = {', '.join(original['files'])}")
+    return unique_plan
+
+
+# ==========================================
+# СКРЕПЛЕНИЕ ПО ПЛАНУ
+# ==========================================
+
+def plan_files(plan):
+    """Плоский список файлов плана в порядке склейки."""
+    return [pdf for item in plan for pdf in item["files"]]
+
+
+def folder_bundle_name(prefix):
+    """Возвращает функцию имени файла вида "<prefix> <диапазон> <N> pcs..pdf" по комплектам плана."""
+    def make_output_name(plan):
+        range_str = generate_range_string([item["folder"] for item in plan])
+        return f"{prefix} {range_str} {len(plan)} pcs..pdf"
+    return make_output_name
+
+
+def build_manifest(plan, output_name, skipped_files=()):
+    """
+    Опись готового файла: для каждого входного файла - путь, номер папки, ключ сортировки,
+    первая и последняя страница в результате и SHA-256. Страницы и хэши берутся из кэша метаданных.
+    skipped_files - файлы, которые не удалось добавить при склейке.
+    """
+    metadata_by_path = get_metadata_cache().get_many(plan_files(plan), get_setting("workers"))
+    inputs = []
+    next_page = 1
+    for item in plan:
+        sort_key = item.get("sort_key", item["folder"])
+        if isinstance(sort_key, float) and sort_key == float('inf'):
+            sort_key = None
+        for pdf in item["files"]:
+            if pdf in skipped_files:
+                continue
+            metadata = metadata_by_path[pdf]
+            pages = metadata["pages"] or 0
+            inputs.append({
+                "source": os.path.abspath(pdf),
+                "folder": item["folder"],
+                "sort_key": sort_key,
+                "page_start": next_page,
+                "page_end": next_page + pages - 1,
+                "sha256": metadata["sha256"],
+            })
+            next_page += pages
+    return {
+        "output": output_name,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "pages": next_page - 1,
+        "inputs": inputs,
+    }
+
+
+def get_document_label(pdf_path):
+    """Подпись документа для закладки: "ДТ 10702070/120520/5179550", "Invoice 3650", "ЭСД" или имя файла."""
+    file_name = os.path.basename(pdf_path)
+    lower_name = file_name.lower()
+    if lower_name.startswith("gtd_"):
+        return f"ДТ {normalize_gtd_number(file_name).replace('_', '/')}"
+    if "invoice" not in lower_name and file_name.count('-') == 4:
+        return "ЭСД"
+    return os.path.splitext(file_name)[0]
+
+
+def build_outline(plan, manifest):
+    """
+    Закладки готового файла по плану и описи (страницы уже известны, файл не перечитывается):
+    закладка на каждую папку, внутри нее - на каждый документ комплекта.
+    """
+    entries_by_source = {entry["source"]: entry for entry in manifest["inputs"]}
+    outline = []
+    for item in plan:
+        documents = []
+        for pdf in item["files"]:
+            entry = entries_by_source.get(os.path.abspath(pdf))
+            if entry is not None and entry["page_end"] >= entry["page_start"]:
+                documents.append((get_document_label(pdf), entry["page_start"] - 1, []))
+        if not documents:
+            continue
+        if item["folder"] is None:
+            outline.extend(documents)
+        elif len(documents) == 1:
+            title, page_index, _ = documents[0]
+            outline.append((f"{item['folder']} · {title}", page_index, []))
+        else:
+            outline.append((str(item["folder"]), documents[0][1], documents))
+    return outline
+
+
+def split_into_shards(pdf_paths, shard_count):
+    """Делит упорядоченный список файлов на непрерывные части примерно равного объема."""
+    sizes = []
+    for pdf in pdf_paths:
+        try:
+            sizes.append(os.path.getsize(pdf))
+        except OSError:
+            sizes.append(0)
+    target = sum(sizes) / shard_count
+
+    shards = [[]]
+    shard_size = 0
+    for pdf, size in zip(pdf_paths, sizes):
+        if shards[-1] and shard_size + size / 2 > target and len(shards) < shard_count:
+            shards.append([])
+            shard_size = 0
+        shards[-1].append(pdf)
+        shard_size += size
+    return shards
+
+
+def get_shard_errors_path(shard_path):
+    return os.path.splitext(shard_path)[0] + ".errors.json"
+
+
+def merge_shard(pdf_paths, shard_path, skip_broken=False, engine_name=None):
+    """
+    Склеивает одну часть плана в отдельный файл (выполняется в процессе-исполнителе).
+    Возвращает (ошибки, повторы и медленные чтения для сводки).
+    Ошибки пропущенных файлов сохраняются рядом до самой части: если запуск прервется, при
+    продолжении готовая часть берется вместе с ними.
+    """
+    take_io_events()  # Процесс-исполнитель склеивает несколько частей подряд
+    merger = create_pdf_engine(engine_name)
+    errors = []
+    for pdf in pdf_paths:
+        if skip_broken:
+            try:
+                merger.append(read_input_pdf(pdf))
+            except Exception as e:
+                errors.append((pdf, str(e)))
+        else:
+            merger.append(read_input_pdf(pdf))
+    errors_data = json.dumps(errors, ensure_ascii=False).encode("utf-8")
+    write_atomically(get_shard_errors_path(shard_path), lambda f_out: f_out.write(errors_data))
+    write_atomically(shard_path, merger.write)
+    merger.close()
+    return errors, take_io_events()
+
+
+def get_checkpoint_dir(save_path, pdf_paths):
+    """
+    Папка контрольной точки склейки по частям. Зависит только от параметров запуска (куда и какие
+    файлы по порядку), поэтому повторный запуск после сбоя находит ту же папку. Имя готового файла
+    в ключ не входит: в сценарии Temp номер Combined-N при повторе будет уже другим.
+    """
+    key_hash = hashlib.sha256(os.path.abspath(save_path).encode("utf-8") + b"\0")
+    for pdf in pdf_paths:
+        key_hash.update(os.path.abspath(pdf).encode("utf-8") + b"\0")
+    return os.path.join(SHARDS_DIR, key_hash.hexdigest())
+
+
+def prune_checkpoints():
+    """Удаляет контрольные точки, к которым давно не возвращались (запуск так и не повторили)."""
+    if not os.path.isdir(SHARDS_DIR):
+        return
+    now = time.time()
+    for name in os.listdir(SHARDS_DIR):
+        path = os.path.join(SHARDS_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > CHECKPOINT_MAX_AGE_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def load_or_create_checkpoint(shard_dir, pdf_paths, workers):
+    """
+    Делит план на части и записывает деление в checkpoint.json. Если точка от прерванного запуска
+    с тем же планом уже есть, берется ее деление: готовые части при этом совпадают по границам.
+    Частей не меньше, чем процессов, и в каждой не больше checkpoint_files файлов.
+    Возвращает список частей.
+    """
+    checkpoint_path = os.path.join(shard_dir, "checkpoint.json")
+    try:
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint["inputs"] == pdf_paths:
+            os.utime(shard_dir)  # Точка снова нужна: не удалять ее как давнюю
+            return [pdf_paths[start:end] for start, end in checkpoint["shards"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    max_files = max(1, get_setting("checkpoint_files"))
+    shards = split_into_shards(pdf_paths, max(workers, (len(pdf_paths) + max_files - 1) // max_files))
+    bounds = []
+    start = 0
+    for shard in shards:
+        bounds.append([start, start + len(shard)])
+        start += len(shard)
+    os.makedirs(shard_dir, exist_ok=True)
+    data = json.dumps({"inputs": pdf_paths, "shards": bounds}, ensure_ascii=False).encode("utf-8")
+    write_atomically(checkpoint_path, lambda f_out: f_out.write(data))
+    return shards
+
+
+def merge_in_shards(pdf_paths, shard_dir, workers, skip_broken=False, engine_name=None):
+    """
+    Склейка большого комплекта по частям: план делится на непрерывные части,
+    они склеиваются параллельно в нескольких процессах, а готовые части соединяются
+    легким проходом без распаковки потоков, строго в исходном порядке.
+    Части - контрольные точки: каждая называется по своим входным файлам (путь, размер, mtime)
+    и пишется атомарно, поэтому после сбоя повторный запуск склеивает заново только
+    недостающие части и части с измененными файлами.
+    Возвращает (объект для save_merged_pdf, список ошибок).
+    """
+    shards = load_or_create_checkpoint(shard_dir, pdf_paths, workers)
+    shard_paths = []
+    for index, shard in enumerate(shards):
+        # Без ключа (какого-то файла нет) часть не считается готовой и всегда склеивается заново.
+        shard_key = get_output_cache_key(f"shard-{engine_name}-{skip_broken}", shard) or "new"
+        shard_paths.append(os.path.join(shard_dir, f"shard-{index:04d}-{shard_key}.pdf"))
+    expected = set(shard_paths) | {get_shard_errors_path(shard_path) for shard_path in shard_paths}
+    for name in os.listdir(shard_dir):
+        path = os.path.join(shard_dir, name)
+        if name.startswith("shard-") and path not in expected:
+            os.remove(path)  # Часть от прежних версий файлов больше не понадобится
+
+    ready = [os.path.isfile(shard_path) and not shard_path.endswith("-new.pdf") for shard_path in shard_paths]
+    print(f"Склейка по частям: {len(pdf_paths)} файлов, частей: {len(shards)} ...")
+    if any(ready):
+        print(f"ℹ️  Продолжаю прерванную склейку: готово частей {sum(ready)} из {len(shards)}.")
+
+    errors = []
+    with create_process_pool(workers) as executor:
+        futures = [None if is_ready else executor.submit(merge_shard, shard, shard_path, skip_broken, engine_name)
+                   for shard, shard_path, is_ready in zip(shards, shard_paths, ready)]
+        try:
+            done = 0
+            for shard, shard_path, future in zip(shards, shard_paths, futures):
+                report_progress(done, len(pdf_paths))
+                if future is None:
+                    with open(get_shard_errors_path(shard_path), 'r', encoding='utf-8') as f:
+                        errors.extend(tuple(error) for error in json.load(f))
+                else:
+                    shard_errors, io_events = future.result()
+                    errors.extend(shard_errors)
+                    for path, text in io_events:
+                        record_io_event(path, text)
+                done += len(shard)
+        except BaseException:
+            # Отмена задания или ошибка: выход из with ждет все части, поэтому еще не начатые отменяются.
+            # Готовые части остаются контрольными точками для следующего запуска.
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    concatenator = RawPdfEngine().open()
+    for shard_path in shard_paths:
+        concatenator.append_part(shard_path)
+    return concatenator, errors
+
+
+def get_volume_limits(scenario):
+    """Ограничения тома для сценария: (макс. байт, макс. страниц), 0 - без ограничения."""
+    limits = (get_setting("volume_limits") or {}).get(scenario, {})
+    max_mb = limits.get("max_mb", get_setting("volume_max_mb")) or 0
+    max_pages = limits.get("max_pages", get_setting("volume_max_pages")) or 0
+    return int(max_mb * 1024 * 1024), int(max_pages)
+
+
+def split_plan_into_volumes(plan, max_bytes, max_pages):
+    """
+    Делит упорядоченный план на непрерывные тома не больше max_bytes байт и max_pages страниц.
+    Объем оценивается по размерам входных файлов, страницы берутся из кэша метаданных.
+    Комплект целиком попадает в один том; комплект больше ограничения становится отдельным томом.
+    """
+    metadata_by_path = get_metadata_cache().get_many(plan_files(plan), get_setting("workers")) if max_pages else {}
+
+    volumes = [[]]
+    volume_bytes = volume_pages = 0
+    for item in plan:
+        item_bytes = sum(os.path.getsize(pdf) for pdf in item["files"]) if max_bytes else 0
+        item_pages = sum(metadata_by_path[pdf]["pages"] or 0 for pdf in item["files"]) if max_pages else 0
+        too_big = ((max_bytes and volume_bytes + item_bytes > max_bytes)
+                   or (max_pages and volume_pages + item_pages > max_pages))
+        if volumes[-1] and too_big:
+            volumes.append([])
+            volume_bytes = volume_pages = 0
+        if (max_bytes and item_bytes > max_bytes) or (max_pages and item_pages > max_pages):
+            print_error(f"Комплект {', '.join(item['files'])} больше ограничения тома, он будет отдельным томом.")
+        volumes[-1].append(item)
+        volume_bytes += item_bytes
+        volume_pages += item_pages
+    return volumes
+
+
+def volume_output_name(output_name, index, count):
+    """Имя тома: "<имя> (part 1 of 3).pdf"."""
+    base, ext = os.path.splitext(output_name)
+    return f"{base} (part {index} of {count}){ext}"
+
+
+def write_plan(plan, save_path, output_name, cache_key, skip_broken=False, use_segments=False,
+               allow_shards=True):
+    """
+    Склеивает проверенный план в файл output_name (при необходимости - по частям в нескольких процессах)
+    и кладет результат в кэш. Возвращает путь к готовому файлу или None.
+    """
+    if use_segments:
+        merge_inputs = [get_segment_path(item["files"]) if len(item["files"]) > 1 else item["files"][0]
+                        for item in plan]
+        # Если сегмент не добавился, из описи выпадают все файлы его комплекта.
+        segment_files = {segment: item["files"] for segment, item in zip(merge_inputs, plan)}
+        # Готовые сегменты соединяются так же, как части: копированием объектов без разбора страниц.
+        engine_name = RawPdfEngine.name
+    else:
+        merge_inputs = plan_files(plan)
+        segment_files = {}
+        engine_name = get_setting("engine")
+
+    workers = get_setting("workers") or os.cpu_count() or 1
+    shard_dir = None
+    failed_inputs = []
+    if (allow_shards and len(merge_inputs) >= get_setting("parallel_min_files")
+            and (workers > 1 or len(merge_inputs) > get_setting("checkpoint_files"))):
+        # В одном процессе части нужны только как контрольные точки - если комплект не умещается в одну.
+        prune_checkpoints()
+        shard_dir = get_checkpoint_dir(save_path, merge_inputs)
+        try:
+            merger, errors = merge_in_shards(merge_inputs, shard_dir, workers, skip_broken, engine_name)
+        except BaseException:
+            print("ℹ️  Готовые части сохранены: повторный запуск с теми же параметрами продолжит с них.")
+            raise
+        for pdf, error in errors:
+            print_error(f"Ошибка с файлом {pdf}: {error}")
+            failed_inputs.append(pdf)
+    else:
+        merger = create_pdf_engine(engine_name)
+        for index, pdf in enumerate(merge_inputs):
+            report_progress(index, len(merge_inputs))
+            if skip_broken:
+                try:
+                    merger.append(read_input_pdf(pdf))
+                except Exception as e:
+                    print_error(f"Ошибка с файлом {pdf}: {e}")
+                    failed_inputs.append(pdf)
+            else:
+                merger.append(read_input_pdf(pdf))
+
+    skipped_files = set()
+    for pdf in failed_inputs:
+        skipped_files.update(segment_files.get(pdf, [pdf]))
+    manifest = build_manifest(plan, output_name, skipped_files)
+    if get_setting("outline"):
+        merger.add_outline(build_outline(plan, manifest))
+    saved = save_merged_pdf(merger, save_path, output_name, manifest)
+    if not saved:
+        return None
+    if shard_dir:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    output_path = os.path.join(save_path, output_name)
+    if cache_key and not failed_inputs:
+        store_output_in_cache(cache_key, output_path)
+    return output_path
+
+
+def merge_volumes(plan, save_path, scenario, make_output_name, max_bytes, max_pages,
+                  skip_broken=False, use_segments=False):
+    """
+    Делит проверенный план на тома по ограничениям и склеивает тома одновременно в нескольких процессах.
+    Каждый том кэшируется отдельно. Возвращает список путей к томам (None, если какой-то том не сохранился).
+    """
+    volumes = split_plan_into_volumes(plan, max_bytes, max_pages)
+    if len(volumes) == 1:
+        output_names = [make_output_name(plan)]
+    else:
+        output_names = [volume_output_name(make_output_name(volume), index, len(volumes))
+                        for index, volume in enumerate(volumes, 1)]
+        print(f"Результат делится на тома: {len(volumes)} шт.")
+
+    output_paths = [None] * len(volumes)
+    pending = []
+    for index, (volume, output_name) in enumerate(zip(volumes, output_names)):
+        cache_key = get_output_cache_key(scenario, plan_files(volume))
+        if cache_key and restore_cached_output(cache_key, save_path, output_name,
+                                               lambda: build_manifest(volume, output_name)):
+            output_paths[index] = os.path.join(save_path, output_name)
+        else:
+            pending.append((index, volume, output_name, cache_key))
+
+    workers = min(get_setting("workers") or os.cpu_count() or 1, len(pending))
+    if workers > 1:
+        with create_process_pool(workers) as executor:
+            futures = [(index, executor.submit(write_plan, volume, save_path, output_name, cache_key,
+                                               skip_broken, use_segments, False))
+                       for index, volume, output_name, cache_key in pending]
+            try:
+                for index, future in futures:
+                    output_paths[index] = future.result()
+            except BaseException:
+                executor.shutdown(wait=False, cancel_futures=True)  # Не склеивать тома, которые еще не начаты
+                raise
+    else:
+        for index, volume, output_name, cache_key in pending:
+            output_paths[index] = write_plan(volume, save_path, output_name, cache_key,
+                                             skip_broken, use_segments)
+
+    if None in output_paths:
+        return None
+    return output_paths
+
+
+def merge_plan(plan, save_path, scenario, make_output_name, skip_broken=False, use_segments=False):
+    """
+    Скрепляет план - упорядоченный список комплектов {"folder": номер, "files": [пути]} - в один файл.
+    В сценариях по папкам отгрузок побайтно одинаковые комплекты скрепляются один раз.
+    Если тот же комплект уже собирался и входные файлы не менялись, файл берется из кэша.
+    Перед склейкой все файлы проверяются, чтобы склейка не падала на середине.
+    skip_broken - пропускать файлы с ошибками вместо остановки (такой результат не кэшируется).
+    use_segments - кэшировать комплекты из нескольких файлов как отдельные сегменты.
+    Если для сценария задан предельный размер или число страниц тома, результат делится на тома.
+    Возвращает путь к готовому файлу (для томов - список путей) или None.
+    """
+    # Вызов сценария напрямую (не через execute_job) - тоже одно задание: конфиг читается один раз.
+    with job_settings():
+        # Railway и Temp скрепляют ровно то, что положили в папку: копия там - тоже нужная страница.
+        if scenario in SHIPPING_SCENARIOS and get_setting("dedup_inputs"):
+            plan = drop_duplicate_inputs(plan)
+
+        max_bytes, max_pages = get_volume_limits(scenario)
+        if max_bytes or max_pages:
+            plan = validate_plan(plan, skip_broken)
+            if not plan:
+                return None
+            if use_segments:
+                prune_cache_dir(SEGMENT_CACHE_DIR, SEGMENT_CACHE_MAX_BYTES)
+            return merge_volumes(plan, save_path, scenario, make_output_name, max_bytes, max_pages,
+                                 skip_broken, use_segments)
+
+        output_name = make_output_name(plan)
+        cache_key = get_output_cache_key(scenario, plan_files(plan))
+        if cache_key and restore_cached_output(cache_key, save_path, output_name,
+                                               lambda: build_manifest(plan, output_name)):
+            return os.path.join(save_path, output_name)
+
+        valid_plan = validate_plan(plan, skip_broken)
+        if not valid_plan:
+            return None
+        if len(valid_plan) != len(plan) and skip_broken and not get_setting("quarantine_broken"):
+            # Как и при ошибке append: имя - по найденным файлам, а результат без пропущенных не кэшируется.
+            plan, cache_key = valid_plan, None
+        elif len(valid_plan) != len(plan):
+            plan = valid_plan
+            output_name = make_output_name(plan)
+            cache_key = get_output_cache_key(scenario, plan_files(plan))
+            if cache_key and restore_cached_output(cache_key, save_path, output_name,
+                                                   lambda: build_manifest(plan, output_name)):
+                return os.path.join(save_path, output_name)
+
+        if use_segments:
+            prune_cache_dir(SEGMENT_CACHE_DIR, SEGMENT_CACHE_MAX_BYTES)
+        return write_plan(plan, save_path, output_name, cache_key, skip_broken, use_segments)
+
+
+# ==========================================
+# ИЗВЛЕЧЕНИЕ ОТГРУЗОК ИЗ ГОТОВОГО ФАЙЛА (по описи)
+# ==========================================
+
+def load_manifest(bundle_path):
+    """Читает опись готового файла. Возвращает словарь или None, если описи нет."""
+    manifest_path = get_manifest_path(bundle_path)
+    if not os.path.isfile(manifest_path):
+        return None
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print_error(f"Не удалось прочитать опись {manifest_path}: {e}")
+        return None
+
+
+def manifest_from_outline(reader):
+    """
+    Восстанавливает опись по закладкам верхнего уровня (для файлов без .manifest.json):
+    папка закладки занимает страницы до начала следующей закладки. Возвращает опись или None.
+    """
+    starts = []
+    for item in reader.outline:
+        if isinstance(item, list):
+            continue  # Вложенные закладки (документы) идут списком после закладки папки
+        folder = get_number_from_string(item.title)
+        if folder != float('inf'):
+            starts.append((reader.get_destination_page_number(item), folder, item.title))
+    if not starts:
+        return None
+
+    page_count = len(reader.pages)
+    inputs = []
+    for index, (page_index, folder, title) in enumerate(starts):
+        next_start = starts[index + 1][0] if index + 1 < len(starts) else page_count
+        inputs.append({"source": title, "folder": folder, "sort_key": None,
+                       "page_start": page_index + 1, "page_end": next_start, "sha256": None})
+    return {"pages": page_count, "inputs": inputs}
+
+
+def extract_folders(bundle_path, folders, save_path=None):
+    """
+    Извлекает из готового файла страницы выбранных папок в отдельный файл (с собственной описью).
+    Диапазоны страниц берутся из описи (если ее нет - из закладок), из документа читаются только
+    нужные страницы, потоки переносятся без распаковки. Возвращает путь к новому файлу или None.
+    """
+    try:
+        # PdfReader по пути прочитал бы в память весь файл; из открытого файла читаются только
+        # xref, дерево страниц и сами извлекаемые страницы.
+        bundle_file = open(bundle_path, 'rb')
+    except OSError as e:
+        print_error(f"Не удалось открыть файл: {e}")
+        return None
+    with bundle_file:
+        return _extract_folders(bundle_path, bundle_file, folders, save_path)
+
+
+def _extract_folders(bundle_path, bundle_file, folders, save_path):
+    try:
+        reader = PdfReader(bundle_file)
+        manifest = load_manifest(bundle_path) or manifest_from_outline(reader)
+    except (OSError, PdfReadError) as e:
+        print_error(f"Не удалось открыть файл: {e}")
+        return None
+    if manifest is None:
+        print_error("У файла нет ни описи (.manifest.json), ни закладок - соберите его заново.")
+        return None
+
+    folders = set(folders)
+    entries = [entry for entry in manifest["inputs"] if entry["folder"] in folders]
+    if not entries:
+        print_error("В файле нет выбранных папок.")
+        return None
+
+    save_path = save_path or os.path.dirname(bundle_path)
+    range_str = generate_range_string([entry["folder"] for entry in entries])
+    file_name = f"{os.path.splitext(os.path.basename(bundle_path))[0]} - {range_str}.pdf"
+
+    page_indexes = []
+    extracted = {"output": file_name, "created": datetime.now().isoformat(timespec="seconds"),
+                 "source_bundle": os.path.abspath(bundle_path), "inputs": []}
+    for entry in entries:
+        pages = range(entry["page_start"] - 1, entry["page_end"])
+        extracted["inputs"].append(dict(entry, page_start=len(page_indexes) + 1,
+                                        page_end=len(page_indexes) + len(pages)))
+        page_indexes.extend(pages)
+    extracted["pages"] = len(page_indexes)
+
+    print(f"Извлечение: {range_str} ({len(page_indexes)} стр.) из {os.path.basename(bundle_path)} ...")
+    try:
+        merger = RawPdfEngine(dedup=False, object_streams=False).open()
+        merger.append_pages(reader, page_indexes)
+    except (OSError, IndexError, UnsupportedPdfError, PdfReadError) as e:
+        print_error(f"Не удалось извлечь страницы: {e}")
+        return None
+    if not save_merged_pdf(merger, save_path, file_name, extracted):
+        return None
+    return os.path.join(save_path, file_name)
+
+
+def process_extract():
+    print("\n[Выполняется: Извлечение отгрузок из готового файла]")
+    bundle_path = get_clean_path("Путь к готовому файлу")
+    if not os.path.isfile(bundle_path):
+        print_error("Файл не найден.")
+        return
+
+    folders = parse_folder_range(input(f"{BOLD}Номера папок (например: 3550-3553,3560):{RESET} ").strip())
+    if not folders:
+        print_error("Некорректный диапазон.")
+        return
+    extract_folders(bundle_path, folders)
+
+
+# ==========================================
+# ЛОГИКА 1: BindingInvSpec (Инвойсы и Спецификации)
+# ==========================================
+def process_inv_spec(source_path, save_path, valid_folders):
+    print("\n[Выполняется: Инвойсы и Спецификации]")
+
+    def get_invoice_num(fname):
+        match = re.search(r'Invoice (\d+)', fname, re.IGNORECASE)
+        return int(match.group(1)) if match else float('inf')
+
+    plan = []
+
+    for _, folder_path, f_num, file_names in get_folder_index().scan_shipment_folders(source_path, valid_folders):
+        for file_name in file_names:
+            if "invoice" in file_name.lower() and file_name.lower().endswith(".pdf"):
+                plan.append({"folder": f_num, "sort_key": get_invoice_num(file_name),
+                             "files": [os.path.join(folder_path, file_name)]})
+
+    if not plan:
+        print_error("Файлы Invoice не найдены.")
+        return
+
+    plan.sort(key=lambda item: item["sort_key"])
+
+    return merge_plan(plan, save_path, "inv_spec", folder_bundle_name("Inv. + Spec."), skip_broken=True)
+
+
+# ==========================================
+# ЛОГИКА 2: BindingGTDESD (Декларации и ЭСД)
+# ==========================================
+def process_gtd_esd(source_path, save_path, valid_folders, append=False):
+    print("\n[Выполняется: Декларации и ЭСД]")
+    plan = []
+
+    for folder_name, folder_path, f_num, file_names in get_folder_index().scan_shipment_folders(
+            source_path, valid_folders):
+        gtd_files = []
+        esd_files = []
+
+        for file_name in file_names:
+            if not file_name.lower().endswith(".pdf"): continue
+            if file_name.startswith("GTD_"):
+                gtd_files.append(os.path.join(folder_path, file_name))
+            elif file_name.count('-') == 4:
+                esd_files.append(os.path.join(folder_path, file_name))
+
+        if gtd_files and esd_files:
+            plan.append({"folder": f_num, "files": sorted(gtd_files)[:1] + sorted(esd_files)[:1]})
+        else:
+            print_error(f"Папка {folder_name} пропущена: некомплект.")
+
+    if not plan:
+        print_error("Не найдено пар GTD+ESD.")
+        return
+
+    if append:
+        extended = extend_existing_bundle(save_path, "GTD+ЭСД", plan)
+        if extended is not False:
+            return extended
+
+    return merge_plan(plan, save_path, "gtd_esd", folder_bundle_name("GTD+ЭСД"))
+
+
+# ==========================================
+# ЛОГИКА 3: BindingGTDInvSpec (GTD + Invoice + Spec)
+# ==========================================
+def process_gtd_inv_spec(source_path, save_path, valid_folders):
+    print("\n[Выполняется: Декларации, Инвойсы и Спецификации]")
+    release_dates_by_gtd = load_release_dates_from_sorting_sheet()
+    if release_dates_by_gtd is None:
+        return
+
+    valid_pairs = []
+    missing_gtd_numbers = []
+
+    for folder_name, folder_path, f_num, file_names in get_folder_index().scan_shipment_folders(
+            source_path, valid_folders):
+        gtd_files = []
+        inv_files = []
+
+        for file_name in sorted(file_names):
+            lower_name = file_name.lower()
+            if not lower_name.endswith(".pdf"): continue
+
+            if lower_name.startswith("gtd_"):
+                gtd_files.append(os.path.join(folder_path, file_name))
+            elif "invoice" in lower_name:
+                inv_files.append(os.path.join(folder_path, file_name))
+
+        gtd_path = gtd_files[0] if gtd_files else None
+        inv_path = inv_files[0] if inv_files else None
+
+        if gtd_path and inv_path:
+            normalized_gtd = normalize_gtd_number(os.path.basename(gtd_path))
+            release_entry = release_dates_by_gtd.get(normalized_gtd)
+
+            if release_entry is None:
+                missing_gtd_numbers.append(normalized_gtd or os.path.basename(gtd_path))
+                continue
+
+            sort_key = (release_entry["release_key"], normalized_gtd)
+            valid_pairs.append({
+                'folder': f_num,
+                'sort_key': sort_key,
+                'gtd': normalized_gtd,
+                'files': [gtd_path, inv_path]
+            })
+
+        elif gtd_path and not inv_path:
+            print_error(f"Папка {folder_name}: Найден GTD, но нет Invoice! (Пропущено)")
+
+        elif inv_path and not gtd_path:
+            print_error(f"Папка {folder_name}: Найден Invoice, но нет GTD! (Пропущено)")
+
+    if missing_gtd_numbers:
+        missing_list = ", ".join(sorted(set(missing_gtd_numbers)))
+        print_error(f'В файле "Sorting sheet.xlsx" отсутствуют номера ДТ: {missing_list}.')
+        print_error('Обновите файл "Sorting sheet.xlsx" и повторите запуск.')
+        return
+
+    if not valid_pairs:
+        print_error("Файлы для скрепления не найдены (или возникли ошибки комплектности).")
+        return
+
+    valid_pairs.sort(key=lambda x: x["sort_key"])
+
+    # Пары GTD + Invoice кэшируются как сегменты: одни и те же папки входят в разные выборки.
+    return merge_plan(valid_pairs, save_path, "gtd_inv_spec", folder_bundle_name("GTD+Inv. + Spec."),
+               use_segments=True)
+
+
+# ==========================================
+# ЛОГИКА 4: BindingGTD (Только Декларации)
+# ==========================================
+def process_gtd_only(source_path, save_path, valid_folders, append=False):
+    print("\n[Выполняется: Только Декларации (GTD)]")
+    plan = []
+
+    for _, folder_path, f_num, file_names in get_folder_index().scan_shipment_folders(source_path, valid_folders):
+        gtd_files = []
+        for file_name in file_names:
+            if file_name.lower().endswith(".pdf") and file_name.startswith("GTD_"):
+                gtd_files.append(os.path.join(folder_path, file_name))
+
+        if gtd_files:
+            plan.append({"folder": f_num, "files": sorted(gtd_files)[:1]})
+
+    if not plan:
+        print_error("GTD файлы не найдены.")
+        return
+
+    if append:
+        extended = extend_existing_bundle(save_path, "GTD", plan)
+        if extended is not False:
+            return extended
+
+    return merge_plan(plan, save_path, "gtd", folder_bundle_name("GTD"))
 
 
 # ==========================================
 # ЛОГИКА 5: Ж/Д Накладные (Railway)
 # ==========================================
-def process_railway():
+def process_railway(source_folder=None, save_folder=None):
     print("\n[Выполняется: Ж/Д накладные по 4 шт.]")
 
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    source_folder = os.path.join(script_dir, "Railway")
-    save_folder = os.path.join(script_dir, "Merged Railway")
+    source_folder = source_folder or os.path.join(script_dir, "Railway")
+    save_folder = save_folder or os.path.join(script_dir, "Merged Railway")
 
     if not os.path.exists(source_folder):
         print_error(f"Папка Railway не найдена по пути: {source_folder}")
         print("Создайте папку 'Railway' рядом со скриптом.")
         return
 
-    files = [f for f in os.listdir(source_folder) if f.lower().endswith('.pdf')]
+    files = [f for f in call_with_retry(source_folder, os.listdir, source_folder) if f.lower().endswith('.pdf')]
     if not files:
         print_error("В папке Railway нет PDF файлов.")
         return
@@ -578,33 +3119,63 @@ def process_railway():
     if not os.path.exists(save_folder):
         os.makedirs(save_folder)
 
+    output_paths = []
     for chunk in chunks:
-        merger = PdfMerger()
-        file_numbers = []
-
         print(f"Скрепляю ({len(chunk)} шт): {chunk[0]} ... {chunk[-1]}")
 
-        for fname in chunk:
-            full_path = os.path.join(source_folder, fname)
-            merger.append(full_path)
-            file_numbers.append(get_number_from_string(fname))
-
-        range_str = generate_range_string(file_numbers)
-        output_name = f"Railway {range_str} {len(chunk)} pcs..pdf"
-
-        save_merged_pdf(merger, save_folder, output_name)
+        plan = [{"folder": get_number_from_string(fname), "files": [os.path.join(source_folder, fname)]}
+                for fname in chunk]
+        output_paths.append(merge_plan(plan, save_folder, "railway", folder_bundle_name("Railway")))
 
     print(f"\n✅ Все файлы обработаны. Сохранено в: {save_folder}")
+    return output_paths
 
 
 # ==========================================
 # ЛОГИКА TEMP (Папка Temp)
 # ==========================================
-def process_temp_folder():
+COMBINED_COUNTER_FILE = "Combined.counter"  # Последний выданный номер Combined-N (в папке Combined)
+_combined_counter_lock = threading.Lock()  # Блокировка файла действует между процессами, а не потоками
+
+
+def find_last_combined_number(combined_folder):
+    """Наибольший N среди файлов Combined-N.pdf в папке (0, если их нет)."""
+    nums = [0]
+    for f in os.listdir(combined_folder):
+        if f.startswith("Combined") and f.endswith(".pdf"):
+            m = re.search(r"Combined-(\d+)", f)
+            if m: nums.append(int(m.group(1)))
+    return max(nums)
+
+
+def take_next_combined_number(combined_folder):
+    """
+    Выдает следующий номер Combined-N. Последний номер хранится в файле-счетчике рядом с результатами
+    и меняется под блокировкой, поэтому два оператора (или два задания службы) не получат один номер,
+    а папку с десятками тысяч файлов не нужно перечитывать. Первый раз счетчик заполняется по
+    имеющимся файлам. Номер выдается до склейки: если она не удалась, номер пропускается.
+    """
+    counter_path = os.path.join(combined_folder, COMBINED_COUNTER_FILE)
+    with _combined_counter_lock, locked_file(counter_path) as counter:
+        counter.seek(0)
+        text = counter.read().decode("ascii", "ignore").strip()
+        next_num = int(text) + 1 if text.isdigit() else find_last_combined_number(combined_folder) + 1
+        # Файл с этим номером мог появиться в обход счетчика (старая версия программы, ручное копирование).
+        while os.path.exists(os.path.join(combined_folder, f"Combined-{next_num}.pdf")):
+            next_num += 1
+        counter.truncate(0)
+        counter.write(str(next_num).encode("ascii"))
+        counter.flush()
+        os.fsync(counter.fileno())
+    return next_num
+
+
+def process_temp_folder(temp_folder=None, combined_folder=None, pdf_files=None):
+    """pdf_files - скрепить только эти имена файлов (по умолчанию - все PDF из папки)."""
     print("\n[Выполняется: Скрепление из папки Temp]")
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    temp_folder = os.path.join(script_dir, "Temp")
-    combined_folder = os.path.join(script_dir, "Combined")
+    temp_folder = temp_folder or os.path.join(script_dir, "Temp")
+    combined_folder = combined_folder or os.path.join(script_dir, "Combined")
 
     if not os.path.exists(temp_folder):
         print_error("Папка Temp не найдена.")
@@ -614,30 +3185,680 @@ def process_temp_folder():
         match = re.match(r"^(\d+),", filename)
         return int(match.group(1)) if match else float('inf')
 
-    pdf_files = [f for f in os.listdir(temp_folder) if f.lower().endswith(".pdf")]
+    if pdf_files is None:
+        pdf_files = [f for f in call_with_retry(temp_folder, os.listdir, temp_folder) if f.lower().endswith(".pdf")]
     sorted_pdfs = sorted(pdf_files, key=extract_temp_number)
 
     if not sorted_pdfs:
         print_error("В папке Temp нет PDF файлов.")
         return
 
-    merger = PdfMerger()
-    for pdf in sorted_pdfs:
-        merger.append(os.path.join(temp_folder, pdf))
-
     if not os.path.exists(combined_folder): os.makedirs(combined_folder)
 
-    existing = [f for f in os.listdir(combined_folder) if f.startswith("Combined") and f.endswith(".pdf")]
-    next_num = 1
-    if existing:
-        nums = []
-        for f in existing:
-            m = re.search(r"Combined-(\d+)", f)
-            if m: nums.append(int(m.group(1)))
-        if nums: next_num = max(nums) + 1
+    out_name = f"Combined-{take_next_combined_number(combined_folder)}.pdf"
+    plan = [{"folder": None, "sort_key": extract_temp_number(pdf), "files": [os.path.join(temp_folder, pdf)]}
+            for pdf in sorted_pdfs]
+    return merge_plan(plan, combined_folder, "temp", lambda items: out_name)
+
+
+# ==========================================
+# НАБЛЮДЕНИЕ ЗА ПАПКОЙ TEMP (автоматическое скрепление)
+# ==========================================
+
+def snapshot_pdfs(folder):
+    """Снимок PDF в папке за один проход: имя -> (размер, mtime)."""
+    snapshot = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(".pdf") and entry.is_file():
+                stat = entry.stat()
+                snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+
+def pdf_is_complete(pdf_path):
+    """
+    Файл дописан: его можно открыть на чтение, и в конце есть маркер %%EOF.
+    Копируемый файл Windows держит заблокированным, а при копировании с заранее заданным
+    размером конец файла еще пуст - в обоих случаях файл не готов.
+    """
+    try:
+        with open(pdf_path, 'rb') as f_in:
+            f_in.seek(0, os.SEEK_END)
+            f_in.seek(max(0, f_in.tell() - 1024))
+            return b"%%EOF" in f_in.read()
+    except OSError:
+        return False
+
+
+class PollingWaiter:
+    """Ожидание изменений в папке простым опросом."""
+
+    def __init__(self, poll_seconds):
+        self.poll_seconds = poll_seconds
+
+    def wait(self, timeout=None):
+        time.sleep(self.poll_seconds if timeout is None else min(timeout, self.poll_seconds))
+
+    def close(self):
+        pass
+
+
+class InotifyWaiter:
+    """
+    Ожидание изменений в папке через inotify (Linux): поток спит, пока в папке ничего не происходит.
+    События только будят наблюдателя, изменения все равно определяются по снимку папки.
+    """
+
+    MASK = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200  # MODIFY ATTRIB CLOSE_WRITE MOVED_* CREATE DELETE
+    # На смонтированных сетевых папках события об изменениях с других машин не приходят,
+    # поэтому папка все равно перечитывается хотя бы раз в RESCAN_SECONDS.
+    RESCAN_SECONDS = 30
+
+    def __init__(self, folder):
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        if libc.inotify_add_watch(self._fd, os.fsencode(folder), self.MASK) < 0:
+            error = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(error, "inotify_add_watch")
+
+    def wait(self, timeout=None):
+        ready, _, _ = select.select([self._fd], [], [], self.RESCAN_SECONDS if timeout is None else timeout)
+        if ready:
+            try:
+                while os.read(self._fd, 64 * 1024):
+                    pass
+            except BlockingIOError:
+                pass  # Все события прочитаны
+
+    def close(self):
+        os.close(self._fd)
+
+
+def create_change_waiter(folder, poll_seconds):
+    """inotify, если он есть (Linux), иначе опрос."""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWaiter(folder)
+        except (OSError, AttributeError):
+            pass
+    return PollingWaiter(poll_seconds)
+
+
+def watch_temp_folder(temp_folder=None, combined_folder=None):
+    """
+    Следит за папкой Temp и, когда файлы в ней перестают меняться (watch_debounce_seconds),
+    скрепляет в следующий Combined-N.pdf файлы, которые появились (или изменились) после прошлой
+    удачной склейки. Скрепляются только файлы из проверенного снимка, и только если все они
+    дописаны: недокопированный файл откладывает склейку. Работает до Ctrl+C.
+    """
+    temp_folder = temp_folder or os.path.join(script_dir, "Temp")
+    if not os.path.isdir(temp_folder):
+        print_error("Папка Temp не найдена.")
+        return
+
+    debounce = get_setting("watch_debounce_seconds")
+    waiter = create_change_waiter(temp_folder, get_setting("watch_poll_seconds"))
+    # Снимок, по которому уже была попытка склейки: следующая - только после изменений в папке.
+    handled_snapshot = last_snapshot = snapshot_pdfs(temp_folder)
+    merged_files = {}  # Файлы, уже вошедшие в какой-то Combined-N: имя -> (размер, mtime)
+    last_change = time.monotonic()
+    waiting_message = None
+
+    print(f"\n[Наблюдение за папкой Temp: {temp_folder}]")
+    mode = "inotify" if isinstance(waiter, InotifyWaiter) else "опрос"
+    print(f"Скрепление через {debounce} с после последнего изменения ({mode}). Ctrl+C - остановить.")
+    if handled_snapshot:
+        print(f"ℹ️  В папке уже {len(handled_snapshot)} PDF, они войдут в файл при следующем изменении.")
+    try:
+        while True:
+            pending = last_snapshot != handled_snapshot and last_snapshot
+            waiter.wait(max(0.1, debounce - (time.monotonic() - last_change)) if pending else None)
+
+            try:
+                snapshot = snapshot_pdfs(temp_folder)
+            except OSError as e:
+                print_error(f"Папка Temp недоступна: {e}")
+                continue
+            if snapshot != last_snapshot:
+                last_snapshot = snapshot
+                last_change = time.monotonic()
+                continue
+            if snapshot == handled_snapshot or not snapshot or time.monotonic() - last_change < debounce:
+                continue
+
+            new_files = [name for name, stat in snapshot.items() if merged_files.get(name) != stat]
+            if not new_files:
+                handled_snapshot = snapshot  # Файлы только удалили: скреплять нечего
+                continue
+            incomplete = [name for name in new_files if not pdf_is_complete(os.path.join(temp_folder, name))]
+            if incomplete:
+                message = f"ℹ️  Жду, пока допишутся файлы: {', '.join(sorted(incomplete)[:5])}"
+                if message != waiting_message:
+                    print(message)
+                    waiting_message = message
+                last_change = time.monotonic()
+                continue
+
+            waiting_message = None
+            handled_snapshot = snapshot
+            try:
+                with job_settings():
+                    merged = process_temp_folder(temp_folder, combined_folder, pdf_files=new_files)
+            except Exception as e:
+                print_error(f"Не удалось скрепить файлы: {e}")
+                merged = None
+            finally:
+                print_io_report(take_io_events())
+            if not merged:
+                # Сбой одной склейки (сеть, диск, поврежденный файл) не останавливает наблюдение:
+                # эти файлы остаются несклеенными и войдут в файл после следующего изменения в папке.
+                print("Жду изменений в папке ...")
+                continue
+            merged_files = {name: stat for name, stat in merged_files.items() if name in snapshot}
+            merged_files.update((name, snapshot[name]) for name in new_files)
+            print("Жду новых файлов ...")
+    except KeyboardInterrupt:
+        print("\nНаблюдение остановлено.")
+    finally:
+        waiter.close()
+
+
+# ==========================================
+# СЛУЖБА СКЛЕЙКИ (локальный HTTP)
+# ==========================================
+# Долгоживущий процесс держит в памяти индекс папок, таблицу Sorting sheet и кэш метаданных
+# и принимает задания склейки по HTTP на 127.0.0.1. Меню и командная строка передают задания
+# службе, если она запущена, поэтому каждое задание - это только сама склейка.
+# Задания стоят в общей очереди с приоритетами и выполняются несколькими потоками.
+
+SERVICE_HOST = "127.0.0.1"
+# Ключ доступа к службе: создается при первом запуске службы рядом с config.json и читается клиентами.
+# Порт на 127.0.0.1 доступен и веб-страницам в браузере оператора, а ключ они прочитать не могут.
+SERVICE_TOKEN_FILE = os.path.join(script_dir, "service.token")
+
+
+def get_service_token(create=False):
+    """Ключ доступа к службе склейки (None, если его еще нет и create=False)."""
+    try:
+        with open(SERVICE_TOKEN_FILE, 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        if not create:
+            return None
+    token = secrets.token_urlsafe(32)
+    try:
+        # Только для владельца: ключ дает право ставить задания с записью в любую папку.
+        fd = os.open(SERVICE_TOKEN_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return get_service_token()  # Его только что создал другой запуск службы
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(token)
+    return token
+
+# Сценарии отгрузочных документов: имя задания -> функция (source_path, save_path, valid_folders)
+SHIPPING_SCENARIOS = {
+    "inv_spec": process_inv_spec,
+    "gtd_esd": process_gtd_esd,
+    "gtd_inv_spec": process_gtd_inv_spec,
+    "gtd": process_gtd_only,
+}
+JOB_SCENARIOS = tuple(SHIPPING_SCENARIOS) + ("railway", "temp")
+
+# Классы приоритета: срочный таможенный комплект идет раньше ночного архива.
+JOB_PRIORITIES = {"urgent": 0, "normal": 1, "archive": 2}
+
+
+def validate_job(job):
+    """
+    Проверяет задание склейки: {"scenario": имя, "folders": [номера], "source": путь,
+    "destination": путь, "append": bool}. Для railway и temp папки необязательны
+    (по умолчанию - рядом со скриптом). Некорректное задание - ValueError.
+    """
+    scenario = job.get("scenario")
+    if scenario in ("railway", "temp"):
+        return
+    if scenario not in SHIPPING_SCENARIOS:
+        raise ValueError(f"Неизвестный сценарий: {scenario}.")
+
+    folders = job.get("folders") or []
+    if not folders or not all(isinstance(f_num, int) for f_num in folders):
+        raise ValueError("Не задан диапазон папок.")
+    source, destination = job.get("source"), job.get("destination")
+    if not source or not os.path.isdir(source):
+        raise ValueError(f"Исходная папка не найдена: {source}")
+    if not destination:
+        raise ValueError("Не задана папка сохранения.")  # Саму папку создаст сохранение
+    if job.get("append") and scenario not in ("gtd_esd", "gtd"):
+        raise ValueError("Дополнить можно только файлы сценариев gtd_esd и gtd.")
+
+
+def execute_job(job):
+    """Выполняет задание склейки в текущем потоке и возвращает результат process_* (пути готовых файлов)."""
+    validate_job(job)
+    scenario = job["scenario"]
+    source, destination = job.get("source"), job.get("destination")
+    take_io_events()  # Поток службы выполняет задания по очереди: прежние события к этому не относятся
+    try:
+        with job_settings():
+            if scenario == "railway":
+                return process_railway(source, destination)
+            if scenario == "temp":
+                return process_temp_folder(source, destination)
+            if job.get("append"):
+                return SHIPPING_SCENARIOS[scenario](source, destination, job["folders"], append=True)
+            return SHIPPING_SCENARIOS[scenario](source, destination, job["folders"])
+    finally:
+        print_io_report(take_io_events())
+
+
+class ThreadOutput:
+    """Замена sys.stdout: вывод потока, выполняющего задание, пишется в буфер задания, остальной - на консоль."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def capture(self, buffer):
+        self._local.buffer = buffer
+        try:
+            yield buffer
+        finally:
+            self._local.buffer = None
+
+    def write(self, text):
+        buffer = getattr(self._local, "buffer", None)
+        return (buffer or self._stream).write(text)
+
+    def flush(self):
+        self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class MergeJob:
+    """Задание в очереди службы: состояние, ход выполнения и вывод."""
+
+    FINISHED_STATES = ("done", "failed", "cancelled")
+
+    def __init__(self, job_id, spec, priority):
+        self.id = job_id
+        self.spec = spec
+        self.priority = priority
+        self.state = "queued"  # queued -> running -> done / failed / cancelled
+        self.progress = None  # (сделано, всего) файлов текущей склейки
+        self.result = None
+        self.error = None
+        self.log = StringIO()
+        self.cancel_requested = False
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def key(self):
+        """Одинаковые задания (тот же сценарий, папки и пути) выполняются один раз."""
+        return (self.spec.get("scenario"), tuple(sorted(self.spec.get("folders") or [])),
+                self.spec.get("source"), self.spec.get("destination"), bool(self.spec.get("append")))
+
+    def to_dict(self, log_from=None):
+        data = {
+            "id": self.id,
+            "scenario": self.spec.get("scenario"),
+            "priority": next(name for name, value in JOB_PRIORITIES.items() if value == self.priority),
+            "state": self.state,
+            "progress": self.progress,
+            "cancel_requested": self.cancel_requested,
+            "result": self.result,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if log_from is not None:
+            log = self.log.getvalue()
+            data["log"] = log[log_from:]
+            data["log_size"] = len(log)
+        return data
+
+
+class JobScheduler:
+    """
+    Очередь заданий службы: ограниченный пул потоков, классы приоритета, отмена и
+    объединение одинаковых заданий. Каждое задание выполняется функциями process_*.
+    """
+
+    KEEP_FINISHED = 200  # Сколько завершенных заданий помнить для запросов состояния
+
+    def __init__(self, workers):
+        self._condition = threading.Condition()
+        self._queue = []  # Куча (приоритет, номер, задание); устаревшие записи пропускаются
+        self._jobs = {}
+        self._next_id = 1
+        for index in range(workers):
+            threading.Thread(target=self._work, name=f"merge-worker-{index + 1}", daemon=True).start()
+
+    def submit(self, spec, priority="normal"):
+        """Ставит задание в очередь. Возвращает (задание, True - если такое уже было в очереди)."""
+        if priority not in JOB_PRIORITIES:
+            raise ValueError(f"Неизвестный приоритет: {priority}. Варианты: {', '.join(JOB_PRIORITIES)}.")
+        validate_job(spec)
+        priority = JOB_PRIORITIES[priority]
+        with self._condition:
+            job = MergeJob(self._next_id, spec, priority)
+            for other in self._jobs.values():
+                if other.state in ("queued", "running") and not other.cancel_requested and other.key == job.key:
+                    if other.state == "queued" and priority < other.priority:
+                        other.priority = priority  # Срочный повтор поднимает уже стоящее задание
+                        heapq.heappush(self._queue, (other.priority, other.id, other))
+                        self._condition.notify()
+                    return other, True
+
+            self._next_id += 1
+            self._jobs[job.id] = job
+            heapq.heappush(self._queue, (priority, job.id, job))
+            self._forget_finished()
+            self._condition.notify()
+            return job, False
+
+    def cancel(self, job_id):
+        """Отменяет задание: из очереди - сразу, выполняющееся - на ближайшем файле. Возвращает задание."""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.state in MergeJob.FINISHED_STATES:
+                return job
+            if job.state == "queued":
+                job.state = "cancelled"
+                job.finished = time.time()
+            else:
+                job.cancel_requested = True
+            return job
+
+    def get(self, job_id):
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._condition:
+            return list(self._jobs.values())
+
+    def _forget_finished(self):
+        finished = [job for job in self._jobs.values() if job.state in MergeJob.FINISHED_STATES]
+        for job in sorted(finished, key=lambda item: item.finished)[:max(0, len(finished) - self.KEEP_FINISHED)]:
+            del self._jobs[job.id]
+
+    def _take(self):
+        with self._condition:
+            while True:
+                while self._queue:
+                    priority, _, job = heapq.heappop(self._queue)
+                    if job.state == "queued" and priority == job.priority:
+                        job.state = "running"
+                        job.started = time.time()
+                        return job
+                self._condition.wait()
+
+    def _work(self):
+        while True:
+            job = self._take()
+            _running_job.job = job
+            try:
+                with sys.stdout.capture(job.log):
+                    try:
+                        job.result = execute_job(job.spec)
+                        job.state = "done"
+                    except JobCancelled:
+                        print("\nЗадание отменено.")
+                        job.state = "cancelled"
+                    except Exception as e:
+                        job.error = str(e) or e.__class__.__name__
+                        print_error(f"Ошибка выполнения задания: {job.error}")
+                        job.state = "failed"
+            finally:
+                _running_job.job = None
+                job.finished = time.time()
+            print(f"Задание {job.id} ({job.spec.get('scenario')}): {job.state}, "
+                  f"{job.finished - job.started:.1f} с")
+
+
+class MergeService:
+    """Состояние службы: очередь заданий и общие для всех заданий кэши."""
+
+    def __init__(self, workers):
+        self.started = time.time()
+        self.scheduler = JobScheduler(workers)
+
+    def warm_up(self):
+        """Заранее читает таблицу Sorting sheet и папки отгрузок из config.json."""
+        if os.path.exists(SORTING_SHEET_FILE):
+            load_release_dates_from_sorting_sheet()
+        source_path = (load_config() or {}).get("source_path", "")
+        if os.path.isdir(source_path):
+            get_folder_index().warm_up(source_path)
+
+    def status(self):
+        states = {}
+        for job in self.scheduler.jobs():
+            states[job.state] = states.get(job.state, 0) + 1
+        return {"pid": os.getpid(), "uptime": time.time() - self.started, "jobs": states}
+
+
+class MergeServiceHandler(BaseHTTPRequestHandler):
+    """
+    GET /status - состояние службы; GET /jobs - очередь;
+    POST /jobs - поставить задание ({"priority": "urgent" | "normal" | "archive", ...});
+    GET /jobs/<номер>?log_from=N - состояние задания и вывод с позиции N; DELETE /jobs/<номер> - отменить.
+    Каждый запрос - с заголовком "Authorization: Bearer <ключ из service.token>", тело POST - application/json.
+    """
+
+    service = None
+    token = None
+
+    def send_json(self, code, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def authorized(self):
+        """Проверяет ключ доступа (иначе отвечает 401)."""
+        scheme, _, token = (self.headers.get("Authorization") or "").partition(" ")
+        if scheme == "Bearer" and hmac.compare_digest(token.encode("utf-8"), self.token.encode("utf-8")):
+            return True
+        self.send_json(401, {"error": "Нужен ключ доступа из service.token."})
+        return False
+
+    def find_job(self):
+        """Задание из адреса /jobs/<номер> (или None с ответом 404)."""
+        match = re.fullmatch(r"/jobs/(\d+)", urllib.parse.urlsplit(self.path).path)
+        job = self.service.scheduler.get(int(match.group(1))) if match else None
+        if job is None:
+            self.send_json(404, {"error": "Задание не найдено."})
+        return job
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/status":
+            self.send_json(200, self.service.status())
+        elif url.path == "/jobs":
+            self.send_json(200, [job.to_dict() for job in self.service.scheduler.jobs()])
+        else:
+            job = self.find_job()
+            if job is not None:
+                query = urllib.parse.parse_qs(url.query)
+                self.send_json(200, job.to_dict(log_from=int(query.get("log_from", ["0"])[0])))
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        if self.path != "/jobs":
+            self.send_json(404, {"error": "Нет такого адреса."})
+            return
+        # Формы и простые запросы из браузера приходят как text/plain или form-data.
+        if self.headers.get_content_type() != "application/json":
+            self.send_json(415, {"error": "Задание принимается только как application/json."})
+            return
+        try:
+            spec = self.read_json()
+            if not isinstance(spec, dict):
+                raise ValueError("Задание должно быть объектом JSON.")
+            priority = spec.pop("priority", "normal")
+            job, duplicate = self.service.scheduler.submit(spec, priority)
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        self.send_json(202, dict(job.to_dict(), duplicate=duplicate))
+
+    def do_DELETE(self):
+        if not self.authorized():
+            return
+        job = self.find_job()
+        if job is not None:
+            self.send_json(200, self.service.scheduler.cancel(job.id).to_dict())
+
+    def log_message(self, format, *args):
+        pass  # Журнал запросов не нужен: служба сама печатает строку на каждое задание
+
+
+def serve(port=None):
+    """Запускает службу склейки и работает до Ctrl+C."""
+    port = port or get_setting("service_port")
+    service = MergeService(get_setting("service_workers"))
+    handler = type("Handler", (MergeServiceHandler,),
+                   {"service": service, "token": get_service_token(create=True)})
+    try:
+        server = ThreadingHTTPServer((SERVICE_HOST, port), handler)
+    except OSError as e:
+        print_error(f"Не удалось открыть порт {port}: {e}")
+        return 1
+
+    sys.stdout = ThreadOutput(sys.stdout)
+    print(f"Служба склейки: http://{SERVICE_HOST}:{port} (Ctrl+C - остановить)")
+    print("Подготовка кэшей ...")
+    service.warm_up()
+    print(f"✅ Служба готова принимать задания (одновременно: {get_setting('service_workers')}).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nСлужба остановлена.")
+    finally:
+        server.server_close()
+    return 0
+
+
+def service_request(method, path, data=None, timeout=None):
+    """Запрос к службе склейки. Ошибки соединения - OSError (URLError), ответ с ошибкой - ValueError."""
+    token = get_service_token()
+    if token is None:
+        raise ConnectionRefusedError("служба склейки еще не запускалась (нет service.token)")
+    body = json.dumps(data).encode("utf-8") if data is not None else None
+    request = urllib.request.Request(f"http://{SERVICE_HOST}:{get_setting('service_port')}{path}",
+                                     data=body, method=method,
+                                     headers={"Content-Type": "application/json",
+                                              "Authorization": f"Bearer {token}"})
+    # Прокси из переменных окружения для локальной службы не нужен.
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+    try:
+        with opener.open(request, timeout=timeout) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        raise ValueError(json.load(e).get("error") or str(e))
+
 
-    out_name = f"Combined-{next_num}.pdf"
-    save_merged_pdf(merger, combined_folder, out_name)
+def service_available():
+    """Запущена ли служба склейки на этой машине."""
+    try:
+        service_request("GET", "/status", timeout=0.5)
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+def wait_for_service_job(job_id):
+    """Печатает вывод задания по мере выполнения и ждет завершения. Ctrl+C отменяет задание."""
+    log_size = 0
+    while True:
+        try:
+            job = service_request("GET", f"/jobs/{job_id}?log_from={log_size}")
+            print(job["log"], end="", flush=True)
+            log_size = job["log_size"]
+            if job["state"] in MergeJob.FINISHED_STATES:
+                return job
+            time.sleep(0.3)
+        except KeyboardInterrupt:
+            print("\nОтменяю задание ...")
+            service_request("DELETE", f"/jobs/{job_id}")
+
+
+def dispatch_job(job, priority="normal"):
+    """
+    Выполняет задание в службе склейки, если она запущена (теплые кэши, общая очередь),
+    иначе - здесь же. Возвращает результат задания (пути готовых файлов) или None.
+    """
+    if not service_available():
+        try:
+            return execute_job(job)
+        except ValueError as e:
+            print_error(str(e))
+            return None
+
+    # У службы своя текущая папка: относительные пути передаем полными.
+    job = dict(job, **{key: os.path.abspath(job[key]) for key in ("source", "destination") if job.get(key)})
+    try:
+        queued = service_request("POST", "/jobs", dict(job, priority=priority))
+        if queued["duplicate"]:
+            print(f"ℹ️  Такое же задание уже в очереди службы (№ {queued['id']}), жду его.")
+        else:
+            print(f"ℹ️  Задание передано службе склейки (№ {queued['id']}).")
+        finished = wait_for_service_job(queued["id"])
+    except ValueError as e:
+        print_error(str(e))
+        return None
+    except OSError as e:
+        print_error(f"Служба склейки не ответила: {e}")
+        return None
+    return finished["result"] if finished["state"] == "done" else None
+
+
+def print_service_jobs():
+    """Очередь службы склейки: номер, сценарий, приоритет, состояние, ход."""
+    try:
+        jobs = service_request("GET", "/jobs", timeout=5)
+    except (OSError, ValueError):
+        print_error("Служба склейки не запущена.")
+        return 1
+    for job in jobs:
+        progress = f"{job['progress'][0]}/{job['progress'][1]}" if job["progress"] else ""
+        print(f"{job['id']:>5}  {job['scenario']:<13} {job['priority']:<8} {job['state']:<10} {progress}")
+    if not jobs:
+        print("Очередь пуста.")
+    return 0
+
+
+def cancel_service_job(job_id):
+    try:
+        job = service_request("DELETE", f"/jobs/{job_id}", timeout=5)
+    except (OSError, ValueError) as e:
+        print_error(f"Не удалось отменить задание: {e}")
+        return 1
+    print(f"Задание {job_id}: {'будет остановлено' if job['cancel_requested'] else job['state']}.")
+    return 0
 
 
 # ==========================================
@@ -654,6 +3875,8 @@ def main():
         print("1. Отгрузочные документы (GTD, Invoice, ESD)")
         print("2. Документы из папки Temp")
         print("3. Ж/Д накладные из папки Railway")
+        print("4. Извлечь отгрузки из готового файла")
+        print("5. Следить за папкой Temp и скреплять автоматически")
         print("0. Выход")
 
         main_choice = input(f"\n{BOLD}Ваш выбор:{RESET} ").strip()
@@ -663,10 +3886,16 @@ def main():
             break
 
         elif main_choice == '2':
-            process_temp_folder()
+            dispatch_job({"scenario": "temp"})
 
         elif main_choice == '3':
-            process_railway()
+            dispatch_job({"scenario": "railway"})
+
+        elif main_choice == '4':
+            process_extract()
+
+        elif main_choice == '5':
+            watch_temp_folder()
 
         elif main_choice == '1':
             shipping_docs_workflow()
@@ -778,6 +4007,13 @@ def shipping_docs_workflow():
 
             print(f"✔ Будут обработаны папки: {folders}")
             valid_folders = folders
+            # Пока пользователь выбирает тип скрепления, собираем сведения о файлах в фоне
+            # (служба склейки, если запущена, держит их сама).
+            try:
+                if not service_available():
+                    get_metadata_cache().index_in_background(list_folder_pdfs(source_path, set(folders)))
+            except (OSError, sqlite3.Error) as e:
+                print_error(f"Не удалось запустить индексацию файлов: {e}")
             current_state = 'SELECT_TYPE'
 
         # ----------------------------------------
@@ -797,6 +4033,7 @@ def shipping_docs_workflow():
             print("2. Декларации и ЭСД")
             print("3. Декларации, Инвойсы и Спецификации")
             print("4. Декларации (Только GTD)")
+            print("5. Дополнить готовый файл новыми папками (сценарии 2 и 4)")
             print("-" * 30)
             print("6. Возврат к выбору диапазона номеров")
             print("7. Изменить пути (возврат к выбору папки)")
@@ -814,21 +4051,70 @@ def shipping_docs_workflow():
                 continue
 
             # Действия
+            job = {"folders": valid_folders, "source": source_path, "destination": save_path}
             if choice == '1':
-                process_inv_spec(source_path, save_path, valid_folders)
+                dispatch_job(dict(job, scenario="inv_spec"))
             elif choice == '2':
-                process_gtd_esd(source_path, save_path, valid_folders)
+                dispatch_job(dict(job, scenario="gtd_esd"))
             elif choice == '3':
-                process_gtd_inv_spec(source_path, save_path, valid_folders)
+                dispatch_job(dict(job, scenario="gtd_inv_spec"))
             elif choice == '4':
-                process_gtd_only(source_path, save_path, valid_folders)
+                dispatch_job(dict(job, scenario="gtd"))
+            elif choice == '5':
+                sub_choice = input(f"{BOLD}Какой файл дополнить (2 - GTD+ЭСД, 4 - только GTD):{RESET} ").strip()
+                if sub_choice == '2':
+                    dispatch_job(dict(job, scenario="gtd_esd", append=True))
+                elif sub_choice == '4':
+                    dispatch_job(dict(job, scenario="gtd", append=True))
+                else:
+                    print_error("Неверный выбор.")
             else:
                 print_error("Неверный выбор.")
                 time.sleep(1)
 
 
+def parse_command_line():
+    parser = argparse.ArgumentParser(
+        description="Утилита скрепления документов. Без параметров открывается меню.")
+    parser.add_argument("--serve", action="store_true", help="запустить службу склейки на 127.0.0.1")
+    parser.add_argument("--port", type=int, help="порт службы (по умолчанию service_port из config.json)")
+    parser.add_argument("--job", choices=JOB_SCENARIOS, help="выполнить одно задание и выйти")
+    parser.add_argument("--watch-temp", action="store_true", help="следить за папкой Temp и скреплять автоматически")
+    parser.add_argument("--range", help="диапазон папок, например 3550-3553,3560")
+    parser.add_argument("--source", help="исходная папка (по умолчанию из config.json)")
+    parser.add_argument("--save", help="папка сохранения (по умолчанию из config.json)")
+    parser.add_argument("--append", action="store_true", help="дополнить готовый файл (gtd_esd, gtd)")
+    parser.add_argument("--priority", choices=JOB_PRIORITIES, default="normal", help="приоритет задания в службе")
+    parser.add_argument("--jobs", action="store_true", help="показать очередь службы склейки")
+    parser.add_argument("--cancel", type=int, metavar="НОМЕР", help="отменить задание службы склейки")
+    return parser.parse_args()
+
+
+def run_command_line_job(args):
+    """Задание из командной строки. Код выхода 0, если файл собран."""
+    job = {"scenario": args.job, "source": args.source, "destination": args.save, "append": args.append}
+    if args.job in SHIPPING_SCENARIOS:
+        config = load_config() or {}
+        job["source"] = args.source or config.get("source_path")
+        job["destination"] = args.save or config.get("save_path")
+        job["folders"] = parse_folder_range(args.range or "")
+    return 0 if dispatch_job(job, args.priority) else 1
+
+
 if __name__ == "__main__":
+    command_line = parse_command_line()
     try:
-        main()
+        if command_line.serve:
+            sys.exit(serve(command_line.port))
+        elif command_line.job:
+            sys.exit(run_command_line_job(command_line))
+        elif command_line.watch_temp:
+            watch_temp_folder(command_line.source, command_line.save)
+        elif command_line.jobs:
+            sys.exit(print_service_jobs())
+        elif command_line.cancel:
+            sys.exit(cancel_service_job(command_line.cancel))
+        else:
+            main()
     except KeyboardInterrupt:
         print("\nПрограмма остановлена.")
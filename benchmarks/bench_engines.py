@@ -0,0 +1,165 @@
+"""
+Сравнение движков склейки на одних и тех же планах: время, пиковая память, размер результата.
+
+Запуск:
+    python benchmarks/bench_engines.py <папка с PDF> [--limit 500] [--repeat 3] [--json results.json]
+
+План - все PDF из папки (рекурсивно) в порядке путей. Каждый движок запускается
+в отдельном процессе, чтобы замер памяти одного не влиял на другой.
+Вариант raw+dedup показывает цену объединения одинаковых ресурсов: сколько времени
+уходит на хэширование потоков и сколько байт выходного файла это экономит.
+Вариант raw+objstm - то же для сжатых объектных потоков и потока xref.
+Варианты *+outline добавляют закладку на каждый входной файл (страницы берутся из кэша
+метаданных заранее) и показывают, во что обходятся закладки при записи.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import BindingPDF  # noqa: E402
+
+
+def collect_plan(folder, limit=None):
+    """Все PDF из папки (рекурсивно) в порядке путей."""
+    pdf_paths = []
+    for root, _, files in os.walk(folder):
+        for file_name in files:
+            if file_name.lower().endswith(".pdf"):
+                pdf_paths.append(os.path.join(root, file_name))
+    pdf_paths.sort()
+    return pdf_paths[:limit] if limit else pdf_paths
+
+
+def get_peak_memory_mb():
+    """Пиковое потребление памяти текущим процессом (МБ) или None, если замер недоступен."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS - байты.
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+# Варианты замера: подпись -> (движок, параметры движка, добавлять ли закладки)
+ENGINE_VARIANTS = {
+    "raw+dedup": ("raw", {"dedup": True}, False),
+    "raw+objstm": ("raw", {"object_streams": True}, False),
+    "pypdf2+outline": ("pypdf2", {}, True),
+    "raw+outline": ("raw", {}, True),
+    "pikepdf+outline": ("pikepdf", {}, True),
+}
+
+
+def build_file_outline(pdf_paths):
+    """Закладка на каждый входной файл; число страниц - из кэша метаданных."""
+    metadata_by_path = BindingPDF.get_metadata_cache().get_many(pdf_paths)
+    outline = []
+    page_index = 0
+    for pdf in pdf_paths:
+        outline.append((os.path.basename(pdf), page_index, []))
+        page_index += metadata_by_path[pdf]["pages"] or 0
+    return outline
+
+
+def run_engine(engine_name, options, pdf_paths, output_path, outline=None):
+    """Одна склейка выбранным движком (выполняется в отдельном процессе)."""
+    started = time.perf_counter()
+    engine = BindingPDF.create_pdf_engine(engine_name, **options)
+    for pdf in pdf_paths:
+        engine.append(pdf)
+    if outline:
+        engine.add_outline(outline)
+    with open(output_path, 'wb') as f_out:
+        engine.write(f_out)
+    stats = getattr(engine, "stats", None)
+    engine.close()
+    return {
+        "seconds": time.perf_counter() - started,
+        "peak_memory_mb": get_peak_memory_mb(),
+        "output_bytes": os.path.getsize(output_path),
+        "stats": stats,
+    }
+
+
+def benchmark_engine(variant, pdf_paths, repeat):
+    engine_name, options, with_outline = ENGINE_VARIANTS.get(variant, (variant, {}, False))
+    outline = build_file_outline(pdf_paths) if with_outline else None
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for attempt in range(repeat):
+            output_path = os.path.join(tmp_dir, f"{attempt}.pdf")
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                results.append(executor.submit(run_engine, engine_name, options, pdf_paths, output_path,
+                                               outline).result())
+
+    best = min(results, key=lambda result: result["seconds"])
+    input_bytes = sum(os.path.getsize(pdf) for pdf in pdf_paths)
+    return {
+        "engine": variant,
+        "files": len(pdf_paths),
+        "input_bytes": input_bytes,
+        "best_seconds": best["seconds"],
+        "mb_per_second": input_bytes / 1024 / 1024 / best["seconds"] if best["seconds"] else None,
+        "peak_memory_mb": max((r["peak_memory_mb"] or 0) for r in results) or None,
+        "output_bytes": best["output_bytes"],
+        "stats": best["stats"],
+        "runs": results,
+    }
+
+
+def available_engines():
+    engines = []
+    for name, engine_class in BindingPDF.PDF_ENGINES.items():
+        if getattr(engine_class, "is_available", lambda: True)():
+            engines.append(name)
+    engines.extend(variant for variant, (name, _, _) in ENGINE_VARIANTS.items() if name in engines)
+    return engines
+
+
+def print_table(rows):
+    print(f"{'Движок':<16} {'Файлов':>7} {'Время, с':>10} {'МБ/с':>8} {'Память, МБ':>11} {'Размер, МБ':>11}")
+    for row in rows:
+        memory = f"{row['peak_memory_mb']:.1f}" if row["peak_memory_mb"] else "-"
+        speed = f"{row['mb_per_second']:.1f}" if row["mb_per_second"] else "-"
+        print(f"{row['engine']:<16} {row['files']:>7} {row['best_seconds']:>10.3f} {speed:>8} "
+              f"{memory:>11} {row['output_bytes'] / 1024 / 1024:>11.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение движков склейки PDF")
+    parser.add_argument("folder", help="папка с исходными PDF")
+    parser.add_argument("--limit", type=int, help="взять только первые N файлов")
+    parser.add_argument("--repeat", type=int, default=3, help="число повторов (берется лучший)")
+    parser.add_argument("--engines", nargs="*", help="какие движки сравнивать (по умолчанию все доступные)")
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    pdf_paths = collect_plan(args.folder, args.limit)
+    if not pdf_paths:
+        BindingPDF.print_error("В папке нет PDF файлов.")
+        return 1
+
+    engines = []
+    for name in args.engines or available_engines():
+        if name in available_engines():
+            engines.append(name)
+        else:
+            BindingPDF.print_error(f"Движок {name} недоступен и пропущен.")
+
+    rows = [benchmark_engine(name, pdf_paths, args.repeat) for name in engines]
+    print_table(rows)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, ensure_ascii=False, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Микрозамеры вспомогательных функций, которые вызываются на каждую папку, файл или строку таблицы,
+с проверкой сложности.
+
+Запуск:
+    python benchmarks/bench_helpers.py [--max-slope 1.25] [--quick] [--json results.json]
+
+Каждая функция прогоняется на входах растущего размера (например, generate_range_string -
+от 1e3 до 1e6 номеров, normalize_gtd_number - до 1e5 значений из таблицы). По замерам
+оценивается показатель роста времени: наклон прямой log(время) от log(размер).
+Для почти линейного кода он около 1. Если наклон какой-то функции больше --max-slope,
+скрипт завершается с кодом 1 - так регресс сложности виден в CI или перед релизом.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import BindingPDF  # noqa: E402
+
+
+def make_numbers(size, rng):
+    """Номера папок с пропусками: и длинные диапазоны, и одиночные номера."""
+    numbers = []
+    current = 1000
+    while len(numbers) < size:
+        run = rng.choice((1, 1, 2, 5, 20))
+        numbers.extend(range(current, current + run))
+        current += run + rng.choice((1, 2, 7))
+    rng.shuffle(numbers)
+    return numbers[:size]
+
+
+def make_range_text(size, rng):
+    """Строка диапазона из size частей: "1000-1004,1006,1010-1029,..."."""
+    parts = []
+    current = 1000
+    for _ in range(size):
+        run = rng.choice((0, 0, 4, 19))
+        parts.append(f"{current}-{current + run}" if run else str(current))
+        current += run + rng.choice((2, 3, 8))
+    return ",".join(parts)
+
+
+def make_file_names(size, rng):
+    templates = ("{n} Shipment", "Invoice {n}.pdf", "GTD_10702070_120526_{n}.pdf", "RW {n}.pdf", "{n},Doc.pdf")
+    return [rng.choice(templates).format(n=rng.randrange(1, 10 ** 7)) for _ in range(size)]
+
+
+def make_gtd_values(size, rng):
+    """Номера ДТ в разных форматах, как они встречаются в Sorting sheet.xlsx и именах файлов."""
+    templates = ("10702070/{d}/{n}", "10702070-{d}-{n}", "GTD_10702070_{d}_{n}.pdf", "ДТ № 10702070/{d}/{n}",
+                 "'10702070/{d}/{n}'")
+    return [rng.choice(templates).format(d=f"{rng.randrange(10, 29)}0526", n=rng.randrange(10 ** 6, 10 ** 7))
+            for _ in range(size)]
+
+
+def make_date_texts(size, rng):
+    formats = ("%d.%m.%Y", "%d.%m.%y", "%d/%m/%Y", "%Y-%m-%d", "нет даты")
+    first = date(2026, 1, 1)
+    return [(first + timedelta(days=rng.randrange(365))).strftime(rng.choice(formats)) for _ in range(size)]
+
+
+def make_release_values(size, rng):
+    """Значения колонки B: даты, datetime, числа Excel, текст, пустые ячейки."""
+    first = date(2026, 1, 1)
+    values = []
+    for index in range(size):
+        day = first + timedelta(days=rng.randrange(365))
+        kind = index % 5
+        if kind == 0:
+            values.append(day)
+        elif kind == 1:
+            values.append(datetime.combine(day, datetime.min.time()))
+        elif kind == 2:
+            values.append(float(rng.randrange(45000, 46000)))
+        elif kind == 3:
+            values.append(day.strftime("%d.%m.%Y"))
+        else:
+            values.append(None)
+    return values
+
+
+def each(function):
+    """Замер функции одного значения на списке значений."""
+    def run(values):
+        for value in values:
+            function(value)
+    return run
+
+
+# Имя -> (генератор входа, прогон, размеры)
+BENCHMARKS = {
+    "generate_range_string": (make_numbers, BindingPDF.generate_range_string, (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6)),
+    "parse_folder_range": (make_range_text, BindingPDF.parse_folder_range, (10 ** 3, 10 ** 4, 10 ** 5)),
+    "get_number_from_string": (make_file_names, each(BindingPDF.get_number_from_string),
+                               (10 ** 3, 10 ** 4, 10 ** 5)),
+    "normalize_gtd_number": (make_gtd_values, each(BindingPDF.normalize_gtd_number), (10 ** 3, 10 ** 4, 10 ** 5)),
+    "_parse_date_text": (make_date_texts, each(BindingPDF._parse_date_text), (10 ** 3, 10 ** 4, 10 ** 5)),
+    "get_release_date_sort_key": (make_release_values, each(BindingPDF.get_release_date_sort_key),
+                                  (10 ** 3, 10 ** 4, 10 ** 5)),
+}
+
+
+def measure(run, values, repeat):
+    """Лучшее время из repeat прогонов (меньше всего зависит от фоновой нагрузки)."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run(values)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def fit_slope(points):
+    """Наклон прямой log(время) от log(размер) методом наименьших квадратов."""
+    xs = [math.log(size) for size, _ in points]
+    ys = [math.log(max(seconds, 1e-9)) for _, seconds in points]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    numerator = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    denominator = sum((x - mean_x) ** 2 for x in xs)
+    return numerator / denominator if denominator else 0.0
+
+
+def run_benchmark(name, repeat, quick):
+    make_input, run, sizes = BENCHMARKS[name]
+    if quick:
+        sizes = sizes[:-1]
+    rng = random.Random(1)
+    points = []
+    for size in sizes:
+        values = make_input(size, rng)
+        points.append((size, measure(run, values, repeat)))
+    return {
+        "function": name,
+        "points": [{"size": size, "seconds": seconds, "ns_per_item": seconds / size * 1e9}
+                   for size, seconds in points],
+        "slope": fit_slope(points),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микрозамеры вспомогательных функций с проверкой сложности")
+    parser.add_argument("--max-slope", type=float, default=1.25,
+                        help="наибольший допустимый показатель роста времени (1 - линейный)")
+    parser.add_argument("--repeat", type=int, default=3, help="число повторов (берется лучший)")
+    parser.add_argument("--quick", action="store_true", help="без самого большого размера")
+    parser.add_argument("--functions", nargs="*", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    results = []
+    failed = []
+    print(f"{'Функция':<26} {'Размер':>9} {'Время, с':>10} {'нс/элемент':>11}")
+    for name in args.functions:
+        result = run_benchmark(name, args.repeat, args.quick)
+        results.append(result)
+        for point in result["points"]:
+            print(f"{name:<26} {point['size']:>9} {point['seconds']:>10.4f} {point['ns_per_item']:>11.0f}")
+        status = "ok" if result["slope"] <= args.max_slope else "РЕГРЕСС"
+        print(f"{'':<26} наклон {result['slope']:.2f} ({status})")
+        if result["slope"] > args.max_slope:
+            failed.append(name)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"max_slope": args.max_slope, "results": results}, f, ensure_ascii=False, indent=4)
+
+    if failed:
+        BindingPDF.print_error(f"Рост времени хуже почти линейного (наклон > {args.max_slope}): {', '.join(failed)}")
+        return 1
+    print("✅ Сложность всех функций в норме.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
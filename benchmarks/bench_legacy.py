@@ -0,0 +1,260 @@
+"""
+Сравнение текущей реализации с прежними версиями из папки old/ на одном синтетическом дереве.
+
+Запуск:
+    python benchmarks/bench_legacy.py [--folders 300] [--threshold 0.10] [--legacy ...] [--json results.json]
+
+Для каждой прежней версии и каждого ее сценария:
+    - прежний скрипт копируется во временную папку (рядом - path.txt, Railway и Temp из дерева)
+      и выполняется в отдельном процессе, как его когда-то запускали;
+    - текущий сценарий выполняется в отдельном процессе дважды, каждый раз со своим пустым кэшем:
+      холодный прогон (сведения о файлах собираются во время склейки, как у прежних версий) и прогон
+      с заранее собранными сведениями, как в программе, пока пользователь выбирает тип скрепления
+      (время индексации в него не входит и выводится только для справки);
+    - результаты сравниваются по именам файлов и по содержимому страниц по порядку
+      (число страниц и порядок документов, в том числе сортировка по дате выпуска в сценарии 3);
+    - с прежней версией сравнивается время холодного прогона: если текущая версия медленнее
+      больше чем на --threshold, это регресс.
+Скрипт завершается с кодом 1, если найдено расхождение страниц или регресс по времени.
+Дерево создается benchmarks/make_tree.py; даты в именах GTD совпадают с датами выпуска в таблице,
+поэтому прежняя сортировка по дате из имени и текущая по Sorting sheet.xlsx должны давать один порядок.
+"""
+import os
+import sys
+import json
+import time
+import runpy
+import shutil
+import hashlib
+import argparse
+import tempfile
+import contextlib
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import BindingPDF  # noqa: E402
+from PyPDF2 import PdfReader  # noqa: E402
+from bench_scenarios import call_scenario, get_tree, use_cache_dir  # noqa: E402
+
+OLD_DIR = os.path.join(BindingPDF.script_dir, "old")
+
+# Прежние версии: файл -> сценарии. Файлы BindingPDF* - модули с функциями process_*,
+# остальные - отдельные скрипты, которые читают path.txt и делают одну склейку.
+LEGACY_VERSIONS = {
+    "BindingPDF.py": ("inv_spec", "gtd_esd", "gtd_inv_spec", "gtd", "railway", "temp"),
+    "BindingPDF (old from 04.05.26).py": ("inv_spec", "gtd_esd", "gtd_inv_spec", "gtd", "railway", "temp"),
+    "BindingPDF(old 24.04.26).py": ("inv_spec", "gtd_esd", "gtd_inv_spec", "gtd", "railway", "temp"),
+    "BindingInvSpec.py": ("inv_spec",),
+    "BindingGTDESD.py": ("gtd_esd",),
+    "BindingGTDInvSpec.py": ("gtd_inv_spec",),
+    "BindingGTD.py": ("gtd",),
+    "BindingTemp.py": ("temp",),
+}
+
+# Сознательные изменения поведения: расхождение отмечается, но регрессом не считается.
+KNOWN_DIFFERENCES = {
+    ("BindingPDF.py", "gtd_inv_spec"): "прежний скрипт сортирует по номеру ДТ, а не по дате выпуска",
+    ("BindingGTDInvSpec.py", "gtd_inv_spec"): "прежний скрипт сортирует по номеру ДТ, а не по дате выпуска",
+}
+
+LEGACY_FUNCTIONS = {
+    "inv_spec": "process_inv_spec",
+    "gtd_esd": "process_gtd_esd",
+    "gtd_inv_spec": "process_gtd_inv_spec",
+    "gtd": "process_gtd_only",
+}
+
+
+def page_signatures(pdf_path):
+    """Отпечатки страниц по порядку: SHA-1 распакованного содержимого каждой страницы."""
+    signatures = []
+    for page in PdfReader(pdf_path).pages:
+        contents = page.get_contents()
+        signatures.append(hashlib.sha1(contents.get_data() if contents is not None else b"").hexdigest())
+    return signatures
+
+
+def collect_outputs(out_dir):
+    """Имя файла -> отпечатки страниц для всех PDF в папке результата."""
+    return {name: page_signatures(os.path.join(out_dir, name))
+            for name in sorted(os.listdir(out_dir)) if name.lower().endswith(".pdf")}
+
+
+def prepare_legacy_dir(legacy_name, tree, run_dir):
+    """Копия прежнего скрипта с path.txt, Railway и Temp рядом - как при обычном запуске."""
+    script_path = os.path.join(run_dir, legacy_name)
+    shutil.copyfile(os.path.join(OLD_DIR, legacy_name), script_path)
+    os.symlink(tree["railway"], os.path.join(run_dir, "Railway"))
+    os.symlink(tree["temp"], os.path.join(run_dir, "Temp"))
+    out_dir = os.path.join(run_dir, "out")
+    os.makedirs(out_dir)
+    with open(os.path.join(run_dir, "path.txt"), 'w', encoding='utf-8') as f:
+        f.write(f"{tree['shipments']}\n{out_dir}\n{tree['folders'][0]}-{tree['folders'][-1]}\n")
+    return script_path, out_dir
+
+
+def run_legacy(legacy_name, scenario, tree, run_dir):
+    """Прогон прежней версии (выполняется в отдельном процессе). Возвращает время и результаты."""
+    script_path, out_dir = prepare_legacy_dir(legacy_name, tree, run_dir)
+    os.chdir(run_dir)
+    module = None
+    if legacy_name.startswith("BindingPDF"):
+        spec = importlib.util.spec_from_file_location("legacy_binding", script_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if module is None:
+            runpy.run_path(script_path, run_name="__main__")
+        elif scenario == "railway":
+            module.process_railway()
+        elif scenario == "temp":
+            module.process_temp_folder()
+        else:
+            getattr(module, LEGACY_FUNCTIONS[scenario])(tree["shipments"], out_dir, set(tree["folders"]))
+    seconds = time.perf_counter() - started
+
+    if scenario == "railway":
+        out_dir = os.path.join(run_dir, "Merged Railway")
+    elif scenario == "temp":
+        out_dir = os.path.join(run_dir, "Combined")
+    return seconds, collect_outputs(out_dir)
+
+
+def list_scenario_pdfs(scenario, tree):
+    if scenario in ("railway", "temp"):
+        folder = tree[scenario]
+        return [os.path.join(folder, name) for name in os.listdir(folder) if name.lower().endswith(".pdf")]
+    return BindingPDF.list_folder_pdfs(tree["shipments"], set(tree["folders"]))
+
+
+def time_current(scenario, tree, run_dir, name, preindex):
+    """
+    Один прогон текущей версии с пустым кэшем. preindex - заранее собрать сведения о файлах
+    (вне замера). Возвращает (время сценария, время индексации или None, папка результата).
+    """
+    use_cache_dir(os.path.join(run_dir, f"Cache-{name}"))
+    BindingPDF.SORTING_SHEET_FILE = tree["sorting_sheet"]
+    out_dir = os.path.join(run_dir, f"out-{name}")
+    os.makedirs(out_dir)
+
+    index_seconds = None
+    if preindex:
+        started = time.perf_counter()
+        BindingPDF.get_metadata_cache().get_many(list_scenario_pdfs(scenario, tree))
+        index_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        call_scenario(scenario, tree, out_dir)
+    return time.perf_counter() - started, index_seconds, out_dir
+
+
+def run_current(scenario, tree, run_dir):
+    """
+    Прогоны текущей версии (выполняется в отдельном процессе): холодный и с заранее собранными
+    сведениями о файлах. Возвращает (время холодного, время с индексом, время индексации, результаты).
+    """
+    cold_seconds, _, out_dir = time_current(scenario, tree, run_dir, "cold", preindex=False)
+    warm_seconds, index_seconds, _ = time_current(scenario, tree, run_dir, "indexed", preindex=True)
+    return cold_seconds, warm_seconds, index_seconds, collect_outputs(out_dir)
+
+
+def run_isolated(function, *args, work_dir):
+    run_dir = tempfile.mkdtemp(dir=work_dir)
+    try:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            return executor.submit(function, *args, run_dir).result()
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def compare_outputs(legacy_outputs, current_outputs):
+    """Описание первого расхождения результатов или None, если совпадают."""
+    if not legacy_outputs:
+        return "прежняя версия не создала ни одного файла"
+    if set(legacy_outputs) != set(current_outputs):
+        missing = sorted(set(legacy_outputs) - set(current_outputs))
+        extra = sorted(set(current_outputs) - set(legacy_outputs))
+        return f"разные файлы: только в прежней {missing[:3]}, только в текущей {extra[:3]}"
+    for name, legacy_pages in legacy_outputs.items():
+        current_pages = current_outputs[name]
+        if len(legacy_pages) != len(current_pages):
+            return f"{name}: страниц {len(current_pages)} вместо {len(legacy_pages)}"
+        for index, (legacy_page, current_page) in enumerate(zip(legacy_pages, current_pages), 1):
+            if legacy_page != current_page:
+                return f"{name}: порядок страниц расходится начиная со страницы {index}"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение с прежними версиями из old/")
+    parser.add_argument("--folders", type=int, default=300, help="число папок в синтетическом дереве")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="допустимое замедление относительно прежней версии (0.10 = 10%%)")
+    parser.add_argument("--legacy", nargs="*", choices=list(LEGACY_VERSIONS), default=list(LEGACY_VERSIONS))
+    parser.add_argument("--work-dir", help="папка для деревьев (сохраняются между запусками)")
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="binding-legacy-")
+    os.makedirs(work_dir, exist_ok=True)
+    tree = get_tree(work_dir, args.folders)
+
+    current_runs = {}
+    rows = []
+    failed = False
+    print(f"{'Прежняя версия':<36} {'Сценарий':<14} {'Было, с':>8} {'Стало, с':>9} "
+          f"{'С индексом, с':>14} {'Индекс, с':>10} {'Итог'}")
+    for legacy_name in args.legacy:
+        for scenario in LEGACY_VERSIONS[legacy_name]:
+            if scenario not in current_runs:
+                current_runs[scenario] = run_isolated(run_current, scenario, tree, work_dir=work_dir)
+            # Сравнивается холодный прогон: прежние версии тоже читают файлы во время склейки.
+            current_seconds, warm_seconds, index_seconds, current_outputs = current_runs[scenario]
+            legacy_seconds, legacy_outputs = run_isolated(run_legacy, legacy_name, scenario, tree,
+                                                          work_dir=work_dir)
+
+            difference = compare_outputs(legacy_outputs, current_outputs)
+            known = KNOWN_DIFFERENCES.get((legacy_name, scenario))
+            slower = current_seconds > legacy_seconds * (1 + args.threshold)
+            if difference and known:
+                status = f"известное отличие: {known}"
+            elif difference:
+                status = f"РАСХОЖДЕНИЕ: {difference}"
+                failed = True
+            elif slower:
+                status = f"РЕГРЕСС: медленнее на {(current_seconds / legacy_seconds - 1) * 100:.0f}%"
+                failed = True
+            else:
+                status = "ok"
+            print(f"{legacy_name:<36} {scenario:<14} {legacy_seconds:>8.3f} {current_seconds:>9.3f} "
+                  f"{warm_seconds:>14.3f} {index_seconds:>10.3f} {status}")
+            rows.append({
+                "legacy": legacy_name,
+                "scenario": scenario,
+                "legacy_seconds": legacy_seconds,
+                "current_seconds": current_seconds,
+                "indexed_seconds": warm_seconds,
+                "index_seconds": index_seconds,
+                "outputs": len(current_outputs),
+                "pages": sum(len(pages) for pages in current_outputs.values()),
+                "difference": difference,
+                "known_difference": known,
+                "status": status,
+            })
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"folders": args.folders, "threshold": args.threshold, "results": rows},
+                      f, ensure_ascii=False, indent=4)
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+Сквозной замер сценариев склейки на синтетических деревьях разного размера.
+
+Запуск:
+    python benchmarks/bench_scenarios.py [--sizes 100 1000 10000] [--scenarios inv_spec gtd_inv_spec]
+                                         [--work-dir bench_trees] [--json results.json]
+
+Для каждого размера дерево создается benchmarks/make_tree.py (или берется готовое из --work-dir).
+Каждый сценарий запускается в отдельном процессе со своим пустым кэшем: сначала "холодный" прогон,
+затем повторный с тем же кэшем ("теплый" - готовый файл берется из кэша). Настройки берутся
+из config.json, как при обычной работе, и записываются в результаты.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import BindingPDF  # noqa: E402
+from make_tree import make_tree  # noqa: E402
+
+SCENARIOS = ("inv_spec", "gtd_esd", "gtd_inv_spec", "gtd", "railway", "temp")
+
+
+def use_cache_dir(cache_dir):
+    """Направляет все кэши BindingPDF в отдельную папку, чтобы замер не трогал рабочий кэш."""
+    BindingPDF.CACHE_DIR = cache_dir
+    BindingPDF.OUTPUT_CACHE_DIR = os.path.join(cache_dir, "Outputs")
+    BindingPDF.SEGMENT_CACHE_DIR = os.path.join(cache_dir, "Segments")
+    BindingPDF.METADATA_DB_FILE = os.path.join(cache_dir, "metadata.sqlite3")
+    BindingPDF.QUARANTINE_FILE = os.path.join(cache_dir, "quarantine.json")
+    BindingPDF.SHARDS_DIR = os.path.join(cache_dir, "Shards")
+    BindingPDF._metadata_cache = BindingPDF.FileMetadataCache(BindingPDF.METADATA_DB_FILE)
+
+
+def call_scenario(scenario, tree, out_dir):
+    folders = set(tree["folders"])
+    if scenario == "inv_spec":
+        BindingPDF.process_inv_spec(tree["shipments"], out_dir, folders)
+    elif scenario == "gtd_esd":
+        BindingPDF.process_gtd_esd(tree["shipments"], out_dir, folders)
+    elif scenario == "gtd_inv_spec":
+        BindingPDF.process_gtd_inv_spec(tree["shipments"], out_dir, folders)
+    elif scenario == "gtd":
+        BindingPDF.process_gtd_only(tree["shipments"], out_dir, folders)
+    elif scenario == "railway":
+        BindingPDF.process_railway(tree["railway"], out_dir)
+    elif scenario == "temp":
+        BindingPDF.process_temp_folder(tree["temp"], out_dir)
+
+
+def run_scenario(scenario, tree, work_dir):
+    """Холодный и теплый прогон сценария (выполняется в отдельном процессе)."""
+    use_cache_dir(os.path.join(work_dir, "Cache"))
+    BindingPDF.SORTING_SHEET_FILE = tree["sorting_sheet"]
+
+    timings = []
+    for attempt in ("cold", "warm"):
+        out_dir = os.path.join(work_dir, attempt)
+        os.makedirs(out_dir)
+        started = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            call_scenario(scenario, tree, out_dir)
+        seconds = time.perf_counter() - started
+        outputs = [os.path.join(out_dir, name) for name in os.listdir(out_dir) if name.endswith(".pdf")]
+        timings.append({
+            "run": attempt,
+            "seconds": seconds,
+            "outputs": len(outputs),
+            "output_bytes": sum(os.path.getsize(path) for path in outputs),
+        })
+    return timings
+
+
+def get_tree(work_dir, folders):
+    """Дерево нужного размера: готовое из work_dir или созданное заново."""
+    root = os.path.join(work_dir, f"tree-{folders}")
+    info_path = os.path.join(root, "tree.json")
+    if os.path.isfile(info_path):
+        with open(info_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    shutil.rmtree(root, ignore_errors=True)
+    print(f"Создаю дерево на {folders} папок ...")
+    started = time.perf_counter()
+    tree = make_tree(root, folders)
+    with open(info_path, 'w', encoding='utf-8') as f:
+        json.dump(tree, f)
+    print(f"   готово за {time.perf_counter() - started:.1f} с")
+    return tree
+
+
+def print_table(rows):
+    print(f"{'Папок':>7} {'Сценарий':<14} {'Холодный, с':>12} {'Теплый, с':>10} {'Файлов':>7} {'Размер, МБ':>11}")
+    for row in rows:
+        cold, warm = row["runs"]
+        print(f"{row['folders']:>7} {row['scenario']:<14} {cold['seconds']:>12.3f} {warm['seconds']:>10.3f} "
+              f"{cold['outputs']:>7} {cold['output_bytes'] / 1024 / 1024:>11.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозной замер сценариев склейки")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[100, 1000, 10000], help="число папок в дереве")
+    parser.add_argument("--scenarios", nargs="*", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--work-dir", help="папка для деревьев (сохраняются между запусками)")
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="binding-bench-")
+    settings = {name: BindingPDF.get_setting(name) for name in BindingPDF.DEFAULT_SETTINGS}
+
+    rows = []
+    for folders in args.sizes:
+        tree = get_tree(work_dir, folders)
+        for scenario in args.scenarios:
+            run_dir = tempfile.mkdtemp(prefix=f"{scenario}-", dir=work_dir)
+            try:
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    runs = executor.submit(run_scenario, scenario, tree, run_dir).result()
+            finally:
+                shutil.rmtree(run_dir, ignore_errors=True)
+            rows.append({"folders": folders, "scenario": scenario, "runs": runs})
+            print(f"   {folders} папок, {scenario}: {runs[0]['seconds']:.2f} с")
+
+    print_table(rows)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"settings": settings, "results": rows}, f, ensure_ascii=False, indent=4)
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Замер записи готового файла с разным размером буфера - на локальном диске и в сетевой папке.
+
+Запуск:
+    python benchmarks/bench_write.py [--target \\\\server\\share\\folder] [--buffers 8 64 256 1024 4096]
+                                     [--fsync] [--folders 300] [--size-kb 20] [--json results.json]
+
+Скрипт один раз склеивает файлы синтетического дерева (benchmarks/make_tree.py) и записывает,
+какими порциями движок пишет результат. Затем эти же порции пишутся в --target через
+write_atomically (временный файл и переименование) с каждым размером буфера: так сравнивается
+только запись, без повторной склейки. Движок PyPDF2 пишет тысячами мелких порций, поэтому
+на сетевой папке размер буфера заметен сильнее всего. По результатам выбирается write_buffer_kb.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import BindingPDF  # noqa: E402
+from make_tree import make_tree  # noqa: E402
+
+
+class RecordingStream:
+    """Поток, который запоминает порции записи (и поддерживает tell, нужный движкам)."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+
+def record_output(tree, engine):
+    """Склеивает все PDF папок дерева и возвращает порции, которыми движок пишет результат."""
+    merger = BindingPDF.create_pdf_engine(engine)
+    for pdf in BindingPDF.list_folder_pdfs(tree["shipments"], set(tree["folders"])):
+        merger.append(pdf)
+    stream = RecordingStream()
+    merger.write(stream)
+    merger.close()
+    return stream.chunks
+
+
+def measure(target_dir, chunks, buffer_kb, fsync, repeat):
+    """Лучшее время записи файла из repeat попыток."""
+    path = os.path.join(target_dir, "bench-write.pdf")
+
+    def replay(f_out):
+        for chunk in chunks:
+            f_out.write(chunk)
+
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        BindingPDF.write_atomically(path, replay, buffer_kb=buffer_kb, fsync=fsync)
+        best = min(best, time.perf_counter() - started)
+        os.remove(path)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер записи готового файла с разным размером буфера")
+    parser.add_argument("--target", help="папка для записи (локальная или сетевая; по умолчанию - временная)")
+    parser.add_argument("--buffers", type=int, nargs="*", default=[8, 64, 256, 1024, 4096],
+                        help="размеры буфера, КБ")
+    parser.add_argument("--fsync", action="store_true", help="дополнительно замерить со сбросом на диск")
+    parser.add_argument("--engine", choices=["pypdf2", "raw"], default="pypdf2")
+    parser.add_argument("--folders", type=int, default=300, help="число папок в синтетическом дереве")
+    parser.add_argument("--size-kb", type=int, default=20, help="размер картинки на странице, КБ")
+    parser.add_argument("--repeat", type=int, default=3, help="число повторов (берется лучший)")
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="binding-write-")
+    target_dir = args.target or os.path.join(work_dir, "out")
+    os.makedirs(target_dir, exist_ok=True)
+    try:
+        print("Создаю дерево и склеиваю результат в память ...")
+        tree = make_tree(os.path.join(work_dir, "tree"), args.folders, size_kb=args.size_kb)
+        chunks = record_output(tree, args.engine)
+        total_bytes = sum(len(chunk) for chunk in chunks)
+        print(f"Результат: {total_bytes / 1024 / 1024:.1f} МБ, порций записи: {len(chunks)} "
+              f"(в среднем {total_bytes / len(chunks):.0f} байт)")
+        print(f"Папка записи: {target_dir}\n")
+
+        results = []
+        print(f"{'Буфер, КБ':>10} {'fsync':>6} {'Время, с':>9} {'МБ/с':>8}")
+        for fsync in (False, True) if args.fsync else (False,):
+            for buffer_kb in args.buffers:
+                seconds = measure(target_dir, chunks, buffer_kb, fsync, args.repeat)
+                speed = total_bytes / 1024 / 1024 / seconds
+                print(f"{buffer_kb:>10} {'да' if fsync else 'нет':>6} {seconds:>9.3f} {speed:>8.1f}")
+                results.append({"buffer_kb": buffer_kb, "fsync": fsync, "seconds": seconds, "mb_per_second": speed})
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"target": args.target, "engine": args.engine, "bytes": total_bytes, "chunks": len(chunks),
+                       "results": results}, f, ensure_ascii=False, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
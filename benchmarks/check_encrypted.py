@@ -0,0 +1,126 @@
+"""
+Проверка склейки файлов, зашифрованных только паролем на права (пароль открытия пустой).
+
+Запуск:
+    python benchmarks/check_encrypted.py [--folders 6] [--json results.json]
+
+Создаются два одинаковых синтетических дерева (benchmarks/make_tree.py). Во втором часть
+деклараций и инвойсов заменена копиями, зашифрованными с пустым паролем открытия и паролем
+владельца. Такие файлы открываются без пароля и должны склеиваться как обычные:
+    - сценарии 1 (с пропуском файлов с ошибками) и 2 (с отменой при ошибках) для каждого движка
+      дают те же страницы в том же порядке, что и для незашифрованного дерева;
+    - файл с паролем открытия по-прежнему считается зашифрованным и не склеивается.
+Скрипт завершается с кодом 1, если хоть одна проверка не прошла.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import contextlib
+from io import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import BindingPDF  # noqa: E402
+from PyPDF2 import PdfReader, PdfWriter  # noqa: E402
+from make_tree import make_tree  # noqa: E402
+from bench_scenarios import use_cache_dir  # noqa: E402
+from bench_legacy import collect_outputs  # noqa: E402
+
+SCENARIOS = {
+    "inv_spec": BindingPDF.process_inv_spec,
+    "gtd_esd": BindingPDF.process_gtd_esd,
+}
+
+
+def encrypt_copy(pdf_path, user_password=""):
+    """Заменяет файл его зашифрованной копией (RC4-128, пароль владельца "owner")."""
+    writer = PdfWriter()
+    for page in PdfReader(pdf_path).pages:
+        writer.add_page(page)
+    writer.encrypt(user_password=user_password, owner_password="owner")
+    with open(pdf_path, 'wb') as f:
+        writer.write(f)
+
+
+def encrypt_inputs(tree):
+    """Шифрует декларацию каждой второй папки и инвойс каждой третьей. Возвращает число файлов."""
+    encrypted = 0
+    for index, folder in enumerate(tree["folders"]):
+        folder_dir = os.path.join(tree["shipments"], f"{folder} Shipment")
+        for name in os.listdir(folder_dir):
+            if (name.startswith("GTD_") and index % 2 == 0) or (name.startswith("Invoice") and index % 3 == 0):
+                encrypt_copy(os.path.join(folder_dir, name))
+                encrypted += 1
+    return encrypted
+
+
+def run_scenario(scenario, tree, work_dir, name, engine):
+    """Склейка в отдельной папке кэша и результата. Возвращает (результат process_*, страницы, вывод)."""
+    run_dir = os.path.join(work_dir, name)
+    out_dir = os.path.join(run_dir, "out")
+    os.makedirs(out_dir)
+    use_cache_dir(os.path.join(run_dir, "Cache"))
+    BindingPDF.SORTING_SHEET_FILE = tree["sorting_sheet"]
+    BindingPDF.CONFIG_FILE = os.path.join(run_dir, "config.json")
+    with open(BindingPDF.CONFIG_FILE, 'w', encoding='utf-8') as f:
+        json.dump({"engine": engine}, f)
+    output = StringIO()
+    with contextlib.redirect_stdout(output):
+        result = SCENARIOS[scenario](tree["shipments"], out_dir, set(tree["folders"]))
+    return result, collect_outputs(out_dir), output.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка склейки файлов с паролем только на права")
+    parser.add_argument("--folders", type=int, default=6, help="число папок отгрузок")
+    parser.add_argument("--work-dir", help="рабочая папка (по умолчанию временная, удаляется)")
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="binding-encrypted-")
+    os.makedirs(work_dir, exist_ok=True)
+    plain_tree = make_tree(os.path.join(work_dir, "plain"), args.folders)
+    encrypted_tree = make_tree(os.path.join(work_dir, "encrypted"), args.folders)
+    encrypted_files = encrypt_inputs(encrypted_tree)
+    print(f"Папок: {args.folders}, файлов с паролем только на права: {encrypted_files}")
+
+    engines = [BindingPDF.PyPdf2Engine.name, BindingPDF.RawPdfEngine.name]
+    if BindingPDF.PikePdfEngine.is_available():
+        engines.append(BindingPDF.PikePdfEngine.name)
+
+    results = []
+    for scenario in SCENARIOS:
+        for engine in engines:
+            _, expected, _ = run_scenario(scenario, plain_tree, work_dir, f"plain-{scenario}-{engine}", engine)
+            result, actual, output = run_scenario(scenario, encrypted_tree, work_dir,
+                                                  f"encrypted-{scenario}-{engine}", engine)
+            ok = bool(result) and bool(expected) and actual == expected and "файл зашифрован" not in output
+            results.append({"scenario": scenario, "engine": engine, "ok": ok})
+            print(f"{scenario:<10} {engine:<8} {'ok' if ok else 'РАСХОЖДЕНИЕ'}")
+
+    # Файл, который без пароля не открыть, склеивать нельзя.
+    locked_path = os.path.join(work_dir, "locked.pdf")
+    shutil.copyfile(os.path.join(plain_tree["temp"], "1,Doc.pdf"), locked_path)
+    encrypt_copy(locked_path, user_password="secret")
+    locked_problem = BindingPDF.get_pdf_problem(BindingPDF.read_pdf_metadata(locked_path))
+    print(f"Файл с паролем открытия: {locked_problem or 'НЕ ОБНАРУЖЕН'}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"folders": args.folders, "encrypted_files": encrypted_files, "runs": results,
+                       "locked_problem": locked_problem}, f, ensure_ascii=False, indent=4)
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if not all(run["ok"] for run in results) or locked_problem != "файл зашифрован":
+        BindingPDF.print_error("Файлы с паролем только на права склеиваются неверно.")
+        return 1
+    print("✅ Файлы с паролем только на права склеиваются так же, как незашифрованные.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+Проверка продолжения прерванной склейки большого комплекта с контрольной точки.
+
+Запуск:
+    python benchmarks/check_resume.py [--files 600] [--checkpoint-files 50] [--workers 2] [--json results.json]
+
+Сценарий Temp склеивает --files файлов синтетического дерева (benchmarks/make_tree.py) по частям
+не больше --checkpoint-files файлов. Проверка:
+    - эталон: склейка без помех в отдельной папке кэша;
+    - склейка в отдельном процессе, который убивается (SIGKILL всей группы процессов, как при
+      сбое питания или закрытии окна), как только готова хотя бы одна часть, но еще не все;
+    - повторный запуск с тем же кэшем и той же папкой результата: он должен взять готовые части
+      и доклеить остальные.
+Результат повторного запуска сравнивается с эталоном по содержимому страниц по порядку.
+Скрипт завершается с кодом 1, если страницы расходятся или готовые части не были использованы.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import argparse
+import tempfile
+import contextlib
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import BindingPDF  # noqa: E402
+from make_tree import make_tree  # noqa: E402
+from bench_scenarios import use_cache_dir  # noqa: E402
+from bench_legacy import collect_outputs  # noqa: E402
+
+
+def run_merge(tree_path, out_dir, cache_dir, config_path):
+    """Одна склейка сценария Temp (выполняется в отдельном процессе: python check_resume.py --run ...)."""
+    with open(tree_path, 'r', encoding='utf-8') as f:
+        tree = json.load(f)
+    use_cache_dir(cache_dir)
+    BindingPDF.CONFIG_FILE = config_path
+    os.makedirs(out_dir, exist_ok=True)
+    BindingPDF.process_temp_folder(tree["temp"], out_dir)
+
+
+def start_merge(work_dir, name, out_name, cache_dir, config_path):
+    out_dir = os.path.join(work_dir, out_name)
+    log = open(os.path.join(work_dir, f"{name}.log"), 'w', encoding='utf-8')
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--run", os.path.join(work_dir, "tree.json"),
+         out_dir, cache_dir, config_path],
+        stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    return process, out_dir, log
+
+
+def count_shards(cache_dir):
+    """Готовые части во всех контрольных точках папки кэша."""
+    shards_dir = os.path.join(cache_dir, "Shards")
+    if not os.path.isdir(shards_dir):
+        return 0
+    return sum(1 for checkpoint in os.listdir(shards_dir)
+               for name in os.listdir(os.path.join(shards_dir, checkpoint))
+               if name.startswith("shard-") and name.endswith(".pdf"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка продолжения прерванной склейки")
+    parser.add_argument("--files", type=int, default=600, help="число файлов в папке Temp")
+    parser.add_argument("--checkpoint-files", type=int, default=50, help="файлов в одной части")
+    parser.add_argument("--workers", type=int, default=2, help="процессов склейки")
+    parser.add_argument("--work-dir", help="рабочая папка (по умолчанию временная, удаляется)")
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    parser.add_argument("--run", nargs=4, metavar=("TREE", "OUT", "CACHE", "CONFIG"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_merge(*args.run)
+        return 0
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="binding-resume-")
+    os.makedirs(work_dir, exist_ok=True)
+    print(f"Создаю дерево: {args.files} файлов в Temp ...")
+    tree = make_tree(os.path.join(work_dir, "tree"), 1, loose_files=args.files)
+    with open(os.path.join(work_dir, "tree.json"), 'w', encoding='utf-8') as f:
+        json.dump(tree, f)
+    config_path = os.path.join(work_dir, "config.json")
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump({"parallel_min_files": 2, "checkpoint_files": args.checkpoint_files,
+                   "workers": args.workers}, f)
+    total_shards = (args.files + args.checkpoint_files - 1) // args.checkpoint_files
+
+    with contextlib.ExitStack() as stack:
+        started = time.perf_counter()
+        process, reference_dir, log = start_merge(work_dir, "reference", "reference",
+                                                  os.path.join(work_dir, "Cache-ref"), config_path)
+        stack.callback(log.close)
+        process.wait()
+        reference_seconds = time.perf_counter() - started
+
+        cache_dir = os.path.join(work_dir, "Cache")
+        process, _, log = start_merge(work_dir, "interrupted", "out", cache_dir, config_path)
+        stack.callback(log.close)
+        while process.poll() is None and count_shards(cache_dir) == 0:
+            time.sleep(0.01)
+        if process.poll() is None:
+            os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+        shards_at_kill = count_shards(cache_dir)
+
+        started = time.perf_counter()
+        process, resumed_dir, log = start_merge(work_dir, "resumed", "out", cache_dir, config_path)
+        stack.callback(log.close)
+        process.wait()
+        resumed_seconds = time.perf_counter() - started
+
+    with open(os.path.join(work_dir, "resumed.log"), 'r', encoding='utf-8') as f:
+        resumed_log = f.read()
+    reference = collect_outputs(reference_dir)
+    resumed = collect_outputs(resumed_dir)
+    same_pages = len(reference) == len(resumed) == 1 and list(reference.values()) == list(resumed.values())
+    resumed_from_checkpoint = "Продолжаю прерванную склейку" in resumed_log
+    leftovers = count_shards(cache_dir)
+
+    print(f"Частей всего: {total_shards}, готово к моменту сбоя: {shards_at_kill}")
+    print(f"Без сбоя: {reference_seconds:.2f} с, повторный запуск после сбоя: {resumed_seconds:.2f} с")
+    print(f"Страницы совпадают с эталоном: {'да' if same_pages else 'НЕТ'}")
+    print(f"Готовые части использованы: {'да' if resumed_from_checkpoint else 'НЕТ'}")
+    print(f"Частей осталось после успешной склейки: {leftovers}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"files": args.files, "checkpoint_files": args.checkpoint_files, "workers": args.workers,
+                       "total_shards": total_shards, "shards_at_kill": shards_at_kill,
+                       "reference_seconds": reference_seconds, "resumed_seconds": resumed_seconds,
+                       "same_pages": same_pages, "resumed_from_checkpoint": resumed_from_checkpoint,
+                       "leftover_shards": leftovers}, f, ensure_ascii=False, indent=4)
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if not same_pages or not resumed_from_checkpoint or leftovers:
+        BindingPDF.print_error("Продолжение прерванной склейки работает неверно.")
+        return 1
+    print("✅ Прерванная склейка продолжена с контрольной точки, результат совпадает с эталоном.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Генератор синтетического дерева отгрузок для замеров.
+
+Запуск:
+    python benchmarks/make_tree.py <папка> [--folders 1000] [--pages 1-3] [--size-kb 0] [--seed 1]
+
+Создает:
+    Shipments/<N> Shipment/GTD_<код>_<дата>_<номер>.pdf  - декларация
+    Shipments/<N> Shipment/<код>-<дата>-<номер>-ESD-1.pdf - ЭСД (четыре дефиса в имени)
+    Shipments/<N> Shipment/Invoice <M>.pdf                - инвойс
+    Sorting sheet.xlsx                                    - лист TOTAL: B - дата выпуска, C - номер ДТ
+    Railway/RW <N>.pdf, Temp/<N>,Doc.pdf                  - для сценариев Railway и Temp
+Даты выпуска перемешаны, поэтому порядок сценария 3 не совпадает с порядком папок.
+--size-kb добавляет на каждую страницу картинку из случайных байт (не сжимается),
+чтобы файлы были нужного размера, как отсканированные документы.
+"""
+import os
+import sys
+import zlib
+import random
+import argparse
+from datetime import date, timedelta
+
+GTD_CODE = "10702070"
+FIRST_RELEASE_DATE = date(2026, 1, 10)
+
+
+def make_pdf(path, pages, label, image_bytes=0, rng=None):
+    """Пишет простой PDF: на каждой странице строка текста и (если image_bytes > 0) картинка-заполнитель."""
+    objects = []
+
+    def add(data):
+        objects.append(data)
+        return len(objects)
+
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = len(objects) + 1
+    objects.append(None)  # Место для корня дерева страниц
+    kids = []
+    for page_number in range(1, pages + 1):
+        resources = b"/Font << /F1 %d 0 R >>" % font_id
+        drawing = b""
+        if image_bytes:
+            width = 256
+            height = max(1, image_bytes // width)
+            pixels = (rng or random).randbytes(width * height)
+            image_id = add(b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray "
+                           b"/BitsPerComponent 8 /Length %d >>\nstream\n" % (width, height, len(pixels))
+                           + pixels + b"\nendstream")
+            resources += b" /XObject << /Im1 %d 0 R >>" % image_id
+            drawing = b"q 468 0 0 500 72 150 cm /Im1 Do Q "
+        content = zlib.compress(drawing + f"BT /F1 24 Tf 72 700 Td ({label} p{page_number}) Tj ET".encode("latin-1"))
+        content_id = add(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(content) + content + b"\nendstream")
+        kids.append(add(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+                        b"/Resources << %s >> >>" % (pages_id, content_id, resources)))
+    objects[pages_id - 1] = (b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % kid for kid in kids)
+                             + b"] /Count %d >>" % pages)
+    root_id = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, data in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + data + b"\nendobj\n"
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, root_id, xref_offset)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f_out:
+        f_out.write(out)
+
+
+def parse_pages(text):
+    """"2" -> (2, 2), "1-3" -> (1, 3)."""
+    low, _, high = text.partition("-")
+    return int(low), int(high or low)
+
+
+def make_tree(root, folders, first_folder=1000, pages=(1, 3), size_kb=0, loose_files=None, seed=1):
+    """
+    Создает дерево отгрузок из folders папок, начиная с номера first_folder, и Sorting sheet.xlsx.
+    loose_files - сколько файлов положить в Railway и Temp (по умолчанию столько же, сколько папок).
+    Возвращает словарь с путями и параметрами дерева.
+    """
+    from openpyxl import Workbook
+
+    rng = random.Random(seed)
+    image_bytes = size_kb * 1024
+    shipments_dir = os.path.join(root, "Shipments")
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("TOTAL")
+    sheet.append(["№", "Дата выпуска", "Номер ДТ"])
+
+    for folder in range(first_folder, first_folder + folders):
+        folder_dir = os.path.join(shipments_dir, f"{folder} Shipment")
+        release_date = FIRST_RELEASE_DATE + timedelta(days=rng.randrange(120))
+        date_code = release_date.strftime("%d%m%y")
+        gtd_number = 5000000 + folder
+        make_pdf(os.path.join(folder_dir, f"GTD_{GTD_CODE}_{date_code}_{gtd_number}.pdf"),
+                 rng.randint(*pages), f"GTD {folder}", image_bytes, rng)
+        make_pdf(os.path.join(folder_dir, f"{GTD_CODE}-{date_code}-{gtd_number}-ESD-1.pdf"),
+                 rng.randint(*pages), f"ESD {folder}", image_bytes, rng)
+        make_pdf(os.path.join(folder_dir, f"Invoice {folder + 100000}.pdf"),
+                 rng.randint(*pages), f"Invoice {folder}", image_bytes, rng)
+        sheet.append([folder, release_date, f"{GTD_CODE}/{date_code}/{gtd_number}"])
+    workbook.save(os.path.join(root, "Sorting sheet.xlsx"))
+
+    loose_files = folders if loose_files is None else loose_files
+    for number in range(1, loose_files + 1):
+        make_pdf(os.path.join(root, "Railway", f"RW {number}.pdf"), 1, f"Railway {number}", image_bytes, rng)
+        make_pdf(os.path.join(root, "Temp", f"{number},Doc.pdf"), rng.randint(*pages), f"Temp {number}",
+                 image_bytes, rng)
+
+    return {
+        "root": os.path.abspath(root),
+        "shipments": os.path.abspath(shipments_dir),
+        "sorting_sheet": os.path.abspath(os.path.join(root, "Sorting sheet.xlsx")),
+        "railway": os.path.abspath(os.path.join(root, "Railway")),
+        "temp": os.path.abspath(os.path.join(root, "Temp")),
+        "folders": list(range(first_folder, first_folder + folders)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтетическое дерево отгрузок для замеров")
+    parser.add_argument("root", help="куда создать дерево")
+    parser.add_argument("--folders", type=int, default=100, help="число папок отгрузок")
+    parser.add_argument("--first-folder", type=int, default=1000, help="номер первой папки")
+    parser.add_argument("--pages", default="1-3", help="страниц в файле: число или диапазон (1-3)")
+    parser.add_argument("--size-kb", type=int, default=0, help="добавить на каждую страницу N КБ картинки")
+    parser.add_argument("--loose-files", type=int, help="файлов в Railway и Temp (по умолчанию = --folders)")
+    parser.add_argument("--seed", type=int, default=1, help="зерно генератора случайных чисел")
+    args = parser.parse_args()
+
+    if os.path.exists(args.root) and os.listdir(args.root):
+        print(f"❗️ Папка {args.root} не пуста.")
+        return 1
+    make_tree(args.root, args.folders, args.first_folder, parse_pages(args.pages), args.size_kb,
+              args.loose_files, args.seed)
+    print(f"✅ Дерево создано: {args.root}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())